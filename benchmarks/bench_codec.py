@@ -0,0 +1,38 @@
+"""Compares the wire codec against pickle: bytes per value and encode/decode time.
+
+Run from the repository root: python benchmarks/bench_codec.py
+"""
+from sys import (path as sys_path)
+from os import (path, urandom)
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from time import (time)
+from pickle import (dumps as pickle_dumps, loads as pickle_loads)
+from timeit import (timeit)
+from peerconn_models import (PeerData, Message, MessageTypes, FileData, ManifestEntry, FileResume, PeerPacket)
+from peerconn_codec import (encode, decode)
+
+ROUNDS:     int = 20000
+
+def bench(name: str, value, rounds: int = ROUNDS) -> None:
+    pickled = pickle_dumps(value)
+    encoded = encode(value)
+    assert encode(decode(encoded)) == encoded
+    pickle_encode = timeit(lambda: pickle_dumps(value), number= rounds) / rounds * 1e6
+    pickle_decode = timeit(lambda: pickle_loads(pickled), number= rounds) / rounds * 1e6
+    codec_encode = timeit(lambda: encode(value), number= rounds) / rounds * 1e6
+    codec_decode = timeit(lambda: decode(encoded), number= rounds) / rounds * 1e6
+    print(f'{name:<16} pickle {len(pickled):>7} B {pickle_encode:>8.1f} / {pickle_decode:>8.1f} us   '
+          f'codec {len(encoded):>7} B {codec_encode:>8.1f} / {codec_decode:>8.1f} us')
+
+if __name__ == '__main__':
+    sender = PeerData(name= 'workstation-01', local_address= '192.168.1.20', msg_port= 50001, file_port= 50002)
+    message = Message(sender.name, 'Build 1432 is on the share, can you check it?', time(), MessageTypes.ME)
+    print(f'{"":<16} {"size":>16} {"encode / decode":>20}')
+    bench('chat message', PeerPacket(sender= sender, target= ('192.168.1.21', 50001), message= message))
+    bench('file header', FileData(name= 'build-1432', extension= '.zip', size= 734003200, cipher= 'aes-256-gcm',
+                                  nonce_prefix= urandom(8), transfer_id= urandom(32).hex(), compression= 'zlib'))
+    bench('resume reply', FileResume(transfer_id= urandom(32).hex(), offset= 1048576))
+    bench('1000 file manifest', FileData(name= 'logs', extension= '', size= 1000 * 4096, cipher= 'aes-256-gcm', nonce_prefix= urandom(8),
+                                         manifest= [ManifestEntry(f'logs/day-{index // 100}/service-{index}.log', 4096, urandom(32).hex()) for index in range(1000)]),
+          rounds= 200)
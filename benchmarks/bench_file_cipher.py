@@ -0,0 +1,34 @@
+"""Compares the file channel cipher modes against the old per-chunk Fernet path.
+
+Run from the repository root: python benchmarks/bench_file_cipher.py
+"""
+from sys import (path as sys_path)
+from os import (path, urandom)
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from time import (perf_counter)
+from cryptography.fernet import (Fernet)
+from peerconn_crypto import (CipherModes, ChunkCipher, derive_file_key, new_nonce_prefix)
+
+TOTAL_SIZE:     int = 64 * 1024 * 1024
+CHUNK_SIZES:    list = [2 * 1024, 64 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+def bench(name: str, cipher, chunk_size: int) -> None:
+    chunk = urandom(chunk_size)
+    rounds = max(1, TOTAL_SIZE // chunk_size)
+    wire_size = 0
+    started = perf_counter()
+    for _ in range(rounds):
+        wire_size += len(cipher.encrypt(chunk))
+    elapsed = perf_counter() - started
+    plain_size = rounds * chunk_size
+    print(f'{name:<20} {chunk_size // 1024:>6} KiB  {plain_size / elapsed / (1024 * 1024):>9.1f} MiB/s  overhead {100 * (wire_size - plain_size) / plain_size:>6.2f}%')
+
+if __name__ == '__main__':
+    key = Fernet.generate_key() + Fernet.generate_key()
+    fernet = Fernet(key)
+    file_key = derive_file_key(key)
+    for chunk_size in CHUNK_SIZES:
+        bench(CipherModes.FERNET, fernet, chunk_size)
+        bench(CipherModes.AES_GCM, ChunkCipher(CipherModes.AES_GCM, file_key, new_nonce_prefix()), chunk_size)
+        bench(CipherModes.CHACHA20_POLY1305, ChunkCipher(CipherModes.CHACHA20_POLY1305, file_key, new_nonce_prefix()), chunk_size)
@@ -0,0 +1,49 @@
+"""Measures the memory a chat history takes per message, before and after the slotted Message.
+
+Run from the repository root: python benchmarks/bench_history_memory.py [message count]
+"""
+from sys import (path as sys_path, argv)
+from os import (path)
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from dataclasses import (dataclass)
+from datetime import (datetime)
+from time import (time)
+from tracemalloc import (start, stop, take_snapshot)
+from peerconn_models import (Message, MessageTypes)
+
+MESSAGE_COUNT:  int = 1000000
+SENDERS:        list = ['workstation-01', 'laptop-ayse', 'build-server']
+NOTIFICATIONS:  list = ['Connected to message socket!', 'Message can\'t be send!', 'No connection!']
+
+# Message as it was: a __dict__ per instance, a datetime per message and the sender string of every decoded packet
+@dataclass
+class LegacyMessage:
+    sender:         str | None = 'sender'
+    content:        str | None = 'message_content'
+    date_time: datetime | None = None
+    type:           int | None = None
+
+def legacy_message(index: int) -> LegacyMessage:
+    if index % 4 == 0:
+        return LegacyMessage('PeerConn', NOTIFICATIONS[index % 3], datetime.now(), 2)
+    # A new string each time, like the sender name decoded from a received packet
+    return LegacyMessage(SENDERS[index % 3].encode().decode(), f'status update {index}', datetime.now(), 1)
+
+def slotted_message(index: int) -> Message:
+    if index % 4 == 0:
+        return Message('PeerConn', NOTIFICATIONS[index % 3], time(), MessageTypes.CONNECTION_ESTABLISHED)
+    return Message(SENDERS[index % 3].encode().decode(), f'status update {index}', time(), MessageTypes.PEER)
+
+def measure(name: str, factory, count: int) -> None:
+    start()
+    history = [factory(index) for index in range(count)]
+    used = sum(stat.size for stat in take_snapshot().statistics('filename'))
+    stop()
+    print(f'{name:<10} {used / (1024 * 1024):>8.1f} MiB  {used / len(history):>6.1f} bytes per message')
+
+if __name__ == '__main__':
+    count = int(argv[1]) if len(argv) > 1 else MESSAGE_COUNT
+    print(f'{count} messages, one in four a system notification')
+    measure('legacy', legacy_message, count)
+    measure('slotted', slotted_message, count)
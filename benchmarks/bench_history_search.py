@@ -0,0 +1,46 @@
+"""Times searches over a history database of a million messages spread across peersockets.
+
+Run from the repository root: python benchmarks/bench_history_search.py [message count]
+"""
+from sys import (path as sys_path, argv)
+from os import (path, remove, close as close_fd)
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from random import (Random)
+from tempfile import (mkstemp)
+from time import (perf_counter, time)
+from timeit import (timeit)
+from peerconn_models import (Message, MessageTypes)
+from peerconn_history import (HistoryDatabase, MessageStore)
+
+MESSAGE_COUNT:  int = 1000000
+PEERSOCKETS:    int = 20
+WORDS:          list = ['build', 'deploy', 'review', 'coffee', 'lunch', 'server', 'backup', 'ticket', 'release', 'meeting',
+                        'invoice', 'screenshot', 'logs', 'crash', 'patch', 'router', 'printer', 'vpn', 'password', 'holiday']
+
+def bench(name: str, search, rounds: int = 200) -> None:
+    hits = len(search())
+    print(f'{name:<34} {timeit(search, number= rounds) / rounds * 1e3:>8.3f} ms  {hits:>4} hits')
+
+if __name__ == '__main__':
+    count = int(argv[1]) if len(argv) > 1 else MESSAGE_COUNT
+    random = Random(1432)
+    database_fd, database_path = mkstemp(suffix= '.sqlite3')
+    close_fd(database_fd)
+    database = HistoryDatabase(database_path)
+    stores = [MessageStore(database, f'peersocket-{index}') for index in range(PEERSOCKETS)]
+    started = time() - count
+    filled = perf_counter()
+    for index in range(count):
+        text = ' '.join(random.choices(WORDS, k= 6)) + f' #{index}'
+        stores[index % PEERSOCKETS].append(Message(f'peer-{index % PEERSOCKETS}', text, started + index, MessageTypes.PEER))
+    for store in stores:
+        store.flush()
+    print(f'{count} messages appended and indexed in {perf_counter() - filled:.1f}s, full text = {database.full_text}')
+    bench('one word', lambda: database.search('screenshot'))
+    bench('two words', lambda: database.search('printer vpn'))
+    bench('rare token', lambda: database.search(f'#{count // 2}'))
+    bench('word in one peersocket', lambda: database.search('holiday', history_ids= ['peersocket-3']))
+    bench('word by sender in the last hour', lambda: database.search('crash', sender= 'peer-5', since= started + count - 3600))
+    database.close()
+    remove(database_path)
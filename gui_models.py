@@ -0,0 +1,90 @@
+from PyQt5.QtCore import (Qt, QAbstractListModel, QModelIndex)
+from PyQt5.QtGui import (QBrush, QColor, QPalette)
+from PyQt5.QtWidgets import (QStyledItemDelegate, QStyleOptionViewItem)
+from peerconn import (History, MessageTypes)
+from peerconn_history import (PAGE_SIZE)
+from typing import (Any, Dict, Tuple)
+
+class ChatListModel(QAbstractListModel):
+    """Messages of one peersocket's History, read from its MessageStore only for the rows a view asks for.
+    A view lays out every row it is given, so the model opens a history with its last window_size messages
+    and load_older() prepends earlier ones a page at a time; switching histories costs the same however long
+    the chat is. Row counts are snapshots taken on the GUI thread, since PeerConn appends on its own thread."""
+    MessageTypeRole: int = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, window_size: int = 1000) -> None:
+        super().__init__()
+        self.window_size = window_size
+        self._history: History | None = None
+        self._first = 0     # History index of the first row
+        self._rows = 0
+
+    def set_history(self, history: History | None) -> None:
+        self.beginResetModel()
+        self._history = history
+        count = len(history.messages) if history != None else 0
+        self._first = max(0, count - self.window_size)
+        self._rows = count - self._first
+        self.endResetModel()
+
+    def refresh(self) -> int:
+        """Shows the messages appended since the last call, returns how many."""
+        if self._history == None:
+            return 0
+        rows = len(self._history.messages) - self._first
+        if rows <= self._rows:
+            return 0
+        self.beginInsertRows(QModelIndex(), self._rows, rows - 1)
+        added = rows - self._rows
+        self._rows = rows
+        self.endInsertRows()
+        return added
+
+    def load_older(self, count: int = PAGE_SIZE) -> int:
+        """Prepends up to count earlier messages, returns how many."""
+        added = min(count, self._first)
+        if added > 0:
+            self.beginInsertRows(QModelIndex(), 0, added - 1)
+            self._first -= added
+            self._rows += added
+            self.endInsertRows()
+        return added
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._rows
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if (not index.isValid() or self._history == None or
+            role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole, self.MessageTypeRole)):
+            return None
+        try:
+            msg = self._history.messages[self._first + index.row()]
+        except IndexError: # The history was cleared before the view caught up
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return msg.content
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            date_time = msg.date_time
+            return f'{date_time.day}/{date_time.month}/{date_time.year}, {date_time.hour}:{date_time.minute}, {msg.sender}'
+        return msg.type
+
+class ChatItemDelegate(QStyledItemDelegate):
+    """Colours and aligns a chat row by its message type while it is painted, so the model stores no formatting."""
+    STYLES: Dict[int, Tuple[Qt.AlignmentFlag, QColor, QColor]] = {   # Message type -> alignment, background, foreground
+        MessageTypes.CONNECTION_ESTABLISHED: (Qt.AlignmentFlag.AlignCenter, QColor(40, 160, 40), QColor(255, 255, 255)),
+        MessageTypes.CONNECTION_LOST: (Qt.AlignmentFlag.AlignCenter, QColor(160, 40, 40), QColor(255, 255, 255)),
+        MessageTypes.ME: (Qt.AlignmentFlag.AlignJustify | Qt.AlignmentFlag.AlignRight, QColor(130, 150, 220), QColor(0, 0, 0)),
+        MessageTypes.PEER: (Qt.AlignmentFlag.AlignJustify, QColor(80, 100, 170), QColor(255, 255, 255)),
+        MessageTypes.FILE_NOTIFY_0: (Qt.AlignmentFlag.AlignCenter, QColor(255, 145, 0), QColor(0, 0, 0)),
+        MessageTypes.FILE_NOTIFY_1: (Qt.AlignmentFlag.AlignCenter, QColor(180, 100, 0), QColor(255, 255, 255)),
+        MessageTypes.SYSTEM_WARN: (Qt.AlignmentFlag.AlignCenter, QColor(100, 0, 250), QColor(255, 255, 255)),
+    }
+
+    def initStyleOption(self, option: QStyleOptionViewItem, index: QModelIndex) -> None:
+        super().initStyleOption(option, index)
+        style = self.STYLES.get(index.data(ChatListModel.MessageTypeRole))
+        if style != None:
+            alignment, background, foreground = style
+            option.displayAlignment = alignment
+            option.backgroundBrush = QBrush(background)
+            option.palette.setColor(QPalette.ColorRole.Text, foreground)
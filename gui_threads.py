@@ -1,6 +1,10 @@
-from PyQt5.QtCore import (QThread, pyqtSignal)
+from PyQt5.QtCore import (Qt, QObject, QThread, pyqtSignal)
 from peerconn import PeerConn
+from peerconn_events import (PeerConnEvents)
 from asyncio import run as async_run
+from concurrent.futures import (Future)
+from threading import (Lock)
+from typing import (Callable, Dict, Tuple)
 
 class PeerConnThread(QThread):
     peerconn_ref: PeerConn | None
@@ -12,4 +16,61 @@ class PeerConnThread(QThread):
 
     def run(self) -> None:
         async_run(self.peerconn_ref.thread_main())
-        self.terminate_thread.emit()
\ No newline at end of file
+        self.terminate_thread.emit()
+
+class CommandResultBridge(QObject):
+    """Calls back on the GUI thread once a PeerConn command future is settled.
+    Futures settle on the event loop's thread; the queued signal hops the callback over to this object's thread."""
+    _settled = pyqtSignal(object, object)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._settled.connect(self._call)
+
+    def watch(self, future: Future, callback: Callable[[Future], None]) -> Future:
+        future.add_done_callback(lambda future: self._settled.emit(callback, future))
+        return future
+
+    def _call(self, callback: Callable[[Future], None], future: Future) -> None:
+        callback(future)
+
+
+class PeerConnEventBridge(QObject):
+    """Re-emits PeerConn events as signals on the GUI thread. Events that arrive before the GUI thread gets to them
+    are coalesced per kind and peersocket, so a burst of messages costs one chat update, and an idle PeerConn costs nothing."""
+    socket_state_changed = pyqtSignal(str)
+    messages_added = pyqtSignal(str)
+    file_progressed = pyqtSignal(str)
+    link_changed = pyqtSignal(str)
+    _wake = pyqtSignal()
+
+    def __init__(self, peerconn_ref: PeerConn) -> None:
+        super().__init__()
+        self.peerconn_ref = peerconn_ref
+        self._signals = {
+            PeerConnEvents.SOCKET_STATE: self.socket_state_changed,
+            PeerConnEvents.NEW_MESSAGES: self.messages_added,
+            PeerConnEvents.FILE_PROGRESS: self.file_progressed,
+            PeerConnEvents.LINK_STATS: self.link_changed,
+        }
+        self._pending: Dict[Tuple[int, str], None] = {}    # Used as an ordered set of (event, peersocket id)
+        self._lock = Lock()
+        self._wake.connect(self._deliver, Qt.ConnectionType.QueuedConnection)
+        peerconn_ref.subscribe(self._on_event)
+
+    def _on_event(self, event: int, peersocket_id: str) -> None:
+        with self._lock:
+            wake = not self._pending
+            self._pending[(event, peersocket_id)] = None
+        if wake: # Only the first event since the last delivery posts to the GUI thread
+            self._wake.emit()
+
+    def _deliver(self) -> None:
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        for event, peersocket_id in pending:
+            self._signals[event].emit(peersocket_id)
+
+    def close(self) -> None:
+        self.peerconn_ref.unsubscribe(self._on_event)
@@ -1,15 +1,18 @@
 from gui import (Ui_MainWindow)
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QMenu, QAction, QDialog, QLineEdit, QMessageBox, QFileDialog)
-from PyQt5.QtCore import (Qt, QPoint, QTimer)
-from PyQt5.QtGui import (QColor, QIcon, QStandardItemModel, QStandardItem)
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QMenu, QAction, QDialog, QLineEdit, QListView, QMessageBox, QFileDialog)
+from PyQt5.QtCore import (Qt, QPoint)
+from PyQt5.QtGui import (QIcon, QStandardItemModel, QStandardItem)
 from sys import (argv as sys_argv, exit as sys_exit)
-from peerconn import (PeerConn, PeerData, MessageTypes)
-from time import (sleep)
+from peerconn import (PeerConn, PeerData)
+from concurrent.futures import (Future, TimeoutError as FutureTimeoutError)
 from os import (path)
 from functools import (partial)
+from typing import (Callable)
 from gui_dialogs import (DialogChangeConfigs, DialogEditConnectionItem, DialogConnect, DialogListen)
-from gui_threads import (PeerConnThread)
+from gui_threads import (PeerConnThread, CommandResultBridge, PeerConnEventBridge)
+from gui_models import (ChatListModel, ChatItemDelegate)
 from os import (path, makedirs)
+from multiprocessing import (freeze_support)
 
 class PeerConnGUI:
     # Main Window Constants
@@ -17,17 +20,16 @@ class PeerConnGUI:
     # Properties
     _peerconn:                        PeerConn | None = None
     _peerconn_thread:           PeerConnThread | None = None
+    _command_bridge:       CommandResultBridge | None = None
+    _event_bridge:         PeerConnEventBridge | None = None
     _app:                         QApplication | None = None
     _ui:                         Ui_MainWindow | None = None
     _main_window:                  QMainWindow | None = None
     _dialog:                           QDialog | None = None
-    _qtimer_update_ui:                  QTimer | None = None
     ICON_FOLDER:                           str | None = None
     # QListView Models
     _model_socket_list: QStandardItemModel | None = None
-    _model_chat: QStandardItemModel | None = None
-    # Flags
-    _update_chat: bool = False
+    _model_chat: ChatListModel | None = None
     # Icons Names
     icon_client_active:     QIcon | None = None
     icon_client_inactive:   QIcon | None = None
@@ -39,12 +41,15 @@ class PeerConnGUI:
     def __init__(self) -> None:
         self._peerconn = PeerConn()
         self._app = QApplication(sys_argv)
+        self._command_bridge = CommandResultBridge()
+        self._event_bridge = PeerConnEventBridge(self._peerconn) # Subscribed before the loop starts, so no event is missed
         self._peerconn_thread = PeerConnThread(self._peerconn)
         self._peerconn_thread.start()
-        self._qtimer_update_ui = QTimer()
-        self._qtimer_update_ui.timeout.connect(self.update_ui)
-        self._qtimer_update_ui.start(250)
         self.set_ui()
+        self._event_bridge.socket_state_changed.connect(self.on_socket_state_changed)
+        self._event_bridge.messages_added.connect(self.on_messages_added)
+        self._event_bridge.file_progressed.connect(self.on_file_progressed)
+        self._event_bridge.link_changed.connect(self.on_link_changed)
         self._peerconn._logger.info(f'UI-{PeerConnGUI.__name__}: Initialized.')
 
     def set_ui(self) -> None:
@@ -96,6 +101,7 @@ class PeerConnGUI:
         self._ui.pushButton_guide_back.clicked.connect(lambda:self._ui.stackedWidget.setCurrentIndex(0))
         self._ui.pushButton_file.clicked.connect(partial(self.pick_file, self._ui.lineEdit_file_path))
         self._ui.pushButton_file.setEnabled(False)
+        self._ui.lineEdit_file_path.textChanged.connect(self.update_file_controls)
         self._peerconn._logger.info(f'UI-{self.set_buttons.__name__}: Set.')
 
     def send_message(self) -> None:
@@ -106,7 +112,6 @@ class PeerConnGUI:
                 peersocket_id = selected_item.data(Qt.ItemDataRole.UserRole + 1)
                 my_message = self._ui.lineEdit_message.text()
                 self._peerconn.send_message(peersocket_id, my_message)
-                self._update_chat = True
                 self._ui.lineEdit_message.clear()
 
     def send_file(self) -> None:
@@ -115,9 +120,11 @@ class PeerConnGUI:
             selected_item = self._model_socket_list.itemFromIndex(index)
             if selected_item:
                 peersocket_id = selected_item.data(Qt.ItemDataRole.UserRole + 1)
-                file_path = self._ui.lineEdit_file_path.text()
-                self._peerconn.send_file(peersocket_id, file_path)
-                self._update_chat = True
+                file_paths = self._ui.lineEdit_file_path.text().split(path.pathsep)
+                if len(file_paths) > 1:
+                    self._peerconn.send_files(peersocket_id, file_paths)
+                else:
+                    self._peerconn.send_file(peersocket_id, file_paths[0])
                 self._ui.lineEdit_file_path.clear()
         else:
             message_box = QMessageBox()
@@ -133,9 +140,9 @@ class PeerConnGUI:
     def pick_file(self, line_edit: QLineEdit):
         options = QFileDialog.Options()
         options |= QFileDialog.Option.ReadOnly
-        file_path, _ = QFileDialog.getOpenFileName(self._main_window, "Select File", "", "All Files (*)", options= options)
-        if file_path:
-            line_edit.setText(file_path)
+        file_paths, _ = QFileDialog.getOpenFileNames(self._main_window, "Select Files", "", "All Files (*)", options= options)
+        if file_paths:
+            line_edit.setText(path.pathsep.join(file_paths))
 
     def show_listen_dialog(self) -> None:
         try:
@@ -150,7 +157,7 @@ class PeerConnGUI:
                     peerdata = PeerData(display_name, local_address, msg_port, file_port)
                     id = self._peerconn.create_peer_socket()
                     self._peerconn.set_peersocket(id, peerdata)
-                    self._peerconn.set_server(id)
+                    self._command_bridge.watch(self._peerconn.set_server(id), partial(self.on_socket_opened, id))
                     item = QStandardItem(peerdata.name)
                     item.setToolTip(f'Address: {peerdata.local_address}\nMessage Port: {peerdata.msg_port}\nFile Port: {peerdata.file_port}')
                     item.setIcon(self.icon_server_waiting)
@@ -179,7 +186,7 @@ class PeerConnGUI:
                     peerdata = PeerData(display_name, local_address, msg_port, file_port)
                     id = self._peerconn.create_peer_socket()
                     self._peerconn.set_peersocket(id, peerdata)
-                    self._peerconn.connect(id)
+                    self._command_bridge.watch(self._peerconn.connect(id), partial(self.on_socket_opened, id))
                     item = QStandardItem(peerdata.name)
                     item.setIcon(self.icon_client_waiting)
                     item.setData(id, Qt.ItemDataRole.UserRole + 1)
@@ -235,13 +242,11 @@ class PeerConnGUI:
                     message_box.addButton(QMessageBox.StandardButton.Ok)
                     message_box.addButton(QMessageBox.StandardButton.Cancel)
                     if message_box.exec_() == QMessageBox.StandardButton.Ok:
-                        self._qtimer_update_ui.stop()
                         self._peerconn.close_all()
                         self._peerconn._peerdata.name = self._dialog.QLineEdit_display_name.text()
                         self._peerconn._peerdata.local_address = self._dialog.QLineEdit_local_address.text()
                         self._model_socket_list.clear()
-                        self._model_chat.clear()
-                        self._qtimer_update_ui.start(50)
+                        self._model_chat.set_history(None)
                 elif not self._peerconn.is_valid_ipv4(ip= self._dialog.QLineEdit_local_address.text()):
                     message_box = QMessageBox()
                     message_box.setWindowTitle('Wrong IPv4')
@@ -270,9 +275,16 @@ class PeerConnGUI:
         self._ui.listView_sockets.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self._ui.listView_sockets.customContextMenuRequested.connect(self.context_menu_active_connections)
         self._ui.listView_sockets.selectionModel().currentChanged.connect(self.on_connection_selection)
+        self._model_socket_list.rowsInserted.connect(self.on_socket_list_changed)
+        self._model_socket_list.rowsRemoved.connect(self.on_socket_list_changed)
+        self._model_socket_list.modelReset.connect(self.on_socket_list_changed)
 
-        self._model_chat = QStandardItemModel()
+        self._model_chat = ChatListModel()
         self._ui.listView_chat.setModel(self._model_chat)
+        self._ui.listView_chat.setItemDelegate(ChatItemDelegate(self._ui.listView_chat))
+        self._ui.listView_chat.setUniformItemSizes(True) # Otherwise the view asks every row for its size hint
+        self._ui.listView_chat.setVerticalScrollMode(QListView.ScrollMode.ScrollPerItem)
+        self._ui.listView_chat.verticalScrollBar().valueChanged.connect(self.on_chat_scrolled)
         self._ui.listView_chat.setAutoScroll(True)
         self._peerconn._logger.info(f'UI-{self.set_QListViews.__name__}: Initialized')
 
@@ -298,12 +310,10 @@ class PeerConnGUI:
                 self._peerconn.close(item_id)
                 self._peerconn._logger.info(f'UI-{self.context_menu_active_connections.__name__}: {peersocket_ref.id} - Connection closed!')
             elif action == remove_action:
-                i = item.row()
-                self._peerconn.close(item_id)
-                sleep(0.1) # Wait for disconnecting from peersocket
-                self._peerconn._peersockets.remove(self._peerconn._peersockets[i])
-                self._model_socket_list.removeRow(i)
-                self._peerconn._logger.info(f'UI-{self.context_menu_active_connections.__name__}: {peersocket_ref.id} - Connection removed!')
+                with self._peerconn.batch():
+                    self._peerconn.close(item_id)
+                    removed = self._peerconn.remove(item_id) # Runs after the close, on the event loop
+                self._command_bridge.watch(removed, partial(self.on_socket_removed, item_id))
             elif action == save_chat_action:
                 saved_chat_path = path.abspath(path.dirname(sys_argv[0]))
                 saved_chat_path = path.join(saved_chat_path, 'saved_chats')
@@ -314,129 +324,153 @@ class PeerConnGUI:
                         chat_text.write(f'{message.date_time}, {message.type}, {message.sender} : {message.content}\n')
                     self._peerconn._logger.info(f'UI-{self.context_menu_active_connections.__name__}: {peersocket_ref.id} - Chat saved!')
 
-    def update_ui(self) -> None:
-        try:
-            self.update_chat()
-            item_list = self._model_socket_list.findItems('*', Qt.MatchFlag.MatchWildcard)
-            if self._peerconn._peersockets != None:
-                if not self._ui.listView_sockets.selectionModel().hasSelection() and self._ui.listView_sockets.model().rowCount() > 0:
-                    self._ui.listView_sockets.setCurrentIndex(self._ui.listView_sockets.model().index(0, 0))
-                    self._ui.listView_chat.setEnabled(True)
-                    self._ui.lineEdit_message.setEnabled(True)
-                    self._ui.lineEdit_file_path.setEnabled(True)
-                    self._ui.pushButton_send_message.setEnabled(True)
-                    self._ui.pushButton_file.setEnabled(True)
-                elif self._ui.listView_sockets.selectionModel().hasSelection() == False:
-                    self._ui.listView_chat.setEnabled(False)
-                    self._ui.lineEdit_message.setEnabled(False)
-                    self._ui.lineEdit_file_path.setEnabled(False)
-                    self._ui.pushButton_send_message.setEnabled(False)
-                    self._ui.pushButton_file.setEnabled(False)
-
-                for i in range(0, len(self._peerconn._peersockets)):
-                    peersocket_ref = self._peerconn._peersockets[i]
-
-                    if peersocket_ref.servers: # Check if socket is server
-                        if (peersocket_ref.msg_comm_connected and
-                            peersocket_ref.file_comm_connected):
-                            item_list[i].setIcon(self.icon_server_active)
-                            
-                        elif (not peersocket_ref.servers.msg_server and
-                            not peersocket_ref.servers.file_server and
-                            not peersocket_ref.msg_comm_connected and
-                            not peersocket_ref.file_comm_connected):
-                            item_list[i].setIcon(self.icon_server_inactive)
-
-                    elif not peersocket_ref.servers and peersocket_ref.streams:
-                        
-                        if (peersocket_ref.msg_comm_connected
-                            and peersocket_ref.file_comm_connected):
-                            item_list[i].setIcon(self.icon_client_active)
-                        elif (not peersocket_ref.streams.msg_reader and
-                            not peersocket_ref.streams.msg_writer and
-                            not peersocket_ref.streams.file_reader and
-                            not peersocket_ref.streams.file_writer and
-                            not peersocket_ref.msg_comm_connected and
-                            not peersocket_ref.file_comm_connected):
-                            item_list[i].setIcon(self.icon_client_inactive)
-        except Exception as ex:
-            self._peerconn._logger.error(f'{self.update_ui.__name__}: {ex}')
+    def _socket_item(self, peersocket_id: str) -> QStandardItem | None:
+        for row in range(self._model_socket_list.rowCount()):
+            item = self._model_socket_list.item(row)
+            if item.data(Qt.ItemDataRole.UserRole + 1) == peersocket_id:
+                return item
+        return None
 
-    def on_connection_selection(self) -> None:
-        self._model_chat.clear()
-        self._update_chat = True
+    def on_socket_opened(self, peersocket_id: str, future: Future) -> None:
+        """Result of set_server or connect, called on the GUI thread."""
+        if future.exception() == None and future.result():
+            return
+        item = self._socket_item(peersocket_id)
+        peersocket_ref = self._peerconn.get_socket(peersocket_id)
+        if item != None and peersocket_ref != None:
+            item.setIcon(self.icon_server_inactive if peersocket_ref.servers != None else self.icon_client_inactive)
+        self._peerconn._logger.warning(f'UI-{self.on_socket_opened.__name__}: {peersocket_id} - Couldn\'t open the connection!')
 
-    def update_chat(self) -> None:
+    def on_socket_removed(self, peersocket_id: str, future: Future) -> None:
+        item = self._socket_item(peersocket_id)
+        if item != None:
+            self._model_socket_list.removeRow(item.row())
+        self._peerconn._logger.info(f'UI-{self.on_socket_removed.__name__}: {peersocket_id} - Connection removed!')
+
+    def _selected_socket_id(self) -> str | None:
         index = self._ui.listView_sockets.currentIndex()
         if index.isValid():
             selected_item = self._model_socket_list.itemFromIndex(index)
             if selected_item:
-                peersocket_id = selected_item.data(Qt.ItemDataRole.UserRole + 1)
-                peersocket_ref = self._peerconn.get_socket(peersocket_id)
-                if peersocket_ref != None:
-                    if len(self._ui.lineEdit_file_path.text()) > 0 and peersocket_ref.in_file_transaction == False:
-                        self._ui.pushButton_file.disconnect()
-                        self._ui.pushButton_file.clicked.connect(self.send_file)
-                        self._ui.pushButton_file.setText('Send File')
-                    elif peersocket_ref.in_file_transaction == True:
-                        if peersocket_ref.file_percentage == 0:
-                            self._ui.pushButton_file.disconnect()
-                            self._ui.pushButton_file.clicked.connect(partial(self.cancel_file, peersocket_ref.id))
-                            self._ui.pushButton_file.setText('Abort File')
-                        self._ui.progressBar_file.setHidden(False)
-                        self._ui.progressBar_file.setValue(peersocket_ref.file_percentage)
-                    elif peersocket_ref.in_file_transaction == False and len(self._ui.lineEdit_file_path.text()) == 0:
-                            self._ui.progressBar_file.setHidden(True)
-                            self._ui.progressBar_file.setValue(0)
-                            self._ui.pushButton_file.disconnect()
-                            self._ui.pushButton_file.clicked.connect(partial(self.pick_file, self._ui.lineEdit_file_path))
-                            self._ui.pushButton_file.setText('Pick File')
-                    if peersocket_ref.history.new_messages > 0 or self._update_chat:
-                        for i in range(self._model_chat.rowCount(), len(peersocket_ref.history.messages)):
-                                msg = peersocket_ref.history.messages[i]
-                                msg_item = QStandardItem(f'{msg.content}')
-                                msg_item.setToolTip(f'{msg.date_time.day}/{msg.date_time.month}/{msg.date_time.year}, {msg.date_time.hour}:{msg.date_time.minute}, {msg.sender}')
-                                if msg.type != None:
-                                    if msg.type == MessageTypes.CONNECTION_ESTABLISHED:
-                                        msg_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                        msg_item.setBackground(QColor(40, 160, 40))
-                                        msg_item.setForeground(QColor(255, 255, 255))
-                                    elif msg.type == MessageTypes.CONNECTION_LOST:
-                                        msg_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                        msg_item.setBackground(QColor(160, 40, 40))
-                                        msg_item.setForeground(QColor(255, 255, 255))
-                                    elif msg.type == MessageTypes.ME:
-                                        msg_item.setTextAlignment(Qt.AlignmentFlag.AlignJustify | Qt.AlignmentFlag.AlignRight)
-                                        msg_item.setBackground(QColor(130, 150, 220))
-                                        msg_item.setForeground(QColor(0, 0, 0))
-                                    elif msg.type == MessageTypes.PEER:
-                                        msg_item.setTextAlignment(Qt.AlignmentFlag.AlignJustify)
-                                        msg_item.setBackground(QColor(80, 100, 170))
-                                        msg_item.setForeground(QColor(255, 255, 255))
-                                    elif msg.type == MessageTypes.FILE_NOTIFY_0:
-                                        msg_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                        msg_item.setBackground(QColor(255, 145, 0))
-                                        msg_item.setForeground(QColor(0, 0, 0))
-                                    elif msg.type == MessageTypes.FILE_NOTIFY_1:
-                                        msg_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                        msg_item.setBackground(QColor(180, 100, 0))
-                                        msg_item.setForeground(QColor(255, 255, 255))
-                                    elif msg.type == MessageTypes.SYSTEM_WARN:
-                                        msg_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                        msg_item.setBackground(QColor(100, 0, 250))
-                                        msg_item.setForeground(QColor(255, 255, 255))
-                                self._model_chat.appendRow(msg_item)
-                        last_item_index = self._model_chat.index(self._model_chat.rowCount() - 1, 0)
-                        self._ui.listView_chat.scrollTo(last_item_index)
-                        peersocket_ref.history.new_messages = 0
-                        self._update_chat = False
+                return selected_item.data(Qt.ItemDataRole.UserRole + 1)
+        return None
+
+    def on_socket_list_changed(self) -> None:
+        """Selects the first socket when none is, and enables the chat widgets only while one is selected."""
+        try:
+            if not self._ui.listView_sockets.selectionModel().hasSelection() and self._model_socket_list.rowCount() > 0:
+                self._ui.listView_sockets.setCurrentIndex(self._model_socket_list.index(0, 0))
+            has_selection = self._ui.listView_sockets.selectionModel().hasSelection()
+            self._ui.listView_chat.setEnabled(has_selection)
+            self._ui.lineEdit_message.setEnabled(has_selection)
+            self._ui.lineEdit_file_path.setEnabled(has_selection)
+            self._ui.pushButton_send_message.setEnabled(has_selection)
+            self._ui.pushButton_file.setEnabled(has_selection)
+        except Exception as ex:
+            self._peerconn._logger.error(f'UI-{self.on_socket_list_changed.__name__}: {ex}')
+
+    def on_link_changed(self, peersocket_id: str) -> None:
+        """Shows the smoothed round trip time of a connection in its tooltip."""
+        item = self._socket_item(peersocket_id)
+        peersocket_ref = self._peerconn.get_socket(peersocket_id)
+        if item == None or peersocket_ref == None or peersocket_ref.link == None or peersocket_ref.link.srtt == None:
+            return
+        peerdata, link = peersocket_ref.peerdata, peersocket_ref.link
+        item.setToolTip(f'Address: {peerdata.local_address}\nMessage Port: {peerdata.msg_port}\nFile Port: {peerdata.file_port}\n'
+                        f'Round Trip: {link.srtt * 1000:.1f} ms\nJitter: {link.jitter * 1000:.1f} ms')
+
+    def on_socket_state_changed(self, peersocket_id: str) -> None:
+        item = self._socket_item(peersocket_id)
+        peersocket_ref = self._peerconn.get_socket(peersocket_id)
+        if item == None or peersocket_ref == None:
+            return
+
+        if peersocket_ref.servers: # Check if socket is server
+            if (peersocket_ref.msg_comm_connected and
+                peersocket_ref.file_comm_connected):
+                item.setIcon(self.icon_server_active)
+
+            elif peersocket_ref.servers.msg_server or peersocket_ref.servers.file_server:
+                item.setIcon(self.icon_server_waiting) # Listening, no client left
+
+            elif (not peersocket_ref.msg_comm_connected and
+                not peersocket_ref.file_comm_connected):
+                item.setIcon(self.icon_server_inactive)
+
+        elif not peersocket_ref.servers and peersocket_ref.streams:
+
+            if (peersocket_ref.msg_comm_connected
+                and peersocket_ref.file_comm_connected):
+                item.setIcon(self.icon_client_active)
+            elif (not peersocket_ref.streams.msg_reader and
+                not peersocket_ref.streams.msg_writer and
+                not peersocket_ref.streams.file_reader and
+                not peersocket_ref.streams.file_writer and
+                not peersocket_ref.msg_comm_connected and
+                not peersocket_ref.file_comm_connected):
+                item.setIcon(self.icon_client_inactive)
+
+    def on_messages_added(self, peersocket_id: str) -> None:
+        if peersocket_id == self._selected_socket_id():
+            self.update_chat()
+
+    def on_file_progressed(self, peersocket_id: str) -> None:
+        if peersocket_id == self._selected_socket_id():
+            self.update_file_controls()
+
+    def on_connection_selection(self) -> None:
+        peersocket_ref = self._peerconn.get_socket(self._selected_socket_id())
+        self._model_chat.set_history(peersocket_ref.history if peersocket_ref != None else None)
+        self._ui.listView_chat.scrollToBottom()
+        self.update_file_controls()
+
+    def update_file_controls(self) -> None:
+        peersocket_ref = self._peerconn.get_socket(self._selected_socket_id())
+        if peersocket_ref == None:
+            return
+        if peersocket_ref.in_file_transaction == True:
+            self._set_file_button('Abort File', partial(self.cancel_file, peersocket_ref.id))
+            self._ui.progressBar_file.setHidden(False)
+            self._ui.progressBar_file.setValue(peersocket_ref.file_percentage)
+        elif len(self._ui.lineEdit_file_path.text()) > 0:
+            self._set_file_button('Send File', self.send_file)
+        else:
+            self._ui.progressBar_file.setHidden(True)
+            self._ui.progressBar_file.setValue(0)
+            self._set_file_button('Pick File', partial(self.pick_file, self._ui.lineEdit_file_path))
+
+    def _set_file_button(self, text: str, slot: Callable[[], None]) -> None:
+        self._ui.pushButton_file.disconnect()
+        self._ui.pushButton_file.clicked.connect(slot)
+        self._ui.pushButton_file.setText(text)
+
+    def on_chat_scrolled(self, value: int) -> None:
+        """Loads earlier messages once the chat is scrolled to its top, keeping the same message in view."""
+        scroll_bar = self._ui.listView_chat.verticalScrollBar()
+        if value == scroll_bar.minimum() and scroll_bar.maximum() > 0:
+            added = self._model_chat.load_older()
+            if added > 0:
+                scroll_bar.setValue(value + added) # Scrolling goes per item, so the value counts rows
+
+    def update_chat(self) -> None:
+        """Shows the messages of the selected socket that the chat doesn't show yet."""
+        peersocket_ref = self._peerconn.get_socket(self._selected_socket_id())
+        if peersocket_ref == None:
+            return
+        if self._model_chat.refresh() > 0:
+            self._ui.listView_chat.scrollToBottom()
+        peersocket_ref.history.new_messages = 0
 
     def on_exit(self) -> None:
-        self._qtimer_update_ui.stop()
-        self._peerconn.exit()
-        sleep(0.5)
-        self._peerconn_thread.terminate()
-        sleep(0.5)
+        self._event_bridge.close()
+        try:
+            self._peerconn.exit().result(timeout= 5)
+        except FutureTimeoutError:
+            self._peerconn._logger.warning(f'UI-{self.on_exit.__name__}: PeerConn didn\'t exit in time!')
+        except Exception as ex:
+            self._peerconn._logger.error(f'UI-{self.on_exit.__name__}: {ex}')
+        if not self._peerconn_thread.wait(2000):
+            self._peerconn_thread.terminate()
         self._peerconn._logger.info(f'UI-{self.on_exit.__name__}: Executed.')
     
     def main(self) -> None:
@@ -445,5 +479,6 @@ class PeerConnGUI:
         sys_exit(self._app.exec_())
 
 if __name__ == '__main__':
+    freeze_support() # Needed by the process worker pool in the frozen executable
     peerconn_gui = PeerConnGUI()
     peerconn_gui.main()
\ No newline at end of file
@@ -1,53 +1,131 @@
 from peerconn_models import (StreamReader, StreamWriter, datetime, PeerData,
                     Message, History, Servers, Streams, PeerSocket,
-                    FileData, MessageTypes, Events, PeerPacket)
+                    FileData, MessageTypes, Events, PeerPacket, FrameTypes, TransferStats,
+                    Frame, FileResume, StripeHello, SessionHello, SearchHit, LaneStats, LinkStats)
 from uuid import (uuid4)
-from asyncio import (start_server, open_connection, create_task, get_running_loop, sleep, wait_for, TimeoutError,
-                     CancelledError, IncompleteReadError, Event, Queue)
-from socket import (gethostname, AF_INET)
-from typing import (List, AnyStr)
-from pickle import (dumps as pickle_dumps, loads as pickle_loads)
+from asyncio import (start_server, open_connection, create_task, gather, get_running_loop, wait_for, wait, sleep, TimeoutError,
+                     CancelledError, IncompleteReadError, Event, Queue, Task, FIRST_COMPLETED)
+from socket import (gethostname, AF_INET, SOL_SOCKET, SO_KEEPALIVE, IPPROTO_TCP)
+try:
+    from socket import (TCP_KEEPIDLE, TCP_KEEPINTVL, TCP_KEEPCNT)
+except ImportError:
+    TCP_KEEPIDLE = TCP_KEEPINTVL = TCP_KEEPCNT = None # SO_KEEPALIVE alone, with the OS's timings
+from typing import (Awaitable, Callable, Dict, List, Tuple, AnyStr)
 from logging import (basicConfig, DEBUG as LOGGING_DEBUG, getLogger, Logger)
 from psutil import (net_if_addrs)
-from os import (path, makedirs)
+from os import (path, makedirs, stat, close as close_fd, remove, replace)
 from ipaddress import (ip_address)
 from json import (dump as json_dump, loads as json_loads)
+from time import (perf_counter, time)
+from functools import (partial)
+from collections import (deque)
+from hmac import (compare_digest)
+from random import (uniform)
+from tempfile import (mkstemp)
+from threading import (local)
 from cryptography.fernet import (Fernet)
 
 from peerconn_commands import Commands
+from peerconn_framing import (read_frame, read_frame_header, read_frame_payload, write_frame, FrameError)
+from peerconn_transfer import (FileSender, FileReceiver, StripedFileSender, StripedReceive)
+from peerconn_workers import (WorkerPool)
+from peerconn_journal import (TransferJournal)
+from peerconn_manifest import (ManifestReader, ManifestWriter, build_manifest)
+from peerconn_compression import (available_compressions, negotiate_compression, compress_chunk, decompress_chunk)
+from peerconn_dedup import (ContentIndex, file_chunk_hashes, chunk_length)
+from peerconn_codec import (encode, decode)
+from peerconn_batching import (MessageBatcher)
+from peerconn_registry import (PeerSocketRegistry)
+from peerconn_events import (EventPublisher, PeerConnEvents)
+from peerconn_history import (HistoryDatabase, MessageStore, SEARCH_LIMIT)
+from peerconn_dispatch import (CommandDispatcher, CommandRoute, CommandLanes)
+from peerconn_mux import (MuxConnection, MuxStreams)
+from peerconn_shaping import (TokenBucket, FairScheduler, TransferShaper)
+from peerconn_crypto import (ChunkCipher, CipherModes, CIPHER_PREFERENCE, negotiate_cipher, derive_file_key, derive_resume_ticket, new_nonce_prefix, file_cipher)
 
 class PeerConn(Commands):
     """Main class for gathering seperate PeerConn classes and accessibility."""
     def __init__(self) -> None:
         self._configure_logging()
-        self._peersockets = []
+        self._events = EventPublisher(self._logger)
+        self._peersockets = PeerSocketRegistry(on_change= self._socket_state_changed)
         self._peerdata = PeerData(
             name= gethostname(),
             local_address= self.get_ipv4_address(adapter_names= ['Wi-Fi', 'WiFi'])
         )
         self._command_event = Event()
         self._command_queue = Queue()
+        self._batch_local = local()
+        self._dispatcher = CommandDispatcher(self._logger)
+        self._route_commands()
         if not path.exists(self._DOWNLOADS_DIR):
             makedirs(self._DOWNLOADS_DIR)
         self.configuration_file(False)
+        self._workers = WorkerPool(self._WORKER_KIND, self._WORKER_COUNT)
+        self._uplink = FairScheduler(TokenBucket(self._UPLOAD_RATE))
+        history_fd, history_path = mkstemp(prefix= 'peerconn-history-', suffix= '.sqlite3')
+        close_fd(history_fd)
+        self._history_database = HistoryDatabase(history_path)
         self._logger.info(f'{PeerConn.__name__}: Initialized.')
     
     def configuration_file(self, new_configs:bool) -> None:
         if not path.exists(self._config_path) and new_configs == False:
             with open(self._config_path, 'w', encoding= 'utf-8') as config_file:
-                json_dump({'name':self._peerdata.name, 'download_dir': self._DOWNLOADS_DIR}, config_file)
+                json_dump(self._configurations(), config_file)
             self._logger.info(f'{self.configuration_file.__name__}: Configuration file initialized.')
         elif path.exists(self._config_path) and new_configs == True:
             with open(self._config_path, 'w', encoding= 'utf-8') as config_file:
-                json_dump({'name':self._peerdata.name, 'download_dir': self._DOWNLOADS_DIR}, config_file)
+                json_dump(self._configurations(), config_file)
             self._logger.info(f'{self.configuration_file.__name__}: New configuration file has saved.')
         else:
             with open(self._config_path, 'r', encoding= 'utf-8') as config_file:
                 config = json_loads(config_file.read())
                 self._DOWNLOADS_DIR = config['download_dir']
                 self._peerdata.name = config['name']
+                self._WORKER_KIND = config.get('worker_kind', self._WORKER_KIND)
+                self._WORKER_COUNT = config.get('worker_count', self._WORKER_COUNT)
+                self._TRUSTED_LINK = config.get('trusted_link', self._TRUSTED_LINK)
+                self._ENCRYPT_FILES = config.get('encrypt_files', self._ENCRYPT_FILES)
+                self._PRE_ENCRYPTED_EXTENSIONS = config.get('pre_encrypted_extensions', self._PRE_ENCRYPTED_EXTENSIONS)
+                self._FILE_STREAMS = config.get('file_streams', self._FILE_STREAMS)
+                self._COMPRESSION = config.get('compression', self._COMPRESSION)
+                self._DEDUP = config.get('dedup', self._DEDUP)
+                self._MESSAGE_BATCH_DELAY = config.get('message_batch_delay', self._MESSAGE_BATCH_DELAY)
+                self._MULTIPLEX = config.get('multiplex', self._MULTIPLEX)
+                self._CONNECT_TIMEOUT = config.get('connect_timeout', self._CONNECT_TIMEOUT)
+                self._RECONNECT = config.get('reconnect', self._RECONNECT)
+                self._HEARTBEAT_INTERVAL = config.get('heartbeat_interval', self._HEARTBEAT_INTERVAL)
+                self._HEARTBEAT_MISSES = config.get('heartbeat_misses', self._HEARTBEAT_MISSES)
+                self._TCP_KEEPALIVE = config.get('tcp_keepalive', self._TCP_KEEPALIVE)
+                self._UPLOAD_RATE = config.get('upload_rate', self._UPLOAD_RATE)
+                self._PEERSOCKET_UPLOAD_RATE = config.get('peersocket_upload_rate', self._PEERSOCKET_UPLOAD_RATE)
+                if self._uplink != None:
+                    self._uplink.bucket.set_rate(self._UPLOAD_RATE)
             self._logger.info(f'{self.configuration_file.__name__}: Configurations are set.')
 
+    def _configurations(self) -> dict:
+        return {
+            'name': self._peerdata.name,
+            'download_dir': self._DOWNLOADS_DIR,
+            'worker_kind': self._WORKER_KIND,
+            'worker_count': self._WORKER_COUNT,
+            'trusted_link': self._TRUSTED_LINK,
+            'encrypt_files': self._ENCRYPT_FILES,
+            'pre_encrypted_extensions': self._PRE_ENCRYPTED_EXTENSIONS,
+            'file_streams': self._FILE_STREAMS,
+            'compression': self._COMPRESSION,
+            'dedup': self._DEDUP,
+            'message_batch_delay': self._MESSAGE_BATCH_DELAY,
+            'multiplex': self._MULTIPLEX,
+            'connect_timeout': self._CONNECT_TIMEOUT,
+            'reconnect': self._RECONNECT,
+            'heartbeat_interval': self._HEARTBEAT_INTERVAL,
+            'heartbeat_misses': self._HEARTBEAT_MISSES,
+            'tcp_keepalive': self._TCP_KEEPALIVE,
+            'upload_rate': self._UPLOAD_RATE,
+            'peersocket_upload_rate': self._PEERSOCKET_UPLOAD_RATE
+        }
+
     def is_valid_ipv4(self, ip: str) -> bool:
         try:
             ip_address(ip)
@@ -55,12 +133,11 @@ class PeerConn(Commands):
         except ValueError:
             return False
 
-    def create_peer_socket(self, custom_id: str = None) -> str:
-        peersocket_ref = PeerSocket(
-            id= custom_id if custom_id != None else str(uuid4()),
-            history= History()
-        )
-        self._peersockets.append(peersocket_ref)
+    def create_peer_socket(self, custom_id: str = None, parent_id: str = None) -> str:
+        peersocket_ref = PeerSocket(id= custom_id if custom_id != None else str(uuid4()), parent_id= parent_id)
+        peersocket_ref.history = History(messages= MessageStore(self._history_database, peersocket_ref.id, self._HISTORY_RING_SIZE, self._HISTORY_FLUSH_SIZE,
+                                                                partial(self._message_appended, peersocket_ref)))
+        self._peersockets.add(peersocket_ref)
 
         self._logger.info(f'{self.create_peer_socket.__name__}: {peersocket_ref.id}')
 
@@ -78,47 +155,71 @@ class PeerConn(Commands):
         return f'Client_{len(self._peersockets)}'
 
     def get_client_sockets(self) -> List[PeerSocket]:
-        matches = [peersocket for peersocket in self._peersockets if peersocket.servers == None]
-        if matches:
-            return matches
-        else:
-            return None
+        return self._peersockets.clients() or None
 
     def get_server_sockets(self) -> List[PeerSocket]:
-        matches = [peersocket for peersocket in self._peersockets if peersocket.servers != None]
-        if matches:
-            return matches
-        else:
-            return None
+        return self._peersockets.servers() or None
 
     def get_active_connections(self) -> List[PeerSocket]:
-        matches = [peersocket for peersocket in self._peersockets if peersocket.msg_comm_connected and peersocket.file_comm_connected]
-        if matches:
-            return matches
-        else:
-            return None
+        return self._peersockets.active() or None
 
     def get_inactive_connections(self) -> List[PeerSocket]:
-        matches = [peersocket for peersocket in self._peersockets if not peersocket.msg_comm_connected and not peersocket.file_comm_connected]
-        if matches:
-            return matches
-        else:
+        return self._peersockets.inactive() or None
+
+    def get_sessions(self, id: str | None = None) -> List[PeerSocket]:
+        """Sessions of the server peersocket id, or of every server."""
+        if id == None:
+            return self._peersockets.sessions() or None
+        peersocket_ref = self.get_socket(id)
+        if peersocket_ref == None or peersocket_ref.sessions == None:
             return None
+        return list(peersocket_ref.sessions.values()) or None
 
     def get_socket(self, id: str) -> PeerSocket:
-        matches = [peersocket for peersocket in self._peersockets if peersocket.id == id]
-        if matches:
-            return matches[0]
+        return self._peersockets.get(id)
+
+    def remove_peer_socket(self, id: str) -> PeerSocket | None:
+        """Forgets a peersocket, which should be closed first; returns it or None when the id is unknown.
+        Runs on the event loop like everything else that changes the session tables, other threads call remove()."""
+        peersocket_ref = self._peersockets.remove(id)
+        if peersocket_ref != None:
+            peersocket_ref.history.messages.clear()
+            for session_ref in (peersocket_ref.sessions or {}).values():
+                self._peersockets.remove(session_ref.id)
+                session_ref.history.messages.clear()
+            self._logger.info(f'{self.remove_peer_socket.__name__}: {id}')
         else:
-            return None
+            self._logger.warning(f'{self.remove_peer_socket.__name__}: {id} not found!')
+        return peersocket_ref
+
+    def search_messages(self, text: str = '', peersocket_ids: List[str] | None = None, sender: str | None = None,
+                        since: float | None = None, until: float | None = None, limit: int = SEARCH_LIMIT) -> List[SearchHit]:
+        """Searches the history of every peersocket, or only of peersocket_ids, newest hits first.
+        since and until are time() timestamps. Safe to call from the GUI thread."""
+        for peersocket_ref in self._peersockets:
+            if peersocket_ids == None or peersocket_ref.id in peersocket_ids:
+                peersocket_ref.history.messages.flush() # The newest messages may not have reached the database yet
+        return self._history_database.search(text, peersocket_ids, sender, since, until, limit)
+
+    def subscribe(self, listener: Callable[[int, str], None]) -> None:
+        """listener(event, peersocket_id) is called on the event loop's thread for every PeerConnEvents event."""
+        self._events.subscribe(listener)
+
+    def unsubscribe(self, listener: Callable[[int, str], None]) -> None:
+        self._events.unsubscribe(listener)
 
     async def hm_close(self, id: str) -> None:
         self._logger.info(f'{self.hm_close.__name__}: {id}')
         peersocket_ref = self.get_socket(id)
 
-        if peersocket_ref != None and peersocket_ref.servers or peersocket_ref.streams:
+        if peersocket_ref != None and (peersocket_ref.servers or peersocket_ref.streams):
+            peersocket_ref.reconnect = False
+            if peersocket_ref.supervisor != None: # Its channels end by themselves once their writers are closed below
+                peersocket_ref.supervisor.cancel()
+                peersocket_ref.supervisor = None
             peersocket_ref.msg_comm_connected = False
             peersocket_ref.file_comm_connected = False
+            self._peersockets.refresh(peersocket_ref)
             if peersocket_ref.servers != None:
                 if peersocket_ref.servers.msg_server != None:
                     peersocket_ref.servers.msg_server.close()
@@ -132,6 +233,14 @@ class PeerConn(Commands):
                     peersocket_ref.servers.file_server = None
                     self._logger.info(f'{self.hm_close.__name__}: File server of is closed.')
 
+            for session_ref in list((peersocket_ref.sessions or {}).values()):
+                await self.hm_close(session_ref.id)
+
+            if peersocket_ref.message_batcher != None:
+                peersocket_ref.message_batcher.close()
+                self._logger.info(f'{peersocket_ref.id} - {self.hm_close.__name__}: Message batching: {peersocket_ref.message_batcher.stats}')
+                peersocket_ref.message_batcher = None
+
             if peersocket_ref.streams != None:
                 if peersocket_ref.streams.msg_writer != None:
                     peersocket_ref.streams.msg_writer.close()
@@ -144,6 +253,9 @@ class PeerConn(Commands):
                     await peersocket_ref.streams.file_writer.wait_closed()
                     peersocket_ref.streams.file_writer = None
                     self._logger.info(f'{self.hm_close.__name__}: File writer of is closed.')
+            if peersocket_ref.parent_id != None: # Closed on purpose, not kept for its client to resume
+                self._end_session(peersocket_ref, linger= False)
+            self._events.publish(PeerConnEvents.SOCKET_STATE, peersocket_ref.id)
         else:
             self._logger.warning(f'{self.hm_close.__name__}: {id} not found!')
 
@@ -152,21 +264,51 @@ class PeerConn(Commands):
         return Fernet.generate_key()
     
     async def exchange_key(self, peersocket_ref:PeerSocket) -> bool:
+        """Negotiates the keys and settings of a new connection, or skips that when the server took the client's resumption ticket."""
         try:
-            dumped_packet = pickle_dumps(PeerPacket(self._peerdata, peersocket_ref.key, peersocket_ref.streams.msg_writer.get_extra_info('peername')))
+            if peersocket_ref.parent_id != None:
+                if peersocket_ref.resumed != None: # The client presented a ticket, tell it whether the session goes on
+                    write_frame(peersocket_ref.streams.msg_writer, FrameTypes.SESSION_RESUME, encode(peersocket_ref.resumed))
+            elif peersocket_ref.resume_ticket != None:
+                frame = await read_frame(peersocket_ref.streams.msg_reader, timeout= 5)
+                if frame.type != FrameTypes.SESSION_RESUME:
+                    raise FrameError(f'Expected a session resume frame, got {frame.type}!')
+                peersocket_ref.resumed = decode(frame.payload)
+                if not peersocket_ref.resumed: # The server forgot the session, the keys are exchanged anew
+                    peersocket_ref.resume_ticket = None
+                    peersocket_ref.key = await self.create_key()
+            if peersocket_ref.resumed:
+                self._start_batcher(peersocket_ref)
+                self._logger.info(f'{self.exchange_key.__name__}: OK, resumed the session.')
+                return True
+            dumped_packet = encode(PeerPacket(self._peerdata, peersocket_ref.key, peersocket_ref.streams.msg_writer.get_extra_info('peername'), ciphers= CIPHER_PREFERENCE,
+                                                trusted_link= self._TRUSTED_LINK, file_streams= self._FILE_STREAMS,
+                                                compressions= available_compressions() if self._COMPRESSION else [], dedup= self._DEDUP, heartbeats= True))
             received_packet = None
-            if peersocket_ref.servers != None:
-                received_packet = await wait_for(peersocket_ref.streams.msg_reader.read(1024 * 2), 5)
-                received_packet: PeerPacket = pickle_loads(received_packet)
+            if peersocket_ref.parent_id != None: # A session, the client speaks first
+                received_packet = await self._read_key_exchange(peersocket_ref)
                 peersocket_ref.key = received_packet.key + peersocket_ref.key
-                peersocket_ref.streams.msg_writer.write(dumped_packet)
+                peersocket_ref.peerdata = received_packet.sender
+                write_frame(peersocket_ref.streams.msg_writer, FrameTypes.KEY_EXCHANGE, dumped_packet)
             else:
-                peersocket_ref.streams.msg_writer.write(dumped_packet)
-                received_packet = await wait_for(peersocket_ref.streams.msg_reader.read(1024 * 2), 5)
-                received_packet: PeerPacket = pickle_loads(received_packet)
+                write_frame(peersocket_ref.streams.msg_writer, FrameTypes.KEY_EXCHANGE, dumped_packet)
+                await peersocket_ref.streams.msg_writer.drain()
+                received_packet = await self._read_key_exchange(peersocket_ref)
                 peersocket_ref.key = peersocket_ref.key + received_packet.key
             peersocket_ref.cipher_suite = Fernet(peersocket_ref.key)
-            self._logger.info(f'{self.exchange_key.__name__}: OK.')
+            peersocket_ref.file_cipher_mode = negotiate_cipher(CIPHER_PREFERENCE, received_packet.ciphers)
+            peersocket_ref.file_key = derive_file_key(peersocket_ref.key)
+            peersocket_ref.trusted_link = self._TRUSTED_LINK and received_packet.trusted_link
+            # Stripes of a multiplexed peersocket would share its only connection, so they aren't opened
+            peersocket_ref.file_streams = 1 if peersocket_ref.mux != None else max(1, min(self._FILE_STREAMS, received_packet.file_streams))
+            peersocket_ref.compression = negotiate_compression(available_compressions() if self._COMPRESSION else [], received_packet.compressions)
+            peersocket_ref.dedup = self._DEDUP and received_packet.dedup
+            if peersocket_ref.dedup:
+                self._content_index_for(PeerConn._DOWNLOADS_DIR) # Indexed in the background before the first file arrives
+            peersocket_ref.heartbeats = received_packet.heartbeats
+            peersocket_ref.resume_ticket = derive_resume_ticket(peersocket_ref.key)
+            self._start_batcher(peersocket_ref)
+            self._logger.info(f'{self.exchange_key.__name__}: OK, file cipher = {peersocket_ref.file_cipher_mode}, trusted link = {peersocket_ref.trusted_link}, compression = {peersocket_ref.compression}.')
             return True
         except TimeoutError:
             self._logger.error(f'{self.exchange_key.__name__}: Timeout!')
@@ -176,17 +318,36 @@ class PeerConn(Commands):
             await peersocket_ref.streams.msg_writer.drain()
         return False
 
-    async def hm_set_server(self, id: str) -> None:
+    def _start_batcher(self, peersocket_ref: PeerSocket) -> None:
+        """Message batcher of a new connection; messages queued while the link was down go out first."""
+        peersocket_ref.message_batcher = MessageBatcher(peersocket_ref.streams.msg_writer, partial(self._seal_message, peersocket_ref),
+                                                        self._MESSAGE_BATCH_DELAY, self._MESSAGE_BATCH_BYTES, self._MESSAGE_BATCH_COUNT, peersocket_ref.outbox)
+        if peersocket_ref.outbox:
+            self._logger.info(f'{peersocket_ref.id} - {self._start_batcher.__name__}: Replaying {len(peersocket_ref.outbox)} queued messages.')
+            queued = list(peersocket_ref.outbox) # The batcher puts them back if this link is already closing too
+            peersocket_ref.outbox.clear()
+            for packet in queued:
+                peersocket_ref.message_batcher.add(packet)
+
+    async def _read_key_exchange(self, peersocket_ref: PeerSocket) -> PeerPacket:
+        frame = await read_frame(peersocket_ref.streams.msg_reader, timeout= 5)
+        if frame.type != FrameTypes.KEY_EXCHANGE:
+            raise FrameError(f'Expected a key exchange frame, got {frame.type}!')
+        return decode(frame.payload)
+
+    async def hm_set_server(self, id: str) -> bool:
+        """Returns whether both servers are listening."""
         self._logger.info(f'{self.hm_set_server.__name__}: {id}')
         peersocket_ref = self.get_socket(id)
 
         if peersocket_ref != None and peersocket_ref.peerdata != None:
             try:
-                peersocket_ref.key = await self.create_key()
                 peersocket_ref.servers = Servers()
+                peersocket_ref.sessions = {}
+                self._peersockets.refresh(peersocket_ref)
                 peersocket_ref.events = Events(msg_event_server= Event(), msg_event_stream= Event(), file_event_server= Event(), file_event_stream= Event())
                 peersocket_ref.servers.msg_server = await start_server(
-                    lambda reader, writer: self._server_incomming_messages(reader, writer, peersocket_ref, self._logger),
+                    lambda reader, writer: self._server_message_connection(reader, writer, peersocket_ref, self._logger),
                     peersocket_ref.peerdata.local_address,
                     peersocket_ref.peerdata.msg_port
                 )
@@ -195,33 +356,142 @@ class PeerConn(Commands):
 
                 # peersocket_ref.events.file_event_server = Event()
                 peersocket_ref.servers.file_server = await start_server(
-                    lambda reader, writer: self._server_incomming_files(reader, writer, peersocket_ref, self._logger),
+                    lambda reader, writer: self._server_file_connection(reader, writer, peersocket_ref, self._logger),
                     peersocket_ref.peerdata.local_address,
                     peersocket_ref.peerdata.file_port
                 )
                 
                 self._logger.info(f'{self.hm_set_server.__name__}: File server = OK.')
+                return True
 
             except Exception as ex:
                 self._logger.error(f'{self.hm_set_server.__name__}: {id}: {ex}')
+        return False
+
+    def _open_session(self, server_ref: PeerSocket, session_id: str) -> PeerSocket:
+        """Session of a server peersocket by the id its client sent; whichever of the client's two connections
+        comes first creates it, with a key, streams and history of its own."""
+        session_ref = server_ref.sessions.get(session_id)
+        if session_ref == None:
+            if not session_id or session_id in self._peersockets:
+                raise FrameError(f'Session id {session_id} is taken!')
+            self.create_peer_socket(session_id, server_ref.id)
+            session_ref = self.get_socket(session_id)
+            session_ref.key = Fernet.generate_key()
+            session_ref.streams = Streams()
+            session_ref.events = Events(msg_event_server= Event(), msg_event_stream= Event(), file_event_server= Event(), file_event_stream= Event())
+            server_ref.sessions[session_id] = session_ref
+            self._logger.info(f'{server_ref.id} - {self._open_session.__name__}: {session_id}, {len(server_ref.sessions)} sessions.')
+        elif session_ref.resume_expiry != None: # A dropped session its client is coming back to
+            session_ref.resume_expiry.cancel()
+            session_ref.resume_expiry = None
+        return session_ref
+
+    def _end_session(self, session_ref: PeerSocket, linger: bool = True) -> None:
+        """Forgets a session once neither of its connections is left. A session that exchanged keys lingers
+        for the resume window first, while its server listens, so its client can reconnect and resume it."""
+        if session_ref.streams.msg_writer != None or session_ref.streams.file_writer != None:
+            return
+        if session_ref.resume_expiry != None:
+            session_ref.resume_expiry.cancel()
+            session_ref.resume_expiry = None
+        server_ref = self.get_socket(session_ref.parent_id)
+        if (linger and session_ref.resume_ticket != None and self._RESUME_WINDOW > 0 and server_ref != None and
+            server_ref.servers != None and server_ref.servers.msg_server != None):
+            session_ref.resume_expiry = get_running_loop().call_later(self._RESUME_WINDOW, self._end_session, session_ref, False)
+            return
+        if server_ref != None and server_ref.sessions != None and server_ref.sessions.pop(session_ref.id, None) != None:
+            self._refresh_server(server_ref)
+        if self._peersockets.remove(session_ref.id) != None:
+            session_ref.history.messages.clear()
+            self._logger.info(f'{session_ref.parent_id} - {self._end_session.__name__}: {session_ref.id}')
+
+    def _refresh_server(self, server_ref: PeerSocket) -> None:
+        """A server peersocket counts as connected while any of its sessions is."""
+        sessions = server_ref.sessions.values()
+        server_ref.msg_comm_connected = any(session_ref.msg_comm_connected for session_ref in sessions)
+        server_ref.file_comm_connected = any(session_ref.file_comm_connected for session_ref in sessions)
+        self._peersockets.refresh(server_ref)
+
+    def _socket_state_changed(self, id: str) -> None:
+        self._events.publish(PeerConnEvents.SOCKET_STATE, id)
+        peersocket_ref = self.get_socket(id)
+        if peersocket_ref != None and peersocket_ref.parent_id != None:
+            server_ref = self.get_socket(peersocket_ref.parent_id)
+            if server_ref != None and server_ref.sessions != None:
+                self._refresh_server(server_ref)
+
+    def _message_appended(self, peersocket_ref: PeerSocket, message: Message) -> None:
+        self._events.publish(PeerConnEvents.NEW_MESSAGES, peersocket_ref.id)
+        if peersocket_ref.parent_id != None: # The history of a server is the merged chat of its sessions
+            server_ref = self.get_socket(peersocket_ref.parent_id)
+            if server_ref != None:
+                server_ref.history.messages.append(message)
 
-    async def _server_incomming_messages(self, reader: StreamReader, writer: StreamWriter, peersocket_ref:PeerSocket, logger: Logger) -> None:
+    async def _server_message_connection(self, reader: StreamReader, writer: StreamWriter, server_ref: PeerSocket, logger: Logger) -> None:
+        """A client's message connection opens with a session hello, then the session takes it over.
+        With a mux hello, it carries the session's file channel too."""
+        self._set_keepalive(writer)
+        try:
+            frame = await read_frame(reader, timeout= 5)
+            if frame.type != FrameTypes.SESSION_HELLO and frame.type != FrameTypes.MUX_HELLO:
+                raise FrameError(f'Expected a session or mux hello frame, got {frame.type}!')
+            hello: SessionHello = decode(frame.payload)
+            session_ref = self._open_session(server_ref, hello.session_id)
+            if session_ref.streams.msg_writer != None:
+                raise FrameError(f'Session {session_ref.id} already has a message socket!')
+            if frame.type == FrameTypes.MUX_HELLO and session_ref.streams.file_writer != None:
+                raise FrameError(f'Session {session_ref.id} already has a file socket!')
+            if hello.ticket != None:
+                session_ref.resumed = session_ref.resume_ticket != None and compare_digest(hello.ticket, session_ref.resume_ticket)
+            else:
+                session_ref.resumed = None
+            if not session_ref.resumed: # Keys are exchanged anew, also by a dropped session whose ticket didn't match
+                session_ref.resume_ticket = None
+                session_ref.key = Fernet.generate_key()
+        except Exception as ex:
+            logger.error(f'{server_ref.id} - {PeerConn._server_message_connection.__name__}: {ex}')
+            writer.close()
+            await writer.wait_closed()
+            return
+        if frame.type == FrameTypes.MUX_HELLO:
+            streams = self._multiplex(session_ref, reader, writer)
+            await gather(self._server_incomming_messages(streams.msg_reader, streams.msg_writer, session_ref, logger),
+                         self._server_incomming_files(streams.file_reader, streams.file_writer, session_ref, logger))
+        else:
+            await self._server_incomming_messages(reader, writer, session_ref, logger)
+
+    def _multiplex(self, peersocket_ref: PeerSocket, reader: StreamReader, writer: StreamWriter) -> Streams:
+        """Splits a connection into the message and file streams of a peersocket."""
+        peersocket_ref.mux = MuxConnection(reader, writer)
+        peersocket_ref.streams.msg_reader, peersocket_ref.streams.msg_writer = peersocket_ref.mux.open_stream(MuxStreams.MESSAGE)
+        peersocket_ref.streams.file_reader, peersocket_ref.streams.file_writer = peersocket_ref.mux.open_stream(MuxStreams.FILE)
+        return peersocket_ref.streams
+
+    async def _server_incomming_messages(self, reader: StreamReader, writer: StreamWriter, peersocket_ref:PeerSocket, logger: Logger) -> bool:
+        """Returns whether the keys were exchanged, or the session resumed, before the connection ended."""
+        connected = False
+        heartbeat: Task | None = None
+        loop = get_running_loop()
         try:
             if peersocket_ref.streams == None:
                 peersocket_ref.streams = Streams()
             # peersocket.events.msg_event_server = Event()
-            if peersocket_ref.history.messages == None:
-                peersocket_ref.history.messages = []
             peersocket_ref.streams.msg_reader = reader
             peersocket_ref.streams.msg_writer = writer
             if await self.exchange_key(peersocket_ref):
+                connected = True
+                peersocket_ref.link = LinkStats(last_heard= loop.time())
+                if peersocket_ref.heartbeats and self._HEARTBEAT_INTERVAL > 0:
+                    heartbeat = create_task(self._heartbeat(peersocket_ref, peersocket_ref.streams.msg_writer))
                 peersocket_ref.msg_comm_connected = True
+                self._peersockets.refresh(peersocket_ref)
 
                 peersocket_ref.history.messages.append(
                             Message(
                                 sender= PeerConn.__name__,
                                 content= 'Connected to message socket!',
-                                date_time= datetime.now(),
+                                timestamp= time(),
                                 type= MessageTypes.CONNECTION_ESTABLISHED
                             )
                         )
@@ -229,21 +499,28 @@ class PeerConn(Commands):
 
                 while not peersocket_ref.events.msg_event_server.is_set():
                     try:
-                        data = await peersocket_ref.streams.msg_reader.read(1024 * 2)
-                        if data:
-                            decrypted_data = peersocket_ref.cipher_suite.decrypt(data)
-                            data : PeerPacket = pickle_loads(decrypted_data)
-                            peersocket_ref.history.messages.append(
-                                Message(
-                                    sender= data.sender.name,
-                                    content= data.message.content,
-                                    date_time= datetime.now(),
-                                    type= MessageTypes.PEER
+                        frame = await read_frame(peersocket_ref.streams.msg_reader)
+                        peersocket_ref.link.last_heard = loop.time()
+                        if frame.type == FrameTypes.MESSAGE or frame.type == FrameTypes.MESSAGE_BATCH:
+                            decrypted_data, _ = decompress_chunk(peersocket_ref.compression, peersocket_ref.cipher_suite.decrypt(frame.payload), frame.flags)
+                            packets : List[PeerPacket] = decode(decrypted_data) if frame.type == FrameTypes.MESSAGE_BATCH else [decode(decrypted_data)]
+                            for data in packets:
+                                peersocket_ref.history.messages.append(
+                                    Message(
+                                        sender= data.sender.name,
+                                        content= data.message.content,
+                                        timestamp= time(),
+                                        type= MessageTypes.PEER
+                                    )
                                 )
-                            )
-                            peersocket_ref.history.new_messages += 1
+                            peersocket_ref.history.new_messages += len(packets)
+                        elif frame.type == FrameTypes.HEARTBEAT:
+                            write_frame(peersocket_ref.streams.msg_writer, FrameTypes.HEARTBEAT_ACK, frame.payload)
+                        elif frame.type == FrameTypes.HEARTBEAT_ACK:
+                            peersocket_ref.link.add_sample(loop.time() - decode(frame.payload))
+                            self._events.publish(PeerConnEvents.LINK_STATS, peersocket_ref.id)
                         else:
-                            break
+                            logger.warning(f'{peersocket_ref.id} - {PeerConn._server_incomming_messages.__name__}: Unexpected frame type {frame.type}!')
                     except IncompleteReadError as ex:
                         if peersocket_ref.msg_comm_connected:
                             logger.warning(f'{peersocket_ref.id} - {PeerConn._server_incomming_messages.__name__}: Connection with message socket closed abruptly! {ex}')
@@ -257,7 +534,7 @@ class PeerConn(Commands):
                                 Message(
                                     sender= PeerConn.__name__,
                                     content= 'Connection lost with message port! The specified network name is no longer available.',
-                                    date_time= datetime.now(),
+                                    timestamp= time(),
                                     type= MessageTypes.CONNECTION_LOST
                                 )
                             )
@@ -266,6 +543,8 @@ class PeerConn(Commands):
                         logger.error(f'{peersocket_ref.id} - {PeerConn._server_incomming_messages.__name__}: {ex}')
                         break
         finally:
+            if heartbeat != None:
+                heartbeat.cancel()
             notify: str = None
             if peersocket_ref.msg_comm_connected:
                 notify = 'Connection with message socket closed abruptly!'
@@ -275,112 +554,262 @@ class PeerConn(Commands):
                         Message(
                             sender= PeerConn.__name__,
                             content= notify,
-                            date_time= datetime.now(),
+                            timestamp= time(),
                             type= MessageTypes.CONNECTION_LOST
                         )
                     )
             peersocket_ref.history.new_messages += 1
             if peersocket_ref != None:
                 peersocket_ref.msg_comm_connected = False
-                if peersocket_ref.servers != None:
-                    if peersocket_ref.servers.msg_server != None:
-                        peersocket_ref.servers.msg_server.close()
-                        await peersocket_ref.servers.msg_server.wait_closed()
-                        peersocket_ref.servers.msg_server = None
-
+                self._peersockets.refresh(peersocket_ref)
+                if peersocket_ref.message_batcher != None:
+                    logger.info(f'{peersocket_ref.id} - {PeerConn._server_incomming_messages.__name__}: Message batching: {peersocket_ref.message_batcher.stats}')
+                    peersocket_ref.message_batcher = None
+                if connected:
+                    logger.info(f'{peersocket_ref.id} - {PeerConn._server_incomming_messages.__name__}: Link: {peersocket_ref.link}')
                 if peersocket_ref.streams != None:
                     if peersocket_ref.streams.msg_writer != None:
                         peersocket_ref.streams.msg_writer.close()
                         await peersocket_ref.streams.msg_writer.wait_closed()
                         peersocket_ref.streams.msg_writer = None
                         peersocket_ref.streams.msg_reader = None
+                self._events.publish(PeerConnEvents.SOCKET_STATE, peersocket_ref.id) # Streams are settled only now
+                if peersocket_ref.parent_id != None: # Only the session ends, its server goes on listening
+                    self._end_session(peersocket_ref)
+        return connected
+
+    async def _server_file_connection(self, reader: StreamReader, writer: StreamWriter, server_ref: PeerSocket, logger: Logger) -> None:
+        """A connection to the file port opens with a session hello when it is a client's file socket,
+        or with a stripe hello when it is a data connection of a striped transfer."""
+        self._set_keepalive(writer)
+        try:
+            frame = await read_frame(reader, timeout= self._FILE_REPLY_TIMEOUT)
+            if frame.type == FrameTypes.SESSION_HELLO:
+                hello: SessionHello = decode(frame.payload)
+                session_ref = self._open_session(server_ref, hello.session_id)
+                if session_ref.streams.file_writer != None:
+                    raise FrameError(f'Session {session_ref.id} already has a file socket!')
+            elif frame.type == FrameTypes.STRIPE_HELLO:
+                await self._server_incomming_stripe(reader, writer, server_ref, decode(frame.payload), logger)
+                return
+            else:
+                raise FrameError(f'Expected a session or stripe hello frame, got {frame.type}!')
+        except Exception as ex:
+            logger.error(f'{server_ref.id} - {PeerConn._server_file_connection.__name__}: {ex}')
+            writer.close()
+            await writer.wait_closed()
+            return
+        await self._server_incomming_files(reader, writer, session_ref, logger)
+
+    async def _server_incomming_stripe(self, reader: StreamReader, writer: StreamWriter, server_ref: PeerSocket, hello: StripeHello, logger: Logger) -> None:
+        try:
+            striped_receive: StripedReceive = next((session_ref.incoming_stripes for session_ref in server_ref.sessions.values()
+                                                    if session_ref.incoming_stripes != None and session_ref.incoming_stripes.transfer_id == hello.transfer_id), None)
+            if striped_receive == None:
+                raise FrameError(f'No striped transfer {hello.transfer_id} to join!')
+            logger.info(f'{server_ref.id} - {PeerConn._server_incomming_stripe.__name__}: Stripe {hello.index} joined.')
+            await striped_receive.receive(reader)
+        except Exception as ex:
+            logger.error(f'{server_ref.id} - {PeerConn._server_incomming_stripe.__name__}: {ex}')
+        finally:
+            writer.close()
+            await writer.wait_closed()
 
     async def _server_incomming_files(self, reader: StreamReader, writer: StreamWriter, peersocket_ref: PeerSocket, logger: Logger) -> None:
         try:
             if peersocket_ref.streams == None:
                 peersocket_ref.streams = Streams()
             # peersocket.events.file_event_stream = Event()
-            if peersocket_ref.history.messages == None:
-                peersocket_ref.history.messages = []
             peersocket_ref.streams.file_reader = reader
             peersocket_ref.streams.file_writer = writer
             peersocket_ref.file_comm_connected = True
+            self._peersockets.refresh(peersocket_ref)
             peersocket_ref.file_percentage = 0
+            peersocket_ref.file_replies = Queue()
 
             peersocket_ref.history.messages.append(
                         Message(
                             sender= PeerConn.__name__,
                             content= 'Connected to file socket!',
-                            date_time= datetime.now(),
+                            timestamp= time(),
                             type= MessageTypes.CONNECTION_ESTABLISHED
                         )
                     )
             peersocket_ref.history.new_messages += 1
 
             while not peersocket_ref.events.file_event_server.is_set():
+                receiver: FileReceiver = None
+                manifest_writer: ManifestWriter = None
+                journal: TransferJournal = None
+                in_transaction = False # Replies to our own send pass through here too, they mustn't end its transaction
+                part_file_path = None
                 try:
-                    serialized_data = await peersocket_ref.streams.file_reader.readuntil(PeerConn._file_delimiter)
-                    peersocket_ref.in_file_transaction = True
-                    file_data:FileData = pickle_loads(serialized_data.removesuffix(PeerConn._file_delimiter))
+                    frame = await read_frame(peersocket_ref.streams.file_reader)
+                    if self._handle_file_reply(peersocket_ref, frame):
+                        continue
+                    if frame.type != FrameTypes.FILE_HEADER:
+                        logger.warning(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Unexpected frame type {frame.type}!')
+                        continue
+                    self._set_file_transaction(peersocket_ref, True)
+                    in_transaction = True
+                    file_data:FileData = decode(frame.payload)
                     logger.info(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Receiving a file: {file_data}')
                     todays_download_path = path.join(PeerConn._DOWNLOADS_DIR, str(datetime.now().date()))
                     if not path.exists(todays_download_path):
                         makedirs(todays_download_path)
                     received_file_path = path.join(todays_download_path, f'{file_data.name}{file_data.extension}')
-                    with open(received_file_path, 'wb') as received_file:
+                    # Received next to its final path and renamed once complete, so a file of the same name stays
+                    # intact, and deduplicable, until then
+                    part_file_path = self._part_path_for(received_file_path)
+                    completed = False
+                    if file_data.cipher == CipherModes.NONE and not peersocket_ref.trusted_link:
+                        raise FrameError('Plaintext file offered on a link that isn\'t trusted!')
+                    cipher = file_cipher(file_data.cipher, peersocket_ref.file_key, peersocket_ref.key, file_data.nonce_prefix)
+                    offset = 0
+                    ranged = file_data.stripes > 1 or file_data.chunk_hashes != None
+                    if file_data.transfer_id != None and file_data.size >= self._JOURNAL_MIN_SIZE:
+                        journal = TransferJournal(part_file_path)
+                        offset = await self._workers.run_io(journal.resume_offset, file_data.transfer_id, file_data.size)
+                        if ranged:
+                            offset -= offset % StripedFileSender.CHUNK_SIZE # Ranges are placed by their chunk index
+                        await self._workers.run_io(journal.start, file_data.transfer_id, file_data.size)
+                    if file_data.manifest != None:
+                        received_file = manifest_writer = await self._workers.run_io(ManifestWriter, todays_download_path, file_data.manifest)
+                    else:
+                        received_file = open(part_file_path, 'r+b' if offset else 'wb')
+                    with received_file:
+                        if file_data.cipher == CipherModes.NONE or ranged:
+                            received_file.truncate(file_data.size)
+                            received_file.flush()
+                        if offset:
+                            received_file.seek(offset)
+                        present = offset
+                        missing = None
+                        if file_data.chunk_hashes != None:
+                            content_index = self._content_index_for(PeerConn._DOWNLOADS_DIR)
+                            missing = await self._workers.run_io(content_index.materialize, part_file_path, file_data.chunk_hashes, file_data.size, offset)
+                            present = file_data.size - sum(chunk_length(file_data.size, index) for index in missing)
+                        stats = TransferStats(size= file_data.size, transferred= present, resumed_from= present, started= perf_counter(), compression= file_data.compression)
+                        if ranged:
+                            chunks = range(-(-file_data.size // StripedFileSender.CHUNK_SIZE))
+                            present_chunks = set(chunks[:offset // StripedFileSender.CHUNK_SIZE]) if missing == None else set(chunks) - set(missing)
+                            peersocket_ref.incoming_stripes = StripedReceive(file_data.transfer_id, part_file_path, cipher, self._workers, stats,
+                                                                             file_data.stripes, journal, partial(self._update_file_progress, peersocket_ref), present_chunks)
+                        if file_data.transfer_id != None:
+                            write_frame(peersocket_ref.streams.file_writer, FrameTypes.FILE_RESUME, encode(FileResume(file_data.transfer_id, offset, missing)))
+                            await peersocket_ref.streams.file_writer.drain()
                         peersocket_ref.history.messages.append(
                             Message(
                                 sender= PeerConn.__name__,
-                                content= f'{peersocket_ref.peerdata.name} is sending you [{file_data.name}{file_data.extension}, {file_data.size}].',
-                                date_time= datetime.now(),
+                                content= f'{peersocket_ref.peerdata.name} is sending you [{file_data.name}{file_data.extension}, {file_data.size}]' + (f', {present} bytes are already here.' if present else '.'),
+                                timestamp= time(),
                                 type= MessageTypes.FILE_NOTIFY_0
                             )
                         )
                         peersocket_ref.history.new_messages += 1
-                        readed_data_size = 0
-                        
+                        receiver = FileReceiver(received_file, cipher, self._workers, stats, journal)
+                        last_transferred = stats.transferred
+
                         while True:
                             try:
-                                chunk = await wait_for(peersocket_ref.streams.file_reader.read(1024 * 4), timeout=10.0)
-                                decrypted_chunk = peersocket_ref.cipher_suite.decrypt(chunk)
-                                received_file.write(decrypted_chunk)
-                                readed_data_size += len(decrypted_chunk)
-                                peersocket_ref.file_percentage = round((readed_data_size * 100) / file_data.size)
-                                if readed_data_size >= file_data.size:
-                                    logger.info(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Completed! Received data size = {readed_data_size}.')
+                                frame = await read_frame_header(peersocket_ref.streams.file_reader, timeout= 10.0)
+                                if frame.type == FrameTypes.FILE_RAW and file_data.cipher == CipherModes.NONE:
+                                    await receiver.receive_raw(peersocket_ref.streams.file_reader, frame.length)
+                                    self._update_file_progress(peersocket_ref, stats)
+                                    continue
+                                await read_frame_payload(peersocket_ref.streams.file_reader, frame)
+                                if self._handle_file_reply(peersocket_ref, frame):
+                                    continue
+                                if frame.type == FrameTypes.FILE_END:
+                                    await receiver.flush()
+                                    if file_data.stripes > 1:
+                                        if frame.payload:
+                                            peersocket_ref.incoming_stripes.expect(decode(frame.payload))
+                                        await wait_for(peersocket_ref.incoming_stripes.done.wait(), self._FILE_REPLY_TIMEOUT)
+                                if frame.type == FrameTypes.FILE_CHUNK:
+                                    await receiver.feed(frame.payload, frame.flags)
+                                    self._update_file_progress(peersocket_ref, stats)
+                                elif frame.type == FrameTypes.FILE_RANGE and ranged:
+                                    await peersocket_ref.incoming_stripes.feed_range(frame)
+                                elif (frame.type == FrameTypes.FILE_END and stats.transferred == file_data.size and
+                                      (peersocket_ref.incoming_stripes == None or peersocket_ref.incoming_stripes.error == None)):
+                                    stats.finished = perf_counter()
+                                    peersocket_ref.file_throughput = stats.throughput
+                                    completed = True
+                                    if journal != None:
+                                        await self._workers.run_io(journal.remove)
+                                    if peersocket_ref.incoming_stripes != None:
+                                        peersocket_ref.incoming_stripes.close()
+                                    logger.info(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Completed! Received {stats}.')
+                                    if file_data.manifest != None and received_file.corrupted:
+                                        logger.warning(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Failed verification: {received_file.corrupted}')
+                                        peersocket_ref.history.messages.append(
+                                            Message(
+                                                sender= PeerConn.__name__,
+                                                content= f'{len(received_file.corrupted)} of {len(file_data.manifest)} files in [{file_data.name}] don\'t match their hashes: {", ".join(received_file.corrupted[:5])}',
+                                                timestamp= time(),
+                                                type= MessageTypes.SYSTEM_WARN
+                                            )
+                                        )
+                                        peersocket_ref.history.new_messages += 1
+                                    peersocket_ref.history.messages.append(
+                                        Message(
+                                            sender= PeerConn.__name__,
+                                            content= f'[{file_data.name}{file_data.extension}, {stats.transferred}] is completely received! ({stats.throughput / (1024 * 1024):.2f} MiB/s)',
+                                            timestamp= time(),
+                                            type= MessageTypes.FILE_NOTIFY_1
+                                        )
+                                    )
+                                    peersocket_ref.history.new_messages += 1
+                                    break
+                                elif frame.type == FrameTypes.FILE_CANCEL:
+                                    logger.info(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Cancelled by the sender!')
                                     peersocket_ref.history.messages.append(
                                         Message(
                                             sender= PeerConn.__name__,
-                                            content= f'[{file_data.name}{file_data.extension}, {readed_data_size}] is completely received!.',
-                                            date_time= datetime.now(),
+                                            content= f'[{file_data.name}{file_data.extension}, {stats.transferred}] is cancelled by the sender!',
+                                            timestamp= time(),
                                             type= MessageTypes.FILE_NOTIFY_1
                                         )
                                     )
                                     peersocket_ref.history.new_messages += 1
                                     break
-                                elif not decrypted_chunk:
+                                else:
                                     logger.warning(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Failed to receive!')
+                                    if frame.type == FrameTypes.FILE_END and journal != None:
+                                        # The journal may vouch for misplaced bytes, the next attempt starts over
+                                        await self._workers.run_io(journal.remove)
+                                        journal = None
                                     peersocket_ref.history.messages.append(
                                         Message(
                                             sender= PeerConn.__name__,
-                                            content= f'[{file_data.name}{file_data.extension}, {readed_data_size}] is failed to receive!.',
-                                            date_time= datetime.now(),
+                                            content= f'[{file_data.name}{file_data.extension}, {stats.transferred}] is failed to receive!.',
+                                            timestamp= time(),
                                             type= MessageTypes.FILE_NOTIFY_1
                                         )
                                     )
                                     peersocket_ref.history.new_messages += 1
                                     break
                             except TimeoutError:
+                                if stats.transferred != last_transferred:
+                                    last_transferred = stats.transferred
+                                    continue # Silent file socket, but the data connections of a striped transfer are busy
                                 peersocket_ref.history.messages.append(
                                         Message(
                                             sender= PeerConn.__name__,
-                                            content= f'[{file_data.name}{file_data.extension}, {readed_data_size}] is failed to receive!.',
-                                            date_time= datetime.now(),
+                                            content= f'[{file_data.name}{file_data.extension}, {stats.transferred}] is failed to receive!.',
+                                            timestamp= time(),
                                             type= MessageTypes.FILE_NOTIFY_1
                                         )
                                     )
                                 peersocket_ref.history.new_messages += 1
                                 break
+                    if completed and manifest_writer != None:
+                        await self._workers.run_io(manifest_writer.commit)
+                    elif completed:
+                        await self._workers.run_io(replace, part_file_path, received_file_path)
+                        if file_data.chunk_hashes != None:
+                            await self._workers.run_io(content_index.add, received_file_path, file_data.chunk_hashes)
                 except IncompleteReadError as ex:
                     if peersocket_ref.file_comm_connected:
                         logger.warning(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: Connection with file socket closed abruptly! {ex}')
@@ -394,7 +823,7 @@ class PeerConn(Commands):
                             Message(
                                 sender= PeerConn.__name__,
                                 content= 'Connection lost with file port! The specified network name is no longer available.',
-                                date_time= datetime.now(),
+                                timestamp= time(),
                                 type= MessageTypes.CONNECTION_LOST
                             )
                         )
@@ -403,7 +832,21 @@ class PeerConn(Commands):
                     logger.error(f'{peersocket_ref.id} - {PeerConn._server_incomming_files.__name__}: {ex}')
                     break
                 finally:
-                    peersocket_ref.in_file_transaction = False
+                    if receiver != None:
+                        receiver.abort()
+                    if manifest_writer != None and not completed:
+                        await self._workers.run_io(manifest_writer.discard)
+                    if journal != None:
+                        journal.close() # Kept next to the partial file so the transfer can be resumed
+                    elif part_file_path != None and not completed and path.exists(part_file_path):
+                        remove(part_file_path) # Nothing to resume it from
+                    if peersocket_ref.incoming_stripes != None:
+                        peersocket_ref.incoming_stripes.close()
+                    peersocket_ref.incoming_stripes = None
+                    if part_file_path != None:
+                        self._part_paths.discard(part_file_path)
+                    if in_transaction:
+                        self._set_file_transaction(peersocket_ref, False)
         finally:
             notify: str = None
             if peersocket_ref.file_comm_connected:
@@ -414,61 +857,214 @@ class PeerConn(Commands):
                         Message(
                             sender= PeerConn.__name__,
                             content= notify,
-                            date_time= datetime.now(),
+                            timestamp= time(),
                             type= MessageTypes.CONNECTION_LOST
                         )
                     )
             peersocket_ref.history.new_messages += 1
             if peersocket_ref != None:
                 peersocket_ref.file_comm_connected = False
-                if peersocket_ref.servers != None:
-                    if peersocket_ref.servers.file_server != None:
-                        peersocket_ref.servers.file_server.close()
-                        await peersocket_ref.servers.file_server.wait_closed()
-                        peersocket_ref.servers.file_server = None
-
+                self._peersockets.refresh(peersocket_ref)
                 if peersocket_ref.streams != None:
                     if peersocket_ref.streams.file_writer != None:
                         peersocket_ref.streams.file_writer.close()
                         await peersocket_ref.streams.file_writer.wait_closed()
                         peersocket_ref.streams.file_writer = None
                         peersocket_ref.streams.file_reader = None
+                self._events.publish(PeerConnEvents.SOCKET_STATE, peersocket_ref.id)
+                if peersocket_ref.parent_id != None:
+                    self._end_session(peersocket_ref)
 
-    async def hm_connect(self, id: str) -> None:
+    async def hm_connect(self, id: str) -> bool:
+        """Returns whether both sockets are connected; the key exchange goes on in the message task.
+        From then on a supervisor task keeps the peersocket connected until hm_close."""
         peersocket_ref = self.get_socket(id)
         if peersocket_ref is not None:
-            self._logger.info(f'{peersocket_ref.id} - {self.hm_connect.__name__}: {peersocket_ref.peerdata.local_address}: {peersocket_ref.peerdata.msg_port}, {peersocket_ref.peerdata.file_port}')
-            try:
+            if peersocket_ref.supervisor != None:
+                peersocket_ref.supervisor.cancel()
+                peersocket_ref.supervisor = None
+            # A new session, whatever the server kept of an old one expires there
+            peersocket_ref.session_id = str(uuid4())
+            peersocket_ref.resume_ticket = None
+            if peersocket_ref.outbox == None:
+                peersocket_ref.outbox = deque(maxlen= self._OUTBOX_SIZE)
+            if await self._open_client(peersocket_ref):
+                peersocket_ref.reconnect = self._RECONNECT
+                peersocket_ref.supervisor = create_task(self._supervise(peersocket_ref))
+                return True
+        return False
+
+    async def _open_client(self, peersocket_ref: PeerSocket) -> bool:
+        """Opens the connections of a client peersocket and introduces them to its server by the session id,
+        with the resumption ticket when there is one; returns whether they are open."""
+        self._logger.info(f'{peersocket_ref.id} - {self._open_client.__name__}: {peersocket_ref.peerdata.local_address}: {peersocket_ref.peerdata.msg_port}, {peersocket_ref.peerdata.file_port}')
+        streams = Streams()
+        opened = False
+        try:
+            if peersocket_ref.resume_ticket == None:
                 peersocket_ref.key = await self.create_key()
-                peersocket_ref.streams = Streams()
-                peersocket_ref.events = Events(msg_event_server= Event(), msg_event_stream= Event(), file_event_server= Event(), file_event_stream= Event())
-                peersocket_ref.streams.msg_reader, peersocket_ref.streams.msg_writer = await open_connection(
-                    peersocket_ref.peerdata.local_address,
-                    peersocket_ref.peerdata.msg_port
-                )
+            peersocket_ref.streams = streams
+            peersocket_ref.mux = None
+            peersocket_ref.resumed = None
+            peersocket_ref.events = Events(msg_event_server= Event(), msg_event_stream= Event(), file_event_server= Event(), file_event_stream= Event())
+            streams.msg_reader, streams.msg_writer = await wait_for(open_connection(
+                peersocket_ref.peerdata.local_address,
+                peersocket_ref.peerdata.msg_port
+            ), self._CONNECT_TIMEOUT)
 
-                self._logger.info(f'{peersocket_ref.id} - {self.hm_connect.__name__}: Message server = OK.')
+            self._set_keepalive(streams.msg_writer)
+            self._logger.info(f'{peersocket_ref.id} - {self._open_client.__name__}: Message server = OK.')
 
-                peersocket_ref.streams.file_reader, peersocket_ref.streams.file_writer = await open_connection(
+            # Both connections open with the same session id, so a server with many clients pairs them up
+            session_hello = encode(SessionHello(peersocket_ref.session_id, peersocket_ref.resume_ticket))
+            if self._MULTIPLEX:
+                # The file channel shares the message connection, the server's file port isn't needed
+                write_frame(streams.msg_writer, FrameTypes.MUX_HELLO, session_hello)
+                self._multiplex(peersocket_ref, streams.msg_reader, streams.msg_writer)
+                self._logger.info(f'{peersocket_ref.id} - {self._open_client.__name__}: Multiplexed.')
+            else:
+                streams.file_reader, streams.file_writer = await wait_for(open_connection(
                     peersocket_ref.peerdata.local_address,
                     peersocket_ref.peerdata.file_port
+                ), self._CONNECT_TIMEOUT)
+
+                self._set_keepalive(streams.file_writer)
+                self._logger.info(f'{peersocket_ref.id} - {self._open_client.__name__}: File server = OK.')
+
+                write_frame(streams.msg_writer, FrameTypes.SESSION_HELLO, session_hello)
+                write_frame(streams.file_writer, FrameTypes.SESSION_HELLO, session_hello)
+            opened = True
+        except TimeoutError:
+            self._logger.error(f'{peersocket_ref.id} - {self._open_client.__name__}: Timeout!')
+        except Exception as ex:
+            self._logger.error(f'{peersocket_ref.id} - {self._open_client.__name__}: {ex}')
+        finally:
+            if not opened: # Also when cancelled, a half open pair isn't left behind
+                for writer in (streams.msg_writer, streams.file_writer):
+                    if writer != None:
+                        writer.close()
+                streams.msg_reader = streams.msg_writer = streams.file_reader = streams.file_writer = None
+        return opened
+
+    async def _supervise(self, peersocket_ref: PeerSocket) -> None:
+        """Runs the channels of a connected client peersocket. When the link drops without hm_close, it reconnects
+        after a jittered exponential backoff and presents the resumption ticket, so the session usually goes on
+        without a new key exchange. Cancelling it leaves running channels alone."""
+        attempt = 0
+        opened = True
+        while True:
+            if opened:
+                streams = peersocket_ref.streams
+                channels = [create_task(self._server_incomming_messages(streams.msg_reader, streams.msg_writer, peersocket_ref, self._logger)),
+                            create_task(self._server_incomming_files(streams.file_reader, streams.file_writer, peersocket_ref, self._logger))]
+                await wait(channels, return_when= FIRST_COMPLETED)
+                for writer in (streams.msg_writer, streams.file_writer): # Either channel ending takes the link down
+                    if writer != None:
+                        writer.close()
+                await wait(channels)
+                connected, _ = await gather(*channels, return_exceptions= True)
+                if connected is True:
+                    attempt = 0
+            if not peersocket_ref.reconnect:
+                return
+            attempt += 1
+            if attempt > self._RECONNECT_ATTEMPTS:
+                peersocket_ref.reconnect = False
+                self._logger.warning(f'{peersocket_ref.id} - {self._supervise.__name__}: Gave up after {self._RECONNECT_ATTEMPTS} attempts.')
+                self.no_repeat_notification_msg(peersocket_ref,
+                    Message(
+                        sender= PeerConn.__name__,
+                        content= 'Couldn\'t reconnect!',
+                        timestamp= time(),
+                        type= MessageTypes.SYSTEM_WARN
+                    )
                 )
+                return
+            # Full jitter: clients dropped together by the same outage don't come back together
+            delay = uniform(0, min(self._RECONNECT_MAX_DELAY, self._RECONNECT_BASE_DELAY * 2 ** (attempt - 1)))
+            self._logger.info(f'{peersocket_ref.id} - {self._supervise.__name__}: Reconnecting in {delay:.2f} s, attempt {attempt}.')
+            self.no_repeat_notification_msg(peersocket_ref,
+                Message(
+                    sender= PeerConn.__name__,
+                    content= 'Reconnecting..',
+                    timestamp= time(),
+                    type= MessageTypes.SYSTEM_WARN
+                )
+            )
+            await sleep(delay)
+            opened = await self._open_client(peersocket_ref)
+            if opened:
+                self._send_interrupted(peersocket_ref)
 
-                self._logger.info(f'{peersocket_ref.id} - {self.hm_connect.__name__}: File server = OK.')
+    def _send_interrupted(self, peersocket_ref: PeerSocket) -> None:
+        """Queues the send the link dropped again, the receiver's journal makes it resume where it stopped.
+        Queued as a command, it runs after the supervisor has started the channels of the new connection."""
+        if peersocket_ref.interrupted_send != None:
+            self._logger.info(f'{peersocket_ref.id} - {self._send_interrupted.__name__}: Sending {peersocket_ref.interrupted_send} again.')
+            self.send_file(peersocket_ref.id, peersocket_ref.interrupted_send)
+            peersocket_ref.interrupted_send = None
 
-                create_task(self._server_incomming_messages(peersocket_ref.streams.msg_reader, peersocket_ref.streams.msg_writer, peersocket_ref, self._logger))
-                create_task(self._server_incomming_files(peersocket_ref.streams.file_reader, peersocket_ref.streams.file_writer, peersocket_ref, self._logger))
+    async def _heartbeat(self, peersocket_ref: PeerSocket, writer: StreamWriter) -> None:
+        """Pings the peer on the message channel every heartbeat interval, the answers feed the round trip estimate.
+        A peer silent for _HEARTBEAT_MISSES intervals is taken for dead and its connections are aborted,
+        so a half open link doesn't look connected and a client goes on to reconnect."""
+        loop = get_running_loop()
+        link = peersocket_ref.link
+        while not writer.is_closing():
+            await sleep(self._HEARTBEAT_INTERVAL)
+            link.missed = int((loop.time() - link.last_heard) / self._HEARTBEAT_INTERVAL)
+            if link.missed >= self._HEARTBEAT_MISSES:
+                self._logger.warning(f'{peersocket_ref.id} - {self._heartbeat.__name__}: No answer for {link.missed} heartbeats, the peer is gone!')
+                peersocket_ref.history.messages.append(
+                    Message(
+                        sender= PeerConn.__name__,
+                        content= 'Peer stopped answering!',
+                        timestamp= time(),
+                        type= MessageTypes.CONNECTION_LOST
+                    )
+                )
+                self._abort_link(peersocket_ref)
+                return
+            write_frame(writer, FrameTypes.HEARTBEAT, encode(loop.time())) # Not drained, a stuck buffer must not stall the check
 
-            except Exception as ex:
-                self._logger.error(f'{id} - {self.hm_connect.__name__}: {ex}')
+    def _abort_link(self, peersocket_ref: PeerSocket) -> None:
+        """Drops the connections of a peersocket at once; closing them would wait for a dead peer to take the buffered bytes."""
+        if peersocket_ref.mux != None:
+            peersocket_ref.mux.abort()
+        for writer in (peersocket_ref.streams.msg_writer, peersocket_ref.streams.file_writer):
+            if writer != None:
+                writer.transport.abort()
+
+    def _set_keepalive(self, writer: StreamWriter) -> None:
+        """TCP keepalive probes of the OS, which notice a vanished peer even while the heartbeats are off."""
+        sock = writer.get_extra_info('socket')
+        if not self._TCP_KEEPALIVE or sock == None:
+            return
+        try:
+            sock.setsockopt(SOL_SOCKET, SO_KEEPALIVE, 1)
+            if TCP_KEEPIDLE != None:
+                sock.setsockopt(IPPROTO_TCP, TCP_KEEPIDLE, self._TCP_KEEPALIVE_IDLE)
+                sock.setsockopt(IPPROTO_TCP, TCP_KEEPINTVL, self._TCP_KEEPALIVE_INTERVAL)
+                sock.setsockopt(IPPROTO_TCP, TCP_KEEPCNT, self._TCP_KEEPALIVE_COUNT)
+        except OSError as ex:
+            self._logger.warning(f'{self._set_keepalive.__name__}: {ex}')
 
     async def hm_close_all(self) -> None:
         for peersocket in self._peersockets:
-            await self.hm_close(peersocket.id)
+            if peersocket.parent_id == None: # Sessions are closed with their server
+                await self.hm_close(peersocket.id)
 
     async def hm_exit(self) -> None:
         await self.hm_close_all()
         self._peersockets.clear()
+        self._workers.shutdown()
+        for lane, lane_stats in self._dispatcher.stats.items():
+            self._logger.info(f'{self.hm_exit.__name__}: Command lane {lane}: {lane_stats}')
+        self._history_database.close()
+        try:
+            remove(self._history_database.file_path)
+        except OSError as ex:
+            self._logger.warning(f'{self.hm_exit.__name__}: {ex}')
         self._logger.info(f'{self.hm_exit.__name__}: Active peersockets = {len(self._peersockets)}')
         self._logger.info(f'{self.hm_exit.__name__}: Exiting {PeerConn.__name__}..')
 
@@ -476,22 +1072,29 @@ class PeerConn(Commands):
         try:
             peersocket_ref = self.get_socket(id)
             if peersocket_ref != None:
-                if peersocket_ref.streams != None:
-                    if peersocket_ref.streams.msg_writer != None:
-                        packet = PeerPacket(sender= self._peerdata, target= peersocket_ref.streams.msg_writer.get_extra_info('peername'), message= Message(self._peerdata.name, data, datetime.now(), MessageTypes.ME))
-                        packet_dump = pickle_dumps(packet)
-                        encrypted_dump = peersocket_ref.cipher_suite.encrypt(packet_dump)
-                        peersocket_ref.streams.msg_writer.write(encrypted_dump)
+                if peersocket_ref.sessions != None:
+                    await self._broadcast_message(peersocket_ref, data)
+                elif peersocket_ref.streams != None:
+                    if peersocket_ref.streams.msg_writer != None and peersocket_ref.message_batcher != None:
+                        packet = PeerPacket(sender= self._peerdata, target= peersocket_ref.streams.msg_writer.get_extra_info('peername'), message= Message(self._peerdata.name, data, time(), MessageTypes.ME))
+                        peersocket_ref.message_batcher.add(encode(packet))
                         peersocket_ref.history.messages.append(packet.message)
-                        await peersocket_ref.streams.msg_writer.drain()
-                        self._logger.info(f'{peersocket_ref.id} - {self.hm_send_message.__name__}: Sent!')
+                        await peersocket_ref.message_batcher.drain()
+                        self._logger.info(f'{peersocket_ref.id} - {self.hm_send_message.__name__}: Queued!')
+                    elif peersocket_ref.reconnect: # Replayed once the supervisor has the link back
+                        message = Message(self._peerdata.name, data, time(), MessageTypes.ME)
+                        if len(peersocket_ref.outbox) == peersocket_ref.outbox.maxlen:
+                            self._logger.warning(f'{peersocket_ref.id} - {self.hm_send_message.__name__}: Outbox is full, dropped the oldest message!')
+                        peersocket_ref.outbox.append(encode(PeerPacket(sender= self._peerdata, message= message)))
+                        peersocket_ref.history.messages.append(message)
+                        self._logger.info(f'{peersocket_ref.id} - {self.hm_send_message.__name__}: Queued until the link is back!')
                     else:
                         self._logger.info(f'{peersocket_ref.id} - {self.hm_send_message.__name__}: Can\'t sent!')
                         self.no_repeat_notification_msg(
                             peersocket_ref, Message(
                                 sender= PeerConn.__name__,
                                 content= 'Message can\'t be send!',
-                                date_time= datetime.now(),
+                                timestamp= time(),
                                 type= MessageTypes.SYSTEM_WARN
                             )
                         )
@@ -500,84 +1103,319 @@ class PeerConn(Commands):
                             peersocket_ref, Message(
                                 sender= PeerConn.__name__,
                                 content= 'No connection!',
-                                date_time= datetime.now(),
+                                timestamp= time(),
                                 type= MessageTypes.SYSTEM_WARN
                             )
                         )
         except ConnectionError as ex:
             self._logger.error(f'{id} - {self.hm_send_message.__name__}: {ex}')
-            await self.close(id)
+            await self.hm_close(id)
+
+    async def _broadcast_message(self, server_ref: PeerSocket, data: str) -> None:
+        """Sends a message to every session of a server, encoded once; it is kept in the server's history only."""
+        batchers = [session_ref.message_batcher for session_ref in server_ref.sessions.values() if session_ref.message_batcher != None]
+        if not batchers:
+            self.no_repeat_notification_msg(
+                server_ref, Message(
+                    sender= PeerConn.__name__,
+                    content= 'No connection!',
+                    timestamp= time(),
+                    type= MessageTypes.SYSTEM_WARN
+                )
+            )
+            return
+        message = Message(self._peerdata.name, data, time(), MessageTypes.ME)
+        packet = encode(PeerPacket(sender= self._peerdata, message= message))
+        for batcher in batchers:
+            batcher.add(packet)
+        server_ref.history.messages.append(message)
+        await gather(*(batcher.drain() for batcher in batchers), return_exceptions= True) # A broken session doesn't hold back the others
+        self._logger.info(f'{server_ref.id} - {self._broadcast_message.__name__}: Queued for {len(batchers)} sessions!')
+
+    async def _broadcast_file(self, server_ref: PeerSocket, send: Callable[[str], Awaitable[None]]) -> None:
+        """Runs a file send for every session of a server at once."""
+        if server_ref.in_file_transaction:
+            return
+        self._set_file_transaction(server_ref, True)
+        try:
+            await gather(*(send(session_id) for session_id in list(server_ref.sessions)))
+        finally:
+            self._set_file_transaction(server_ref, False)
+
+    def _seal_message(self, peersocket_ref: PeerSocket, payload: bytes) -> Tuple[bytes, int]:
+        """Compresses a message frame's payload when it is large enough, then encrypts it; returns it with its frame flags."""
+        flags = 0
+        if peersocket_ref.compression != None and len(payload) >= self._MESSAGE_COMPRESSION_MIN:
+            payload, flags, _ = compress_chunk(peersocket_ref.compression, payload)
+        return peersocket_ref.cipher_suite.encrypt(payload), flags
 
     async def hm_send_file(self, id: str, file_path: str) -> None:
+        if path.isdir(file_path):
+            await self.hm_send_files(id, [file_path])
+            return
+        server_ref = self.get_socket(id)
+        if server_ref != None and server_ref.sessions != None:
+            await self._broadcast_file(server_ref, partial(self.hm_send_file, file_path= file_path))
+            return
+        peersocket_ref = None
+        in_transaction = False # Whether this call took the transaction, only then it releases it
         try:
-            path.isdir(file_path)
             peersocket_ref = self.get_socket(id)
             if peersocket_ref != None and not peersocket_ref.in_file_transaction:
                 if peersocket_ref.streams.file_writer != None:
-                    peersocket_ref.in_file_transaction = True
+                    self._set_file_transaction(peersocket_ref, True)
+                    in_transaction = True
+                    file_writer = peersocket_ref.streams.file_writer
                     file_name_without_extension, file_extension = path.splitext(file_path)
                     file_name_without_extension = file_name_without_extension.split('/')[-1]
-                    file_data = FileData(name= file_name_without_extension, extension= file_extension, size= path.getsize(file_path))
-                    serialized_file_data = pickle_dumps(file_data)
+                    file_data = FileData(name= file_name_without_extension, extension= file_extension, size= path.getsize(file_path), cipher= peersocket_ref.file_cipher_mode)
+                    if peersocket_ref.trusted_link and (not self._ENCRYPT_FILES or file_extension.lower() in self._PRE_ENCRYPTED_EXTENSIONS):
+                        file_data.cipher = CipherModes.NONE
+                    else:
+                        file_data.compression = peersocket_ref.compression
+                        if file_data.cipher != CipherModes.FERNET:
+                            file_data.nonce_prefix = new_nonce_prefix()
+                    cipher = file_cipher(file_data.cipher, peersocket_ref.file_key, peersocket_ref.key, file_data.nonce_prefix)
+                    file_data.transfer_id = TransferJournal.transfer_id(file_path)
+                    if (peersocket_ref.servers == None and peersocket_ref.parent_id == None and peersocket_ref.file_streams > 1 and
+                        file_data.cipher != CipherModes.NONE and file_data.size >= self._STRIPE_MIN_SIZE):
+                        file_data.stripes = peersocket_ref.file_streams
+                    if peersocket_ref.dedup and file_data.cipher != CipherModes.NONE and file_data.size >= self._DEDUP_MIN_SIZE:
+                        file_stat = stat(file_path)
+                        file_data.chunk_hashes = await self._workers.run_io(file_chunk_hashes, file_path, file_stat.st_size, file_stat.st_mtime_ns)
+                    serialized_file_data = encode(file_data)
                     self._logger.info(f'{peersocket_ref.id} - {PeerConn.hm_send_file.__name__}: Sending a file: {file_data}')
                     self.no_repeat_notification_msg(peersocket_ref,
                         Message(
                             sender= PeerConn.__name__,
                             content= f'Sending [{file_data.name}{file_data.extension}, {file_data.size}] to {peersocket_ref.peerdata.name}.',
-                            date_time= datetime.now(),
+                            timestamp= time(),
                             type= MessageTypes.FILE_NOTIFY_0
                         )
                     )
-                    peersocket_ref.streams.file_writer.write(serialized_file_data)
-                    peersocket_ref.streams.file_writer.write(self._file_delimiter)
-                    with open(file_path, 'rb') as file:
-                        total_write = 0
-                        while not peersocket_ref.events.file_event_stream.is_set():
-                            chunk = file.read(1024 * 2)
-                            if not chunk:
-                                peersocket_ref.file_percentage = 0
-                                peersocket_ref.in_file_transaction = False
-                                break
-                            encrypted_chunk = peersocket_ref.cipher_suite.encrypt(chunk)
-                            peersocket_ref.streams.file_writer.write(encrypted_chunk)
-                            await peersocket_ref.streams.file_writer.drain()
-                            total_write += len(chunk)
-                            peersocket_ref.file_percentage = round((total_write * 100) / file_data.size)
-                            await sleep(self._SLEEP_TIME)
-                    if peersocket_ref.events.file_event_stream.is_set():
-                        self._logger.info(f'{peersocket_ref.id} - {self.hm_send_file.__name__}: Cancelled!')
-                        self.no_repeat_notification_msg(peersocket_ref,
-                            Message(
-                                sender= PeerConn.__name__,
-                                content= f'[{file_data.name}{file_data.extension}] is cancelled!',
-                                date_time= datetime.now(),
-                                type= MessageTypes.FILE_NOTIFY_1
-                            )
-                        )
+                    while not peersocket_ref.file_replies.empty():
+                        peersocket_ref.file_replies.get_nowait() # Stale replies of an abandoned transfer
+                    write_frame(peersocket_ref.streams.file_writer, FrameTypes.FILE_HEADER, serialized_file_data)
+                    await peersocket_ref.streams.file_writer.drain()
+                    reply = await self._wait_file_resume(peersocket_ref, file_data.transfer_id, file_writer)
+                    if reply == None:
+                        await self._finish_file_send(peersocket_ref, file_data, TransferStats(size= file_data.size))
+                        return
+                    offset = reply.offset
+                    if reply.missing != None:
+                        self._logger.info(f'{peersocket_ref.id} - {self.hm_send_file.__name__}: Peer lacks {len(reply.missing)} of {len(file_data.chunk_hashes)} chunks.')
+                    elif offset:
+                        self._logger.info(f'{peersocket_ref.id} - {self.hm_send_file.__name__}: Resuming from {offset}.')
+                    if file_data.stripes > 1 or file_data.chunk_hashes != None:
+                        stats = await self._send_file_ranges(peersocket_ref, file_path, file_data, cipher, offset, reply.missing)
                     else:
-                        self._logger.info(f'{peersocket_ref.id} - {self.hm_send_file.__name__}: Sent!')
-                        self.no_repeat_notification_msg(peersocket_ref,
-                            Message(
-                                sender= PeerConn.__name__,
-                                content= f'[{file_data.name}{file_data.extension}] is sent to {peersocket_ref.peerdata.name}!',
-                                date_time= datetime.now(),
-                                type= MessageTypes.FILE_NOTIFY_1
-                            )
-                        )
-                    peersocket_ref.events.file_event_stream.clear()
+                        with open(file_path, 'rb') as file:
+                            file.seek(offset)
+                            sender = FileSender(peersocket_ref.streams.file_writer, cipher, peersocket_ref.events.file_event_stream, self._workers, file_data.compression,
+                                                zero_copy= peersocket_ref.mux == None, shaper= self._transfer_shaper(peersocket_ref))
+                            if file_data.cipher == CipherModes.NONE:
+                                stats = await sender.send_raw(file, file_data.size, partial(self._update_file_progress, peersocket_ref), offset)
+                            else:
+                                stats = await sender.send(file, file_data.size, partial(self._update_file_progress, peersocket_ref), offset)
+                    await self._finish_file_send(peersocket_ref, file_data, stats)
                 else:
                     self.no_repeat_notification_msg(peersocket_ref,
                         Message(
                             sender= PeerConn.__name__,
                             content= 'File can\'t be send!',
-                            date_time= datetime.now(),
+                            timestamp= time(),
+                            type= MessageTypes.SYSTEM_WARN
+                        )
+                    )
+        except Exception as ex:
+            self._logger.error(f'{id} - {self.hm_send_file.__name__}: {ex}')
+            if in_transaction and peersocket_ref.reconnect and isinstance(ex, (ConnectionError, IncompleteReadError)):
+                peersocket_ref.interrupted_send = file_path # The link dropped, it is offered again once reconnected
+                reopened_writer = peersocket_ref.streams.file_writer if peersocket_ref.streams != None else None
+                if reopened_writer != None and reopened_writer is not file_writer and not reopened_writer.is_closing():
+                    self._send_interrupted(peersocket_ref) # ...which already happened while this send noticed
+        finally:
+            if in_transaction:
+                self._set_file_transaction(peersocket_ref, False)
+
+    async def hm_send_files(self, id: str, file_paths: List[str]) -> None:
+        """Sends files and directory trees as one transaction: a manifest of paths, sizes and hashes in the header,
+        then every file's bytes back-to-back as a single chunk stream, with no round trip per file."""
+        server_ref = self.get_socket(id)
+        if server_ref != None and server_ref.sessions != None:
+            await self._broadcast_file(server_ref, partial(self.hm_send_files, file_paths= file_paths))
+            return
+        peersocket_ref = None
+        in_transaction = False # Whether this call took the transaction, only then it releases it
+        try:
+            peersocket_ref = self.get_socket(id)
+            if peersocket_ref != None and not peersocket_ref.in_file_transaction:
+                if peersocket_ref.streams.file_writer != None:
+                    self._set_file_transaction(peersocket_ref, True)
+                    in_transaction = True
+                    entries, sources = await self._workers.run_io(build_manifest, file_paths)
+                    name = path.basename(path.abspath(file_paths[0])) + (f' and {len(file_paths) - 1} more' if len(file_paths) > 1 else '')
+                    file_data = FileData(name= name, extension= '', size= sum(entry.size for entry in entries), cipher= peersocket_ref.file_cipher_mode,
+                                         manifest= entries, compression= peersocket_ref.compression)
+                    if file_data.cipher != CipherModes.FERNET:
+                        file_data.nonce_prefix = new_nonce_prefix()
+                    cipher = file_cipher(file_data.cipher, peersocket_ref.file_key, peersocket_ref.key, file_data.nonce_prefix)
+                    self._logger.info(f'{peersocket_ref.id} - {PeerConn.hm_send_files.__name__}: Sending {len(entries)} files, {file_data.size} bytes as [{file_data.name}].')
+                    self.no_repeat_notification_msg(peersocket_ref,
+                        Message(
+                            sender= PeerConn.__name__,
+                            content= f'Sending [{file_data.name}, {len(entries)} files, {file_data.size}] to {peersocket_ref.peerdata.name}.',
+                            timestamp= time(),
+                            type= MessageTypes.FILE_NOTIFY_0
+                        )
+                    )
+                    write_frame(peersocket_ref.streams.file_writer, FrameTypes.FILE_HEADER, encode(file_data))
+                    await peersocket_ref.streams.file_writer.drain()
+                    with ManifestReader(sources, entries) as reader:
+                        sender = FileSender(peersocket_ref.streams.file_writer, cipher, peersocket_ref.events.file_event_stream, self._workers, file_data.compression,
+                                            shaper= self._transfer_shaper(peersocket_ref))
+                        stats = await sender.send(reader, file_data.size, partial(self._update_file_progress, peersocket_ref))
+                    await self._finish_file_send(peersocket_ref, file_data, stats)
+                else:
+                    self.no_repeat_notification_msg(peersocket_ref,
+                        Message(
+                            sender= PeerConn.__name__,
+                            content= 'Files can\'t be send!',
+                            timestamp= time(),
                             type= MessageTypes.SYSTEM_WARN
                         )
                     )
         except Exception as ex:
-            self._logger.error(f'{id} - {self.hm_send_file.__name__}: {peersocket_ref.id}, {ex}')
+            self._logger.error(f'{id} - {self.hm_send_files.__name__}: {ex}')
+        finally:
+            if in_transaction:
+                self._set_file_transaction(peersocket_ref, False)
+
+    async def _finish_file_send(self, peersocket_ref: PeerSocket, file_data: FileData, stats: TransferStats) -> None:
+        """Ends the transaction with FILE_END, or FILE_CANCEL when the user cancelled it."""
+        peersocket_ref.file_percentage = 0
+        peersocket_ref.file_throughput = stats.throughput
+        if peersocket_ref.events.file_event_stream.is_set():
+            write_frame(peersocket_ref.streams.file_writer, FrameTypes.FILE_CANCEL)
+            await peersocket_ref.streams.file_writer.drain()
+            self._logger.info(f'{peersocket_ref.id} - {self._finish_file_send.__name__}: Cancelled!')
+            self.no_repeat_notification_msg(peersocket_ref,
+                Message(
+                    sender= PeerConn.__name__,
+                    content= f'[{file_data.name}{file_data.extension}] is cancelled!',
+                    timestamp= time(),
+                    type= MessageTypes.FILE_NOTIFY_1
+                )
+            )
+        else:
+            write_frame(peersocket_ref.streams.file_writer, FrameTypes.FILE_END, encode(stats.stripes) if file_data.stripes > 1 else b'')
+            await peersocket_ref.streams.file_writer.drain()
+            self._logger.info(f'{peersocket_ref.id} - {self._finish_file_send.__name__}: Sent! {stats}')
+            self.no_repeat_notification_msg(peersocket_ref,
+                Message(
+                    sender= PeerConn.__name__,
+                    content= f'[{file_data.name}{file_data.extension}] is sent to {peersocket_ref.peerdata.name}! ({stats.throughput / (1024 * 1024):.2f} MiB/s)',
+                    timestamp= time(),
+                    type= MessageTypes.FILE_NOTIFY_1
+                )
+            )
+        peersocket_ref.events.file_event_stream.clear()
+
+    async def _send_file_ranges(self, peersocket_ref: PeerSocket, file_path: str, file_data: FileData, cipher: ChunkCipher, offset: int,
+                                missing: List[int] | None) -> TransferStats:
+        """Sends FILE_RANGE frames over the extra data connections of a striped transfer, or over the file socket
+        when the file is only deduplicated; missing limits them to the chunks the receiver lacks. When a data connection
+        can't be opened, the ones already open carry the ranges, or the file socket when none is; FILE_END tells how many."""
+        writers: List[StreamWriter] = []
+        try:
+            if file_data.stripes > 1:
+                for index in range(file_data.stripes):
+                    try:
+                        _, writer = await wait_for(open_connection(
+                            peersocket_ref.peerdata.local_address,
+                            peersocket_ref.peerdata.file_port
+                        ), self._CONNECT_TIMEOUT)
+                    except (TimeoutError, OSError) as ex:
+                        self._logger.warning(f'{peersocket_ref.id} - {self._send_file_ranges.__name__}: Data connection {index} failed, {ex!r}')
+                        break
+                    writers.append(writer)
+                    write_frame(writer, FrameTypes.STRIPE_HELLO, encode(StripeHello(file_data.transfer_id, index)))
+                self._logger.info(f'{peersocket_ref.id} - {self._send_file_ranges.__name__}: {len(writers)} data connections.')
+            sender = StripedFileSender(writers or [peersocket_ref.streams.file_writer], cipher, peersocket_ref.events.file_event_stream, self._workers, file_data.compression,
+                                       shaper= self._transfer_shaper(peersocket_ref))
+            stats = await sender.send(file_path, file_data.size, partial(self._update_file_progress, peersocket_ref), offset, missing)
+            stats.stripes = len(writers)
+            return stats
+        finally:
+            for writer in writers:
+                writer.close()
+                await writer.wait_closed()
+
+    def _handle_file_reply(self, peersocket_ref: PeerSocket, frame: Frame) -> bool:
+        """Routes replies meant for our own outgoing transfer; they share the stream with the peer's file frames."""
+        if frame.type == FrameTypes.FILE_RESUME:
+            peersocket_ref.file_replies.put_nowait(decode(frame.payload))
+            return True
+        return False
+
+    async def _wait_file_resume(self, peersocket_ref: PeerSocket, transfer_id: str, file_writer: StreamWriter) -> FileResume | None:
+        """Waits for the receiver's resume offset however long verifying its partial file takes, since it has already
+        seeked there; returns None once the send is cancelled and raises once the file socket closes."""
+        getting = create_task(peersocket_ref.file_replies.get())
+        cancelled = create_task(peersocket_ref.events.file_event_stream.wait())
+        try:
+            while True:
+                done, _ = await wait((getting, cancelled), timeout= self._FILE_REPLY_TIMEOUT, return_when= FIRST_COMPLETED)
+                if getting in done:
+                    reply: FileResume = getting.result()
+                    if reply.transfer_id == transfer_id:
+                        return reply
+                    getting = create_task(peersocket_ref.file_replies.get())
+                elif cancelled in done:
+                    return None
+                elif file_writer.is_closing():
+                    raise ConnectionResetError('The file socket closed before the resume reply!')
+                else:
+                    self._logger.info(f'{peersocket_ref.id} - {self._wait_file_resume.__name__}: Still waiting for the resume reply..')
         finally:
-            peersocket_ref.in_file_transaction = False
+            getting.cancel()
+            cancelled.cancel()
+
+    def _part_path_for(self, received_file_path: str) -> str:
+        """The file's name plus .part, where an interrupted transfer of it left its journal; when another
+        peersocket is receiving a file of the same name right now, a numbered one instead."""
+        part_file_path = received_file_path + TransferJournal.PART_SUFFIX
+        number = 1
+        while part_file_path in self._part_paths:
+            part_file_path = f'{received_file_path}.{number}{TransferJournal.PART_SUFFIX}'
+            number += 1
+        self._part_paths.add(part_file_path)
+        return part_file_path
+
+    def _content_index_for(self, root: str) -> ContentIndex:
+        """Also starts a background refresh, unless one is running, for the files that got there other than by a receive."""
+        if self._content_index == None or self._content_index.root != root:
+            self._content_index = ContentIndex(root)
+        if self._content_refresh == None or self._content_refresh.done():
+            self._content_refresh = create_task(self._refresh_content_index(self._content_index))
+        return self._content_index
+
+    async def _refresh_content_index(self, content_index: ContentIndex) -> None:
+        try:
+            await self._workers.run_io(content_index.refresh)
+        except Exception as ex:
+            self._logger.warning(f'{self._refresh_content_index.__name__}: {ex}')
+
+    def _set_file_transaction(self, peersocket_ref: PeerSocket, in_file_transaction: bool) -> None:
+        peersocket_ref.in_file_transaction = in_file_transaction
+        self._events.publish(PeerConnEvents.FILE_PROGRESS, peersocket_ref.id)
+
+    def _update_file_progress(self, peersocket_ref: PeerSocket, stats: TransferStats) -> None:
+        percentage = stats.percentage
+        peersocket_ref.file_throughput = stats.throughput
+        if percentage != peersocket_ref.file_percentage: # Called per chunk, published per percent
+            peersocket_ref.file_percentage = percentage
+            self._events.publish(PeerConnEvents.FILE_PROGRESS, peersocket_ref.id)
 
     def no_repeat_notification_msg(self, peersocket_ref: PeerSocket, message: Message) -> None:
         if peersocket_ref.history.messages:
@@ -607,6 +1445,72 @@ class PeerConn(Commands):
         self._logger.error(f'{self.get_ipv4_address.__name__}: Cannot found!')
         return None
 
+    def _route_commands(self) -> None:
+        routes = {
+            PeerConn.CommandTypes.set_server:           CommandRoute(self.hm_set_server, CommandLanes.SESSION),
+            PeerConn.CommandTypes.connect:              CommandRoute(self.hm_connect, CommandLanes.SESSION),
+            PeerConn.CommandTypes.send_message:         CommandRoute(self.hm_send_message, CommandLanes.BULK),
+            PeerConn.CommandTypes.send_file:            CommandRoute(self.hm_send_file, CommandLanes.BULK, detached= True),
+            PeerConn.CommandTypes.send_files:           CommandRoute(self.hm_send_files, CommandLanes.BULK, detached= True),
+            PeerConn.CommandTypes.cancel_file:          CommandRoute(self._cancel_file, CommandLanes.CONTROL),
+            PeerConn.CommandTypes.set_rate_limit:       CommandRoute(self.hm_set_rate_limit, CommandLanes.CONTROL),
+            PeerConn.CommandTypes.change_download_dir:  CommandRoute(self._change_download_dir, CommandLanes.CONTROL, keyed= False),
+            PeerConn.CommandTypes.config_file:          CommandRoute(self.configuration_file, CommandLanes.CONTROL, keyed= False),
+            PeerConn.CommandTypes.close:                CommandRoute(self.hm_close, CommandLanes.CONTROL),
+            PeerConn.CommandTypes.close_all:            CommandRoute(self.hm_close_all, CommandLanes.CONTROL, keyed= False),
+            PeerConn.CommandTypes.remove:               CommandRoute(self.remove_peer_socket, CommandLanes.CONTROL),
+            PeerConn.CommandTypes.exit:                 CommandRoute(self.hm_exit, CommandLanes.CONTROL, keyed= False)
+        }
+        for command_type, route in routes.items():
+            self._dispatcher.route(command_type, route)
+
+    def _cancel_file(self, id: str) -> None:
+        peersocket_ref = self.get_socket(id)
+        if peersocket_ref != None and peersocket_ref.events != None:
+            peersocket_ref.events.file_event_stream.set()
+            for session_ref in (peersocket_ref.sessions or {}).values(): # A broadcast file goes out on every session
+                if session_ref.events != None and session_ref.in_file_transaction:
+                    session_ref.events.file_event_stream.set()
+        else:
+            self._logger.warning(f'{self._cancel_file.__name__}: {id} not found!')
+
+    def hm_set_rate_limit(self, id: str | None, rate: float, weight: float | None = None) -> None:
+        """Takes effect from the next chunk of the sends already running."""
+        if id == None:
+            self._uplink.bucket.set_rate(rate)
+            self._logger.info(f'{self.hm_set_rate_limit.__name__}: Global upload rate {rate or "unlimited"}.')
+            return
+        peersocket_ref = self.get_socket(id)
+        if peersocket_ref == None:
+            self._logger.warning(f'{self.hm_set_rate_limit.__name__}: {id} not found!')
+            return
+        uplink = self._uplink_of(peersocket_ref)
+        uplink.bucket.set_rate(rate)
+        if weight != None:
+            uplink.weight = weight
+        self._logger.info(f'{peersocket_ref.id} - {PeerConn.hm_set_rate_limit.__name__}: Upload rate {rate or "unlimited"}, weight {uplink.weight}.')
+
+    def _uplink_of(self, peersocket_ref: PeerSocket) -> FairScheduler:
+        if peersocket_ref.uplink == None:
+            peersocket_ref.uplink = FairScheduler(TokenBucket(self._PEERSOCKET_UPLOAD_RATE))
+        return peersocket_ref.uplink
+
+    def _transfer_shaper(self, peersocket_ref: PeerSocket) -> TransferShaper:
+        """Paces a send by the peersocket's limit, its server's for a session, then the global one."""
+        schedulers = [self._uplink_of(peersocket_ref)]
+        server_ref = self.get_socket(peersocket_ref.parent_id) if peersocket_ref.parent_id != None else None
+        if server_ref != None:
+            schedulers.append(self._uplink_of(server_ref))
+        schedulers.append(self._uplink)
+        return TransferShaper(schedulers)
+
+    def _change_download_dir(self, dir_path: str) -> None:
+        PeerConn._DOWNLOADS_DIR = dir_path
+
+    def get_command_stats(self) -> Dict[int, LaneStats]:
+        """Queue depth and wait times of the command dispatcher by CommandLanes value."""
+        return self._dispatcher.stats
+
     async def thread_main(self) -> None:
         try:
             self._logger.info(f'{self.thread_main.__name__}: Running.')
@@ -615,28 +1519,11 @@ class PeerConn(Commands):
                 try:
                     command: PeerConn.Command = await self._command_queue.get()
                     self._logger.info(f'{self.thread_main.__name__}: {command.type}')
-                    if command.type == PeerConn.CommandTypes.set_server:
-                        await self.hm_set_server(command.content[0])
-                    elif command.type == PeerConn.CommandTypes.connect:
-                        await self.hm_connect(command.content[0])
-                    elif command.type == PeerConn.CommandTypes.send_message:
-                        await self.hm_send_message(command.content[0], command.content[1])
-                    elif command.type == PeerConn.CommandTypes.send_file:
-                        create_task(self.hm_send_file(command.content[0], command.content[1]))
-                    elif command.type == PeerConn.CommandTypes.cancel_file:
-                        self.get_socket(command.content[0]).events.file_event_stream.set()
-                    elif command.type == PeerConn.CommandTypes.change_download_dir:
-                        PeerConn._DOWNLOADS_DIR = command.content[0]
-                    elif command.type == PeerConn.CommandTypes.config_file:
-                        self.configuration_file(command.content[0])
-                    elif command.type == PeerConn.CommandTypes.close:
-                        await self.hm_close(command.content[0])
-                    elif command.type == PeerConn.CommandTypes.close_all:
-                        await self.hm_close_all()
-                    elif command.type == PeerConn.CommandTypes.exit:
-                        await self.hm_exit()
+                    if command.type == PeerConn.CommandTypes.exit:
+                        await self._dispatcher.run(command)
                         break
-                except CancelledError:
+                    self._dispatcher.submit(command)
+                except CancelledError as ex:
                     self._logger.error(f'{self.thread_main.__name__}: {ex}')
                 except Exception as ex:
                     self._logger.error(f'{self.thread_main.__name__}: {ex}')
@@ -0,0 +1,89 @@
+from peerconn_models import (StreamWriter, FrameTypes, BatchStats)
+from peerconn_framing import (write_frame)
+from peerconn_codec import (encode_list)
+from asyncio import (TimerHandle, get_running_loop)
+from typing import (Callable, Deque, List, Tuple)
+
+class BatchFlushes:
+    IDLE:                   int = 0     # The packet found nothing sent within the latency budget
+    TIMER:                  int = 1     # The latency budget of the oldest pending packet ran out
+    SIZE:                   int = 2     # The pending packets reached max_bytes or max_count
+    CLOSE:                  int = 3     # The peersocket is closing
+
+class MessageBatcher:
+    """Outgoing message queue of a peersocket that coalesces encoded PeerPackets into one frame, Nagle-style:
+    a packet that finds the link idle goes out at once, the ones following it within delay seconds share
+    a single MESSAGE_BATCH frame, sealed (compressed and encrypted) once. A batch reaching max_bytes or
+    max_count is flushed without waiting; a delay of 0 sends every packet in its own frame. Packets still pending
+    once the writer is closing go back to the front of outbox, if any, to be replayed over the next connection."""
+    def __init__(self, writer: StreamWriter, seal: Callable[[bytes], Tuple[bytes, int]],
+                 delay: float, max_bytes: int, max_count: int, outbox: Deque[bytes] | None = None) -> None:
+        self.stats = BatchStats()
+        self.delay = delay
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self._writer = writer
+        self._seal = seal                   # Payload -> frame payload and flags
+        self._outbox = outbox
+        self._loop = get_running_loop()
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._flush_handle: TimerHandle | None = None
+        self._last_flush = float('-inf')    # loop.time() of the last frame
+
+    def add(self, packet: bytes) -> None:
+        """Queues an encode()d PeerPacket; it is written within delay seconds at the latest."""
+        self._pending.append(packet)
+        self._pending_bytes += len(packet)
+        self.stats.messages += 1
+        if len(self._pending) >= self.max_count or self._pending_bytes >= self.max_bytes:
+            self.flush(BatchFlushes.SIZE)
+        elif self._flush_handle == None:
+            wait = self._last_flush + self.delay - self._loop.time()
+            if wait <= 0:
+                self.flush(BatchFlushes.IDLE)
+            else:
+                self._flush_handle = self._loop.call_later(wait, self.flush, BatchFlushes.TIMER)
+
+    def flush(self, reason: int = BatchFlushes.TIMER) -> None:
+        if self._flush_handle != None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = []
+        self._pending_bytes = 0
+        if self._writer.is_closing():
+            if self._outbox == None:
+                self.stats.dropped += len(pending)
+            else: # Older than anything queued since, a full outbox drops the oldest as usual
+                queued = pending + list(self._outbox)
+                self._outbox.clear()
+                self._outbox.extend(queued)
+                self.stats.dropped += len(queued) - len(self._outbox)
+            return
+        if len(pending) == 1:
+            payload, flags = self._seal(pending[0])
+            write_frame(self._writer, FrameTypes.MESSAGE, payload, flags)
+        else:
+            payload, flags = self._seal(encode_list(pending))
+            write_frame(self._writer, FrameTypes.MESSAGE_BATCH, payload, flags)
+        self._last_flush = self._loop.time()
+        self.stats.frames += 1
+        self.stats.wire_bytes += len(payload)
+        self.stats.largest_batch = max(self.stats.largest_batch, len(pending))
+        if reason == BatchFlushes.IDLE:
+            self.stats.idle_flushes += 1
+        elif reason == BatchFlushes.SIZE:
+            self.stats.size_flushes += 1
+        elif reason == BatchFlushes.TIMER:
+            self.stats.timer_flushes += 1
+
+    async def drain(self) -> None:
+        """Waits only while the transport's buffer is above its high-water mark."""
+        await self._writer.drain()
+
+    def close(self) -> None:
+        """Writes whatever is still pending, called before the writer is closed."""
+        self.flush(BatchFlushes.CLOSE)
@@ -0,0 +1,208 @@
+from peerconn_models import (PeerData, Message, FileData, ManifestEntry, FileResume, StripeHello, SessionHello, PeerPacket)
+from dataclasses import (fields, MISSING)
+from datetime import (datetime)
+from struct import (Struct)
+from typing import (Any, Callable, Dict, List, Tuple)
+
+CODEC_VERSION:      int = 1         # First byte of every encoded value, bumped on any incompatible change of the format
+MAX_DEPTH:          int = 32        # Lists and structs nested deeper than this don't decode, long before the recursion limit
+
+# msgpack-style tags, one byte in front of every value
+_NONE:              int = 0xC0
+_FALSE:             int = 0xC2
+_TRUE:              int = 0xC3
+_BIN:               int = 0xC6      # !I length, then the bytes
+_STRUCT:            int = 0xC7      # Type id, schema version and field count bytes, then the fields in declaration order
+_FLOAT:             int = 0xCB      # !d
+_DATETIME:          int = 0xD7      # !d POSIX timestamp of a local datetime
+_INT:               int = 0xD3      # !q
+_STR:               int = 0xDB      # !I length, then utf-8
+_LIST:              int = 0xDD      # !I item count, then the items
+_FIXSTR:            int = 0xA0      # 0xA0 | length for strings under 32 bytes
+_FIXLIST:           int = 0x90      # 0x90 | count for lists under 16 items
+_FIXINT_MAX:        int = 0x7F      # 0..127 are their own tag
+_INT_MIN:           int = -(1 << 63)
+_INT_MAX:           int = (1 << 63) - 1
+
+_U32:            Struct = Struct('!I')
+_I64:            Struct = Struct('!q')
+_F64:            Struct = Struct('!d')
+_STRUCT_HEADER:  Struct = Struct('!BBBB')     # Tag, type id, schema version, field count
+
+class CodecError(ValueError):
+    """Raised for bytes that aren't a value of a known schema."""
+
+class Schema:
+    """Wire layout of a dataclass: its fields by position, so only values travel and never names or class paths.
+    Fields may only be appended; a decoder fills fields an older peer didn't send with their defaults
+    and skips the extra ones a newer peer sent."""
+    def __init__(self, type_id: int, cls: type, version: int) -> None:
+        self.type_id = type_id
+        self.cls = cls
+        self.version = version
+        self.names: Tuple[str, ...] = tuple(field.name for field in fields(cls))
+        self.header: bytes = _STRUCT_HEADER.pack(_STRUCT, type_id, version, len(self.names))
+        self.defaults: List[Callable[[], Any]] = [
+            (lambda value= field.default: value) if field.default is not MISSING else field.default_factory
+            for field in fields(cls)
+        ]
+
+_SCHEMAS_BY_ID: Dict[int, Schema] = {}
+_SCHEMAS_BY_CLASS: Dict[type, Schema] = {}
+
+def register(type_id: int, cls: type, version: int) -> None:
+    schema = Schema(type_id, cls, version)
+    _SCHEMAS_BY_ID[type_id] = schema
+    _SCHEMAS_BY_CLASS[cls] = schema
+
+register(1, PeerData, 1)
+register(2, Message, 2)      # 2: date_time became an epoch float timestamp
+register(3, FileData, 1)
+register(4, ManifestEntry, 1)
+register(5, FileResume, 1)
+register(6, StripeHello, 1)
+register(7, PeerPacket, 2)   # 2: heartbeats
+register(8, SessionHello, 2) # 2: ticket of a resuming client
+
+_FIXED_TAGS: List[bytes] = [bytes((tag,)) for tag in range(256)]
+
+def _encode_value(value: Any, out: List[bytes]) -> None:
+    value_type = type(value)
+    if value_type is str:
+        encoded = value.encode('utf-8')
+        if len(encoded) < 32:
+            out.append(_FIXED_TAGS[_FIXSTR | len(encoded)])
+        else:
+            out.append(_FIXED_TAGS[_STR] + _U32.pack(len(encoded)))
+        out.append(encoded)
+    elif value_type is int:
+        if 0 <= value <= _FIXINT_MAX:
+            out.append(_FIXED_TAGS[value])
+        elif not _INT_MIN <= value <= _INT_MAX:
+            raise CodecError(f'{value} doesn\'t fit in 64 bits!')
+        else:
+            out.append(_FIXED_TAGS[_INT] + _I64.pack(value))
+    elif value is None:
+        out.append(_FIXED_TAGS[_NONE])
+    elif value_type is bool:
+        out.append(_FIXED_TAGS[_TRUE if value else _FALSE])
+    elif value_type is bytes or value_type is bytearray or value_type is memoryview:
+        out.append(_FIXED_TAGS[_BIN] + _U32.pack(len(value)))
+        out.append(value)
+    elif value_type is list or value_type is tuple:
+        if len(value) < 16:
+            out.append(_FIXED_TAGS[_FIXLIST | len(value)])
+        else:
+            out.append(_FIXED_TAGS[_LIST] + _U32.pack(len(value)))
+        for item in value:
+            _encode_value(item, out)
+    elif value_type is float:
+        out.append(_FIXED_TAGS[_FLOAT] + _F64.pack(value))
+    elif value_type is datetime:
+        out.append(_FIXED_TAGS[_DATETIME] + _F64.pack(value.timestamp()))
+    elif isinstance(value, int):
+        _encode_value(int(value), out) # IntEnum members like MessageTypes travel as plain ints
+    else:
+        schema = _SCHEMAS_BY_CLASS.get(value_type)
+        if schema == None:
+            raise CodecError(f'{value_type.__name__} has no schema!')
+        out.append(schema.header)
+        for name in schema.names:
+            _encode_value(getattr(value, name), out)
+
+def encode(value: Any) -> bytes:
+    """Encodes None, bools, ints, floats, strings, bytes, datetimes, lists and registered dataclasses."""
+    out = [_FIXED_TAGS[CODEC_VERSION]]
+    _encode_value(value, out)
+    return b''.join(out)
+
+def encode_list(encoded_values: List[bytes]) -> bytes:
+    """Joins values that were encode()d one by one into an encoded list of them, without encoding them again."""
+    if len(encoded_values) < 16:
+        header = _FIXED_TAGS[_FIXLIST | len(encoded_values)]
+    else:
+        header = _FIXED_TAGS[_LIST] + _U32.pack(len(encoded_values))
+    out = [_FIXED_TAGS[CODEC_VERSION], header]
+    for encoded in encoded_values:
+        if encoded[0] != CODEC_VERSION:
+            raise CodecError(f'Unsupported codec version {encoded[0]}!')
+        out.append(memoryview(encoded)[1:])
+    return b''.join(out)
+
+def decode(data: bytes | bytearray | memoryview, zero_copy: bool = False) -> Any:
+    """Decodes what encode() produced. With zero_copy, bytes values are memoryview slices of data instead of copies,
+    so they stay valid only as long as data does."""
+    view = memoryview(data)
+    text = data if type(data) is bytes else view    # Slicing bytes is the cheaper way to decode short strings
+    size = len(view)
+    position = 1
+
+    def take(length: int) -> int:
+        nonlocal position
+        start = position
+        position += length
+        if position > size:
+            raise CodecError('Truncated value!')
+        return start
+
+    def nested(depth: int) -> int:
+        if depth >= MAX_DEPTH:
+            raise CodecError('Value nested too deeply!')
+        return depth + 1
+
+    def value(depth: int = 0) -> Any:
+        # The hot tags skip take() and rely on the IndexError of a read past the end instead
+        nonlocal position
+        try:
+            tag = view[position]
+        except IndexError:
+            raise CodecError('Truncated value!')
+        position += 1
+        if tag <= _FIXINT_MAX:
+            return tag
+        elif tag & 0xE0 == _FIXSTR:
+            start = take(tag & 0x1F)
+            return str(text[start:position], 'utf-8')
+        elif tag & 0xF0 == _FIXLIST:
+            depth = nested(depth)
+            return [value(depth) for _ in range(tag & 0x0F)]
+        elif tag == _STRUCT:
+            start = take(3)
+            schema = _SCHEMAS_BY_ID.get(view[start])
+            if schema == None:
+                raise CodecError(f'Unknown type id {view[start]}!')
+            count = view[start + 2] # The schema version in between is informational as long as fields are only appended
+            depth = nested(depth)
+            values = [value(depth) for _ in range(count)]
+            if count < len(schema.names):
+                values.extend(default() for default in schema.defaults[count:])
+            return schema.cls(*values[:len(schema.names)])
+        elif tag == _NONE:
+            return None
+        elif tag == _TRUE:
+            return True
+        elif tag == _FALSE:
+            return False
+        elif tag == _STR:
+            start = take(_U32.unpack_from(view, take(4))[0])
+            return str(text[start:position], 'utf-8')
+        elif tag == _BIN:
+            start = take(_U32.unpack_from(view, take(4))[0])
+            return view[start:position] if zero_copy else view[start:position].tobytes()
+        elif tag == _INT:
+            return _I64.unpack_from(view, take(8))[0]
+        elif tag == _FLOAT:
+            return _F64.unpack_from(view, take(8))[0]
+        elif tag == _DATETIME:
+            return datetime.fromtimestamp(_F64.unpack_from(view, take(8))[0])
+        elif tag == _LIST:
+            depth = nested(depth)
+            return [value(depth) for _ in range(_U32.unpack_from(view, take(4))[0])]
+        raise CodecError(f'Unknown tag {tag:#x}!')
+
+    if size == 0 or view[0] != CODEC_VERSION:
+        raise CodecError(f'Unsupported codec version {view[0] if size else None}!')
+    decoded = value()
+    if position != size:
+        raise CodecError('Trailing bytes after the value!')
+    return decoded
@@ -1,8 +1,13 @@
 from peerconn_variables import Variables
 from peerconn_models import (dataclass)
+from concurrent.futures import (Future)
+from contextlib import (contextmanager)
+from time import (perf_counter)
+from typing import (Iterator, List)
 
 class Commands(Variables):
-    """Has command definations for ability of use async functions within sync script."""
+    """Has command definations for ability of use async functions within sync script.
+    Every command returns a concurrent.futures.Future of its handler's result, safe to wait on from other threads."""
     @dataclass
     class CommandTypes:
         """Command Type Enum"""
@@ -16,92 +21,150 @@ class Commands(Variables):
         config_file: int = 7      # Transactions about configuration json file
         close: int = 8            # Closes a PeerSocket
         close_all: int = 9        # Closes all PeerSockets
+        send_files: int = 10      # Sends files and directories under one manifest
+        set_rate_limit: int = 11  # Caps the file upload rate of a PeerSocket, or of all of them
+        remove: int = 12          # Forgets a closed PeerSocket and its sessions
 
     @dataclass
     class Command:
         type: int = None
         content: list = None
+        queued_at: float = 0.0    # perf_counter() when the command was queued, for the dispatcher's wait times
+        future: Future = None     # Settled by the dispatcher with the handler's result or exception
 
-    def set_server(self, peersocket_id: str) -> None:
-        self._queue_command(
+    def set_server(self, peersocket_id: str) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.set_server,
                     content= [peersocket_id]
                 )
         )
 
-    def connect(self, peersocket_id: str) -> None:
-        self._queue_command(
+    def connect(self, peersocket_id: str) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.connect,
                     content= [peersocket_id]
                 )
         )
 
-    def send_message(self, peersocket_id: str, message: str) -> None:
-        self._queue_command(
+    def send_message(self, peersocket_id: str, message: str) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.send_message,
                     content= [peersocket_id, message]
                 )
         )
 
-    def send_file(self, peersocket_id: str, file_path: str) -> None:
-        self._queue_command(
+    def send_file(self, peersocket_id: str, file_path: str) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.send_file,
                     content= [peersocket_id, file_path]
                 )
         )
 
-    def cancel_file(self, peersocket_id: str) -> None:
-        self._queue_command(
+    def send_files(self, peersocket_id: str, file_paths: list) -> Future:
+        return self._queue_command(
+            Commands.Command(
+                    type= Commands.CommandTypes.send_files,
+                    content= [peersocket_id, file_paths]
+                )
+        )
+
+    def set_rate_limit(self, peersocket_id: str | None, rate: float, weight: float | None = None) -> Future:
+        """rate is in bytes per second, 0 lifts the limit; a None peersocket_id sets the global limit.
+        weight is the peersocket's share of the global limit against the others' sends, 1 by default."""
+        return self._queue_command(
+            Commands.Command(
+                    type= Commands.CommandTypes.set_rate_limit,
+                    content= [peersocket_id, rate, weight]
+                )
+        )
+
+    def cancel_file(self, peersocket_id: str) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.cancel_file,
                     content= [peersocket_id]
                 )
         )
 
-    def change_download_dir(self, dir_path: str) -> None:
-        self._queue_command(
+    def change_download_dir(self, dir_path: str) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.change_download_dir,
                     content= [dir_path]
                 )
         )
 
-    def config_file(self, save) -> None:
-        self._queue_command(
+    def config_file(self, save) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.config_file,
                     content= [save]
                 )
         )
 
-    def close(self, peersocket_id: str) -> None:
-        self._queue_command(
+    def close(self, peersocket_id: str) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.close,
                     content= [peersocket_id]
                 )
         )
 
-    def close_all(self) -> None:
-        self._queue_command(
+    def remove(self, peersocket_id: str) -> Future:
+        """Queued after a close() of the same PeerSocket, it runs once the close is done."""
+        return self._queue_command(
+            Commands.Command(
+                    type= Commands.CommandTypes.remove,
+                    content= [peersocket_id]
+                )
+        )
+
+    def close_all(self) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.close_all
                 )
         )
 
-    def exit(self) -> None:
-        self._queue_command(
+    def exit(self) -> Future:
+        return self._queue_command(
             Commands.Command(
                     type= Commands.CommandTypes.exit
                 )
         )
 
-    def _queue_command(self, command: Command) -> None:
-        self._loop.call_soon_threadsafe(
-                self._command_queue.put_nowait,
-                command
-            )
\ No newline at end of file
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Commands queued inside the block cross to the event loop in a single hop when it ends, in order."""
+        if getattr(self._batch_local, 'commands', None) != None:
+            yield # Nested, the outermost batch sends them
+            return
+        commands: List[Commands.Command] = []
+        self._batch_local.commands = commands
+        try:
+            yield
+        finally:
+            self._batch_local.commands = None
+            if commands:
+                self._loop.call_soon_threadsafe(self._put_commands, commands)
+
+    def _put_commands(self, commands: List[Command]) -> None:
+        for command in commands:
+            self._command_queue.put_nowait(command)
+
+    def _queue_command(self, command: Command) -> Future:
+        command.queued_at = perf_counter()
+        command.future = Future()
+        batched = getattr(self._batch_local, 'commands', None)
+        if batched != None:
+            batched.append(command)
+        else:
+            self._loop.call_soon_threadsafe(
+                    self._command_queue.put_nowait,
+                    command
+                )
+        return command.future
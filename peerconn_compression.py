@@ -0,0 +1,75 @@
+from zlib import (compress as zlib_compress, decompressobj as zlib_decompressobj)
+from time import (thread_time)
+from typing import (List, Tuple)
+try:
+    from zstandard import (ZstdCompressor, ZstdDecompressor, frame_content_size)
+except ImportError:
+    ZstdCompressor = None # Optional, zlib is always there
+
+class CompressionModes:
+    ZSTD:                   str = 'zstd'
+    ZLIB:                   str = 'zlib'
+
+COMPRESSION_PREFERENCE: List[str] = [CompressionModes.ZSTD, CompressionModes.ZLIB]
+FRAME_COMPRESSED:           int = 0x01          # Frame flag, the payload was compressed before it was encrypted
+ZSTD_LEVEL:                 int = 3
+ZLIB_LEVEL:                 int = 1             # Favors speed, the link is usually faster than level 6 on one core
+SAMPLE_SIZE:                int = 64 * 1024     # Bytes of the first chunk compressed to judge the whole file
+MIN_SAMPLE_SAVING:        float = 0.1           # The sample must shrink at least this much for compression to stay on
+MAX_DECOMPRESSED_SIZE:      int = 64 * 1024 * 1024
+
+def available_compressions() -> List[str]:
+    return [mode for mode in COMPRESSION_PREFERENCE if mode != CompressionModes.ZSTD or ZstdCompressor != None]
+
+def negotiate_compression(local_modes: List[str], remote_modes: List[str] | None) -> str | None:
+    """Same walk as negotiate_cipher; None when either side can't or won't compress."""
+    if remote_modes:
+        for mode in COMPRESSION_PREFERENCE:
+            if mode in local_modes and mode in remote_modes:
+                return mode
+    return None
+
+def compress(mode: str, data: bytes) -> bytes:
+    if mode == CompressionModes.ZSTD:
+        return ZstdCompressor(level= ZSTD_LEVEL).compress(data)
+    return zlib_compress(data, ZLIB_LEVEL)
+
+def decompress(mode: str, data: bytes) -> bytes:
+    """Refuses output larger than a frame could carry, so a tiny payload can't expand without bound."""
+    if mode == CompressionModes.ZSTD:
+        if ZstdCompressor == None:
+            raise ValueError('Received a zstd payload without zstandard installed!')
+        size = frame_content_size(data)
+        if size < 0 or size > MAX_DECOMPRESSED_SIZE:
+            raise ValueError(f'Refusing a zstd payload of {size} bytes!')
+        return ZstdDecompressor().decompress(data)
+    decompressor = zlib_decompressobj()
+    decompressed = decompressor.decompress(data, MAX_DECOMPRESSED_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ValueError('Refusing a zlib payload larger than a frame!')
+    return decompressed
+
+def is_compressible(mode: str, sample: bytes) -> bool:
+    """Zipped archives, media and encrypted files don't shrink; a sample tells before any chunk pays for it."""
+    sample = sample[:SAMPLE_SIZE]
+    return len(compress(mode, sample)) <= len(sample) * (1 - MIN_SAMPLE_SAVING)
+
+def compress_chunk(mode: str | None, chunk: bytes) -> Tuple[bytes, int, float]:
+    """Returns the payload, its frame flags and the CPU seconds spent; a chunk that doesn't shrink goes as it is."""
+    if mode == None:
+        return chunk, 0, 0.0
+    started = thread_time()
+    compressed = compress(mode, chunk)
+    cpu_time = thread_time() - started
+    if len(compressed) < len(chunk):
+        return compressed, FRAME_COMPRESSED, cpu_time
+    return chunk, 0, cpu_time
+
+def decompress_chunk(mode: str | None, payload: bytes, flags: int) -> Tuple[bytes, float]:
+    if not flags & FRAME_COMPRESSED:
+        return payload, 0.0
+    if mode == None:
+        raise ValueError('Compressed chunk in a transfer without compression!')
+    started = thread_time()
+    chunk = decompress(mode, payload)
+    return chunk, thread_time() - started
@@ -0,0 +1,96 @@
+from hashlib import (sha256)
+from os import (urandom)
+from struct import (Struct)
+from functools import (lru_cache)
+from typing import (List)
+from cryptography.fernet import (Fernet)
+from cryptography.hazmat.primitives.ciphers.aead import (AESGCM, ChaCha20Poly1305)
+
+class CipherModes:
+    FERNET:                 str = 'fernet'              # One Fernet token per chunk, understood by every peer
+    AES_GCM:                str = 'aes-256-gcm'
+    CHACHA20_POLY1305:      str = 'chacha20-poly1305'
+    NONE:                   str = 'none'                # Plaintext, only on a negotiated trusted link, never offered
+
+CIPHER_PREFERENCE:    List[str] = [CipherModes.AES_GCM, CipherModes.CHACHA20_POLY1305, CipherModes.FERNET]
+NONCE_PREFIX_SIZE:          int = 8                     # Random per transfer, sent in FileData
+_COUNTER:                Struct = Struct('!I')          # Chunk counter, the last 4 bytes of the 12 byte nonce
+
+def negotiate_cipher(local_modes: List[str], remote_modes: List[str] | None) -> str:
+    """Both peers walk the same preference list so they agree without another round trip.
+    Peers that don't advertise any mode are old ones and only speak Fernet."""
+    if remote_modes:
+        for mode in CIPHER_PREFERENCE:
+            if mode in local_modes and mode in remote_modes:
+                return mode
+    return CipherModes.FERNET
+
+def derive_file_key(key: bytes) -> bytes:
+    """32 byte AEAD key of the file channel, derived from the exchanged key material."""
+    return sha256(b'PEERCONN_FILE_KEY' + key).digest()
+
+def derive_resume_ticket(key: bytes) -> bytes:
+    """Ticket a reconnecting client presents to resume its session, derived from the exchanged key material."""
+    return sha256(b'PEERCONN_RESUME_TICKET' + key).digest()
+
+def new_nonce_prefix() -> bytes:
+    return urandom(NONCE_PREFIX_SIZE)
+
+@lru_cache(maxsize= 16)
+def _primitive(mode: str, key: bytes) -> Fernet | AESGCM | ChaCha20Poly1305:
+    # Cached per process so worker processes build each key schedule once
+    if mode == CipherModes.AES_GCM:
+        return AESGCM(key)
+    elif mode == CipherModes.CHACHA20_POLY1305:
+        return ChaCha20Poly1305(key)
+    return Fernet(key)
+
+def seal(mode: str, key: bytes, nonce: bytes | None, chunk: bytes) -> bytes:
+    """Module level so it can be shipped to a worker process."""
+    if nonce == None:
+        return _primitive(mode, key).encrypt(chunk)
+    return _primitive(mode, key).encrypt(nonce, chunk, None)
+
+def unseal(mode: str, key: bytes, nonce: bytes | None, token: bytes) -> bytes:
+    if nonce == None:
+        return _primitive(mode, key).decrypt(token)
+    return _primitive(mode, key).decrypt(nonce, token, None)
+
+class ChunkCipher:
+    """Cipher of one file transfer. With an AEAD the nonce is transfer prefix + chunk counter, so chunks
+    must be decrypted in the order they were encrypted; a reordered or dropped chunk fails authentication.
+    Nonces are handed out in order on the loop, the sealing itself can run anywhere."""
+    def __init__(self, mode: str, key: bytes, nonce_prefix: bytes | None = None) -> None:
+        self.mode = mode
+        self.key = key
+        self._nonce_prefix = nonce_prefix
+        self._encrypt_counter = 0
+        self._decrypt_counter = 0
+
+    def nonce_for(self, counter: int) -> bytes | None:
+        """Nonce of an explicitly numbered chunk, used by striped transfers where chunks arrive out of order."""
+        if self._nonce_prefix == None:
+            return None
+        return self._nonce_prefix + _COUNTER.pack(counter)
+
+    def next_encrypt_nonce(self) -> bytes | None:
+        nonce = self.nonce_for(self._encrypt_counter)
+        self._encrypt_counter += 1
+        return nonce
+
+    def next_decrypt_nonce(self) -> bytes | None:
+        nonce = self.nonce_for(self._decrypt_counter)
+        self._decrypt_counter += 1
+        return nonce
+
+    def encrypt(self, chunk: bytes) -> bytes:
+        return seal(self.mode, self.key, self.next_encrypt_nonce(), chunk)
+
+    def decrypt(self, token: bytes) -> bytes:
+        return unseal(self.mode, self.key, self.next_decrypt_nonce(), token)
+
+def file_cipher(mode: str | None, file_key: bytes, fernet_key: bytes, nonce_prefix: bytes | None = None) -> ChunkCipher:
+    """Chunk cipher for a transfer; anything but a negotiated AEAD falls back to Fernet with the message channel's key."""
+    if mode in (CipherModes.AES_GCM, CipherModes.CHACHA20_POLY1305) and nonce_prefix != None:
+        return ChunkCipher(mode, file_key, nonce_prefix)
+    return ChunkCipher(CipherModes.FERNET, fernet_key)
@@ -0,0 +1,114 @@
+from peerconn_transfer import (StripedFileSender, read_at, write_at)
+from peerconn_journal import (TransferJournal)
+from hashlib import (sha256)
+from functools import (lru_cache)
+from json import (dump as json_dump, load as json_load)
+from os import (path, walk, stat, replace)
+from threading import (Lock)
+from typing import (Dict, List, Tuple)
+
+CHUNK_SIZE:     int = StripedFileSender.CHUNK_SIZE      # Missing chunks are sent as FILE_RANGE frames, so both must agree
+
+@lru_cache(maxsize= 64)
+def file_chunk_hashes(file_path: str, size: int, mtime_ns: int) -> List[str]:
+    """sha256 of every CHUNK_SIZE block of the file; size and mtime are part of the cache key."""
+    hashes = []
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            hashes.append(sha256(chunk).hexdigest())
+    return hashes
+
+def chunk_length(size: int, index: int) -> int:
+    return min(CHUNK_SIZE, size - index * CHUNK_SIZE)
+
+class ContentIndex:
+    """Chunk hashes of the files under the downloads directory, kept in a sidecar json file so only new or
+    changed files, by size and mtime, are hashed again. Partial files, still under their .part name, are left out.
+    Received files are added one by one, refresh() picks up the rest in the background; materialize() only looks up
+    what is indexed so far, so it never walks the tree while the sender waits for its reply.
+    Every method does disk I/O and is meant to run on the worker pool."""
+    FILE_NAME:      str = '.pcindex.json'
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.index_path = path.join(root, self.FILE_NAME)
+        self._files: Dict[str, dict] = {}                       # Path -> size, mtime_ns and chunk hashes
+        self._chunks: Dict[str, Tuple[str, int, int]] = {}      # Chunk hash -> path, offset, length
+        self._lock = Lock()
+        try:
+            with open(self.index_path, 'r', encoding= 'utf-8') as index_file:
+                self._files = json_load(index_file)
+        except (OSError, ValueError):
+            pass
+        self._rebuild()
+
+    def refresh(self) -> None:
+        """Hashes the files that are new or changed since the last refresh; the chunk table and the sidecar
+        file are only rebuilt when something changed."""
+        with self._lock:
+            files = {}
+            changed = False
+            for directory, _, names in walk(self.root):
+                for name in names:
+                    if name.startswith(self.FILE_NAME) or name.endswith((TransferJournal.SUFFIX, TransferJournal.PART_SUFFIX)):
+                        continue
+                    file_path = path.join(directory, name)
+                    try:
+                        file_stat = stat(file_path)
+                        known = self._files.get(file_path)
+                        if known == None or known['size'] != file_stat.st_size or known['mtime_ns'] != file_stat.st_mtime_ns:
+                            known = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns,
+                                     'chunks': file_chunk_hashes(file_path, file_stat.st_size, file_stat.st_mtime_ns)}
+                            changed = True
+                        files[file_path] = known
+                    except OSError:
+                        pass # Vanished or unreadable, it simply isn't indexed
+            if changed or files.keys() != self._files.keys():
+                self._files = files
+                self._rebuild()
+                self._save()
+
+    def add(self, file_path: str, chunk_hashes: List[str]) -> None:
+        """Indexes a file that was just received, with the hashes the sender announced for it."""
+        with self._lock:
+            file_stat = stat(file_path)
+            self._files[file_path] = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'chunks': chunk_hashes}
+            self._rebuild()
+            self._save()
+
+    def _rebuild(self) -> None:
+        chunks = {}
+        for file_path, known in self._files.items():
+            for index, chunk_hash in enumerate(known['chunks']):
+                chunks.setdefault(chunk_hash, (file_path, index * CHUNK_SIZE, chunk_length(known['size'], index)))
+        self._chunks = chunks # Swapped whole, materialize() reads it without the lock
+
+    def _save(self) -> None:
+        with open(self.index_path + '.tmp', 'w', encoding= 'utf-8') as index_file:
+            json_dump(self._files, index_file)
+        replace(self.index_path + '.tmp', self.index_path)
+
+    def materialize(self, target_path: str, chunk_hashes: List[str], size: int, offset: int = 0) -> List[int]:
+        """Copies every chunk of the announced file that is already somewhere under root into target_path,
+        which must be allocated to its full size, and returns the indexes of the chunks still missing.
+        Chunks below offset are already in place; a copied chunk is re-hashed in case its source changed."""
+        missing = []
+        chunks = self._chunks
+        with open(target_path, 'r+b', buffering= 0) as target:
+            for index, chunk_hash in enumerate(chunk_hashes):
+                position = index * CHUNK_SIZE
+                if position + chunk_length(size, index) <= offset:
+                    continue
+                found = chunks.get(chunk_hash)
+                chunk = b''
+                if found != None and found[0] != target_path:
+                    try:
+                        with open(found[0], 'rb') as source:
+                            chunk = read_at(source, found[1], found[2])
+                    except OSError:
+                        pass
+                if chunk and sha256(chunk).hexdigest() == chunk_hash:
+                    write_at(target, position, chunk)
+                else:
+                    missing.append(index)
+        return missing
@@ -0,0 +1,101 @@
+from peerconn_models import (dataclass, LaneStats)
+from asyncio import (Task, CancelledError, create_task)
+from concurrent.futures import (Future)
+from heapq import (heappush, heappop)
+from inspect import (isawaitable)
+from itertools import (count)
+from logging import (Logger)
+from time import (perf_counter)
+from typing import (Any, Callable, Dict, List, Tuple)
+
+class CommandLanes:
+    CONTROL:                int = 0     # Cancels, closes and settings, they go ahead of everything queued
+    SESSION:                int = 1     # Opening servers and connections
+    BULK:                   int = 2     # Messages and files
+
+@dataclass
+class CommandRoute:
+    handler:    Callable[..., Any]      # Called with the command's content, may return an awaitable
+    lane:       int = CommandLanes.BULK
+    keyed:      bool = True             # The first content item is a peersocket id, commands of one id run in order
+    detached:   bool = False            # Started as a task of its own so the lane moves on, like a file transfer
+
+class CommandDispatcher:
+    """Runs commands by a table of routes instead of an if/elif chain. Every peersocket has its own queue and
+    runner task, so a slow connect or close only holds back commands of the same peersocket, which still run
+    in order; unkeyed commands share one more queue. Within a queue, lower lanes go first."""
+    def __init__(self, logger: Logger) -> None:
+        self.stats: Dict[int, LaneStats] = {lane: LaneStats() for lane in (CommandLanes.CONTROL, CommandLanes.SESSION, CommandLanes.BULK)}
+        self._logger = logger
+        self._routes: Dict[int, CommandRoute] = {}
+        self._queues: Dict[str | None, List[Tuple[int, int, Any]]] = {}    # Peersocket id -> heap of (lane, sequence, command)
+        self._runners: Dict[str | None, Task] = {}
+        self._sequence = count()                                            # Keeps commands of one lane in arrival order
+
+    def route(self, command_type: int, route: CommandRoute) -> None:
+        self._routes[command_type] = route
+
+    def submit(self, command: Any) -> None:
+        """Queues a command; must be called on the event loop."""
+        route = self._routes.get(command.type)
+        if route == None:
+            self._logger.warning(f'{self.submit.__name__}: No route for command type {command.type}!')
+            if command.future != None and command.future.set_running_or_notify_cancel():
+                command.future.set_exception(KeyError(f'No route for command type {command.type}!'))
+            return
+        key = command.content[0] if route.keyed else None
+        heappush(self._queues.setdefault(key, []), (route.lane, next(self._sequence), command))
+        self.stats[route.lane].depth += 1
+        if key not in self._runners:
+            self._runners[key] = create_task(self._run_queue(key))
+
+    async def _run_queue(self, key: str | None) -> None:
+        queue = self._queues[key]
+        while queue:
+            lane, _, command = heappop(queue)
+            self.stats[lane].depth -= 1
+            await self.run(command)
+        # Nothing awaited between the empty check and here, so no command can slip in unnoticed
+        del self._queues[key]
+        del self._runners[key]
+
+    async def run(self, command: Any) -> None:
+        """Runs a command right away, without queueing it, and settles its future.
+        A command whose future was cancelled while it waited is skipped."""
+        route = self._routes[command.type]
+        future: Future | None = command.future
+        if future != None and not future.set_running_or_notify_cancel():
+            return
+        lane_stats = self.stats[route.lane]
+        wait = perf_counter() - command.queued_at if command.queued_at else 0.0
+        lane_stats.dispatched += 1
+        lane_stats.total_wait += wait
+        lane_stats.max_wait = max(lane_stats.max_wait, wait)
+        try:
+            result = route.handler(*(command.content or []))
+            if isawaitable(result):
+                if route.detached:
+                    task = create_task(result)
+                    if future != None:
+                        task.add_done_callback(lambda task: self._settle(future, task))
+                    return
+                result = await result
+            if future != None:
+                future.set_result(result)
+        except Exception as ex:
+            self._logger.error(f'{self.run.__name__}: Command {command.type}: {ex}')
+            if future != None:
+                future.set_exception(ex)
+
+    @staticmethod
+    def _settle(future: Future, task: Task) -> None:
+        """Passes the outcome of a detached command's task on to its future."""
+        if task.cancelled():
+            future.set_exception(CancelledError())
+        elif task.exception() != None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def depth(self) -> int:
+        return sum(lane_stats.depth for lane_stats in self.stats.values())
@@ -0,0 +1,34 @@
+from logging import (Logger)
+from threading import (Lock)
+from typing import (Callable, List)
+
+class PeerConnEvents:
+    SOCKET_STATE:           int = 0     # Role, connection flags or servers of a peersocket changed
+    NEW_MESSAGES:           int = 1     # Messages were appended to the history of a peersocket
+    FILE_PROGRESS:          int = 2     # A file transaction of a peersocket started, moved on by a percent or ended
+    LINK_STATS:             int = 3     # A heartbeat of a peersocket came back, its round trip estimate moved
+
+class EventPublisher:
+    """Tells listeners what changed, and of which peersocket, as it changes, so a GUI doesn't have to poll.
+    Listeners are called on the publishing thread, mostly the event loop's; they should only hand the event over
+    to their own thread and return. A listener that raises is logged and doesn't stop the others."""
+    def __init__(self, logger: Logger) -> None:
+        self._logger = logger
+        self._listeners: List[Callable[[int, str], None]] = []
+        self._lock = Lock()
+
+    def subscribe(self, listener: Callable[[int, str], None]) -> None:
+        """listener is called with the PeerConnEvents kind and the peersocket id."""
+        with self._lock:
+            self._listeners = self._listeners + [listener] # Copied on write so publish() needs no lock
+
+    def unsubscribe(self, listener: Callable[[int, str], None]) -> None:
+        with self._lock:
+            self._listeners = [subscribed for subscribed in self._listeners if subscribed != listener]
+
+    def publish(self, event: int, peersocket_id: str) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event, peersocket_id)
+            except Exception as ex:
+                self._logger.error(f'{self.publish.__name__}: Event {event} of {peersocket_id}: {ex}')
@@ -0,0 +1,51 @@
+from peerconn_models import (StreamReader, StreamWriter, Frame)
+from asyncio import (wait_for)
+from struct import (Struct)
+from typing import (Iterable, Tuple)
+
+FRAME_VERSION:              int = 1
+FRAME_HEADER:            Struct = Struct('!BBBI')      # version, type, flags, payload length
+MAX_FRAME_SIZE:             int = 64 * 1024 * 1024      # Upper bound of a payload, protects against corrupt headers
+
+class FrameError(Exception):
+    """Raised when a frame header can't be trusted (unknown version or oversized payload)."""
+
+def encode_header(type: int, length: int, flags: int = 0) -> bytes:
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f'Frame payload is too large: {length}')
+    return FRAME_HEADER.pack(FRAME_VERSION, type, flags, length)
+
+def write_frame(writer: StreamWriter, type: int, payload: bytes = b'', flags: int = 0) -> None:
+    """Writes header and payload without concatenating them; caller is responsible for drain()."""
+    writer.writelines((encode_header(type, len(payload), flags), payload))
+
+def write_frames(writer: StreamWriter, frames: Iterable[Tuple[int, bytes]]) -> None:
+    """Pipelines many (type, payload) frames with a single write call."""
+    buffers = []
+    for type, payload in frames:
+        buffers.append(encode_header(type, len(payload)))
+        buffers.append(payload)
+    writer.writelines(buffers)
+
+async def read_frame_header(reader: StreamReader, timeout: float | None = None) -> Frame:
+    """Reads only the header; the caller must consume exactly frame.length payload bytes next.
+    The timeout only applies while waiting for the header so a cancelled wait never leaves the stream mid-frame."""
+    if timeout != None:
+        header = await wait_for(reader.readexactly(FRAME_HEADER.size), timeout)
+    else:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    version, type, flags, length = FRAME_HEADER.unpack(header)
+    if version != FRAME_VERSION:
+        raise FrameError(f'Unsupported frame version: {version}')
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f'Frame payload is too large: {length}')
+    return Frame(type= type, flags= flags, length= length)
+
+async def read_frame_payload(reader: StreamReader, frame: Frame) -> Frame:
+    if frame.length:
+        frame.payload = await reader.readexactly(frame.length)
+    return frame
+
+async def read_frame(reader: StreamReader, timeout: float | None = None) -> Frame:
+    """Reads exactly one frame. Raises IncompleteReadError on EOF."""
+    return await read_frame_payload(reader, await read_frame_header(reader, timeout))
@@ -0,0 +1,194 @@
+from peerconn_models import (Message, SearchHit)
+from collections import (deque)
+from itertools import (islice)
+from sqlite3 import (connect, OperationalError)
+from threading import (Lock)
+from typing import (Callable, Iterator, List)
+
+PAGE_SIZE:      int = 256       # Messages read from the database at once
+SEARCH_LIMIT:   int = 100       # Default number of hits of a search, newest first
+
+class HistoryDatabase:
+    """SQLite file the message histories of every peersocket spill into. It is scratch space for a single run,
+    so it trades durability for speed; the event loop appends and the GUI thread pages through the same connection.
+    An FTS5 index over sender and content is updated with every batch; without FTS5, search falls back to LIKE."""
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self._lock = Lock()
+        self._connection = connect(file_path, check_same_thread= False, isolation_level= None)
+        self._connection.execute('PRAGMA journal_mode = MEMORY')
+        self._connection.execute('PRAGMA synchronous = OFF')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS messages (history TEXT, position INTEGER, sender TEXT, content TEXT, '
+                                 'timestamp REAL, type INTEGER, UNIQUE (history, position))')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)')
+        self.full_text = True
+        try:
+            # External content, the text is only stored in messages. Batches are indexed by a statement of their own,
+            # an insert trigger would make FTS5 flush its pending terms once per message.
+            self._connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5("
+                                     "sender, content, content= 'messages', tokenize= 'unicode61 remove_diacritics 2')")
+        except OperationalError:
+            self.full_text = False # SQLite built without FTS5
+
+    def append(self, history_id: str, start: int, messages: List[Message]) -> None:
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                last_rowid = self._connection.execute('SELECT IFNULL(MAX(rowid), 0) FROM messages').fetchone()[0]
+                self._connection.executemany(
+                    'INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)',
+                    [(history_id, start + index, message.sender, message.content, message.timestamp, message.type)
+                     for index, message in enumerate(messages)]
+                )
+                if self.full_text:
+                    self._connection.execute('INSERT INTO message_search (rowid, sender, content) '
+                                             'SELECT rowid, sender, content FROM messages WHERE rowid > ?', (last_rowid,))
+            finally:
+                self._connection.execute('COMMIT')
+
+    def read(self, history_id: str, start: int, stop: int) -> List[Message]:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT sender, content, timestamp, type FROM messages WHERE history = ? AND position >= ? AND position < ? ORDER BY position',
+                (history_id, start, stop)
+            ).fetchall()
+        return [Message(*row) for row in rows]
+
+    def search(self, text: str = '', history_ids: List[str] | None = None, sender: str | None = None,
+               since: float | None = None, until: float | None = None, limit: int = SEARCH_LIMIT) -> List[SearchHit]:
+        """Newest messages whose sender or content has every word of text; all filters are optional."""
+        conditions, parameters = [], []
+        words = text.split()
+        if words and self.full_text:
+            source, order = 'message_search JOIN messages ON messages.rowid = message_search.rowid', 'message_search.rowid'
+            conditions.append('message_search MATCH ?')
+            parameters.append(' '.join('"' + word.replace('"', '""') + '"' for word in words))
+        else:
+            source, order = 'messages', 'messages.rowid'
+            for word in words:
+                conditions.append("(messages.content LIKE ? ESCAPE '\\' OR messages.sender LIKE ? ESCAPE '\\')")
+                pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                parameters.extend((pattern, pattern))
+        # With a MATCH, the unary + keeps SQLite from driving the query by an index of messages instead:
+        # walking the FTS5 rowids backwards stops at the limit without sorting every match
+        column = '+messages.' if order == 'message_search.rowid' else 'messages.'
+        if history_ids != None:
+            conditions.append(f'{column}history IN ({", ".join("?" * len(history_ids))})')
+            parameters.extend(history_ids)
+        if sender != None:
+            conditions.append(f'{column}sender = ?')
+            parameters.append(sender)
+        if since != None:
+            conditions.append(f'{column}timestamp >= ?')
+            parameters.append(since)
+            if order == 'message_search.rowid': # Also bounds the rowids FTS5 walks, read off the timestamp index
+                conditions.append('message_search.rowid >= (SELECT MIN(rowid) FROM messages INDEXED BY messages_timestamp WHERE timestamp >= ?)')
+                parameters.append(since)
+        if until != None:
+            conditions.append(f'{column}timestamp < ?')
+            parameters.append(until)
+            if order == 'message_search.rowid':
+                conditions.append('message_search.rowid <= (SELECT MAX(rowid) FROM messages INDEXED BY messages_timestamp WHERE timestamp < ?)')
+                parameters.append(until)
+        query = (f'SELECT messages.history, messages.position, messages.sender, messages.content, messages.timestamp, messages.type FROM {source}'
+                 f'{" WHERE " + " AND ".join(conditions) if conditions else ""} ORDER BY {order} DESC LIMIT ?')
+        with self._lock:
+            rows = self._connection.execute(query, (*parameters, limit)).fetchall()
+        return [SearchHit(history_id= row[0], position= row[1], message= Message(*row[2:])) for row in rows]
+
+    def delete(self, history_id: str) -> None:
+        with self._lock:
+            if self.full_text:
+                self._connection.execute("INSERT INTO message_search (message_search, rowid, sender, content) "
+                                         "SELECT 'delete', rowid, sender, content FROM messages WHERE history = ?", (history_id,))
+            self._connection.execute('DELETE FROM messages WHERE history = ?', (history_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+class MessageStore:
+    """Message history of a peersocket: the most recent ring_size messages stay in memory and every message
+    is appended to the database in batches of flush_size, so memory stays flat however long the session runs.
+    Indexes and slices count from the first message ever appended; older ones are paged in from the database.
+    on_append is called with every appended message, outside the lock, so a reader it wakes up sees the new message."""
+    def __init__(self, database: HistoryDatabase, history_id: str, ring_size: int = 1000, flush_size: int = 256,
+                 on_append: Callable[[Message], None] | None = None) -> None:
+        self.history_id = history_id
+        self._on_append = on_append
+        self._database = database
+        self._ring: deque = deque(maxlen= ring_size)
+        self._flush_size = max(1, min(flush_size, ring_size))   # Unflushed messages must still be in the ring
+        self._count = 0
+        self._flushed = 0                                       # Messages below this index are in the database
+        self._page_start = 0                                    # Last page read from the database
+        self._page: List[Message] = []
+        self._lock = Lock()
+
+    def append(self, message: Message) -> None:
+        with self._lock:
+            self._ring.append(message)
+            self._count += 1
+            if self._count - self._flushed >= self._flush_size:
+                self._flush()
+        if self._on_append != None:
+            self._on_append(message)
+
+    def _flush(self) -> None:
+        pending = self._count - self._flushed
+        if pending > 0:
+            self._database.append(self.history_id, self._flushed, list(islice(self._ring, len(self._ring) - pending, None)))
+            self._flushed = self._count
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def page(self, start: int, stop: int) -> List[Message]:
+        """Messages start..stop-1, clamped to the history."""
+        with self._lock:
+            start, stop = max(0, start), min(stop, self._count)
+            if start >= stop:
+                return []
+            ring_start = self._count - len(self._ring)
+            messages = []
+            if start < ring_start:
+                messages = self._database.read(self.history_id, start, min(stop, ring_start))
+            if stop > ring_start:
+                messages.extend(islice(self._ring, max(start, ring_start) - ring_start, stop - ring_start))
+            return messages
+
+    def __getitem__(self, index: int | slice) -> Message | List[Message]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            messages = self.page(start, stop)
+            return messages if step == 1 else messages[::step]
+        with self._lock:
+            if index < 0:
+                index += self._count
+            if not 0 <= index < self._count:
+                raise IndexError('Message index out of range!')
+            ring_start = self._count - len(self._ring)
+            if index >= ring_start:
+                return self._ring[index - ring_start]
+            if not self._page_start <= index < self._page_start + len(self._page):
+                self._page_start = index - index % PAGE_SIZE
+                self._page = self._database.read(self.history_id, self._page_start, min(self._page_start + PAGE_SIZE, ring_start))
+            return self._page[index - self._page_start]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[Message]:
+        """Walks the whole history a page at a time."""
+        for start in range(0, len(self), PAGE_SIZE):
+            yield from self.page(start, start + PAGE_SIZE)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._database.delete(self.history_id)
+            self._ring.clear()
+            self._count = 0
+            self._flushed = 0
+            self._page_start = 0
+            self._page = []
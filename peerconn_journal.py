@@ -0,0 +1,119 @@
+from hashlib import (sha256)
+from json import (dumps as json_dumps, loads as json_loads)
+from os import (path, remove, stat)
+from threading import (Lock)
+from time import (monotonic)
+from typing import (List, TextIO)
+
+class TransferJournal:
+    """Sidecar journal of a file being received: a header line with the transfer id and size,
+    then one line per written chunk with its offset, length and sha256. Chunks of a striped transfer
+    are recorded in completion order, not offset order. Entries are flushed in batches, a crash loses at most
+    the last batch, which is only sent again.
+    Every method does disk I/O and is meant to run on the worker pool."""
+    SUFFIX:             str = '.pcjournal'
+    PART_SUFFIX:        str = '.part'               # The file is received under its name plus this, then renamed
+    VERIFY_BLOCK:       int = 4 * 1024 * 1024       # Largest read while verifying a journaled chunk
+    FLUSH_BYTES:        int = 16 * 1024 * 1024      # Chunk bytes recorded between flushes...
+    FLUSH_INTERVAL:   float = 1.0                   # ...or seconds, whichever comes first
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.journal_path = file_path + self.SUFFIX
+        self._journal: TextIO | None = None
+        self._verified: List[dict] = []            # Entries resume_offset() checked against the file
+        self._lock = Lock()                         # Striped transfers record from several worker threads
+        self._unflushed = 0                         # Chunk bytes recorded since the last flush
+        self._flushed_at = 0.0
+
+    @staticmethod
+    def transfer_id(file_path: str) -> str:
+        """Same file, same id across reconnects; any change to name, size or mtime starts over."""
+        file_stat = stat(file_path)
+        return sha256(f'{path.basename(file_path)}:{file_stat.st_size}:{file_stat.st_mtime_ns}'.encode()).hexdigest()
+
+    def resume_offset(self, transfer_id: str | None, size: int) -> int:
+        """Length of the verified, contiguous prefix left by an earlier attempt of the same transfer, at most size."""
+        self._verified = []
+        if transfer_id == None or not path.exists(self.journal_path) or not path.exists(self.file_path):
+            return 0
+        entries = self._read_entries(transfer_id, size)
+        offset = 0
+        try:
+            with open(self.file_path, 'rb') as file:
+                for entry in sorted(entries, key= lambda entry: entry['offset']):
+                    if entry['offset'] < offset:
+                        continue # Same range written twice, once before an interruption and once after
+                    if entry['offset'] != offset:
+                        break
+                    file.seek(offset)
+                    if self._digest(file, entry['length']) != entry['sha256']:
+                        break
+                    offset += entry['length']
+                    self._verified.append(entry)
+        except OSError:
+            pass
+        return offset
+
+    def _read_entries(self, transfer_id: str, size: int) -> List[dict]:
+        entries = []
+        try:
+            with open(self.journal_path, 'r', encoding= 'utf-8') as journal:
+                header = json_loads(journal.readline())
+                if header.get('transfer_id') != transfer_id or header.get('size') != size:
+                    return []
+                for line in journal:
+                    entry = json_loads(line)
+                    if {'offset', 'length', 'sha256'} <= entry.keys():
+                        if not 0 <= entry['offset'] < entry['offset'] + entry['length'] <= size:
+                            return [] # Describes another file than this one, none of it can be trusted
+                        entries.append(entry)
+        except (OSError, ValueError):
+            pass # A torn last line just ends the journal
+        except (TypeError, AttributeError):
+            return [] # Lines or fields of the wrong type
+        return entries
+
+    def _digest(self, file, length: int) -> str:
+        digest = sha256()
+        while length > 0:
+            block = file.read(min(length, self.VERIFY_BLOCK))
+            if not block:
+                break
+            digest.update(block)
+            length -= len(block)
+        return digest.hexdigest()
+
+    def start(self, transfer_id: str, size: int) -> None:
+        """Rewrites the journal so it only describes the verified prefix, then keeps it open for appending."""
+        self._journal = open(self.journal_path, 'w', encoding= 'utf-8')
+        self._journal.write(json_dumps({'transfer_id': transfer_id, 'size': size}) + '\n')
+        for entry in self._verified:
+            self._journal.write(json_dumps(entry) + '\n')
+        self._journal.flush()
+        self._unflushed = 0
+        self._flushed_at = monotonic()
+
+    def record(self, offset: int, chunk: bytes) -> None:
+        if self._journal != None:
+            line = json_dumps({'offset': offset, 'length': len(chunk), 'sha256': sha256(chunk).hexdigest()}) + '\n'
+            with self._lock:
+                if self._journal == None:
+                    return # Closed by the transfer ending meanwhile
+                self._journal.write(line)
+                self._unflushed += len(chunk)
+                if self._unflushed >= self.FLUSH_BYTES or monotonic() - self._flushed_at >= self.FLUSH_INTERVAL:
+                    self._journal.flush()
+                    self._unflushed = 0
+                    self._flushed_at = monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._journal != None:
+                self._journal.close()
+                self._journal = None
+
+    def remove(self) -> None:
+        self.close()
+        if path.exists(self.journal_path):
+            remove(self.journal_path)
@@ -0,0 +1,158 @@
+from peerconn_models import (ManifestEntry)
+from peerconn_journal import (TransferJournal)
+from hashlib import (sha256)
+from os import (path, walk, makedirs, sep, remove, replace)
+from typing import (BinaryIO, List, Tuple)
+
+HASH_BLOCK:     int = 1024 * 1024       # Read size while hashing files for the manifest
+
+def _hash_file(file_path: str) -> Tuple[int, str]:
+    digest = sha256()
+    size = 0
+    with open(file_path, 'rb') as file:
+        while block := file.read(HASH_BLOCK):
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+def build_manifest(file_paths: List[str]) -> Tuple[List[ManifestEntry], List[str]]:
+    """Entries for the given files and directories, walked recursively and sorted, with the local path of each entry.
+    Entry paths are relative to the parent of the path they were found under, so a directory keeps its own name."""
+    entries: List[ManifestEntry] = []
+    sources: List[str] = []
+    for top_path in file_paths:
+        top_path = path.abspath(top_path)
+        parent = path.dirname(top_path)
+        if path.isdir(top_path):
+            found = []
+            for directory, directories, files in walk(top_path):
+                directories.sort()
+                found.extend(path.join(directory, name) for name in sorted(files))
+        else:
+            found = [top_path]
+        for file_path in found:
+            if path.isfile(file_path):
+                size, digest = _hash_file(file_path)
+                entries.append(ManifestEntry(path= path.relpath(file_path, parent).replace(sep, '/'), size= size, sha256= digest))
+                sources.append(file_path)
+    return entries, sources
+
+def safe_join(root: str, relative_path: str) -> str:
+    """Joins a manifest path under root, refusing anything that could land outside of it."""
+    parts = relative_path.split('/')
+    if '\\' in relative_path or ':' in relative_path or any(part in ('', '.', '..') for part in parts):
+        raise ValueError(f'Unsafe path in the manifest: {relative_path!r}')
+    return path.join(root, *parts)
+
+class ManifestReader:
+    """File-like view of the manifest's files back-to-back, so FileSender packs small files into shared chunks.
+    Every file contributes exactly the size it had when it was hashed."""
+    def __init__(self, sources: List[str], entries: List[ManifestEntry]) -> None:
+        self._sources = sources
+        self._entries = entries
+        self._index = 0
+        self._file: BinaryIO | None = None
+        self._remaining = 0
+
+    def read(self, size: int) -> bytes:
+        parts = []
+        while size > 0 and self._index < len(self._entries):
+            if self._file == None:
+                self._file = open(self._sources[self._index], 'rb')
+                self._remaining = self._entries[self._index].size
+            part = self._file.read(min(size, self._remaining))
+            if not part and self._remaining > 0:
+                raise OSError(f'{self._sources[self._index]} shrank while it was being sent!')
+            parts.append(part)
+            size -= len(part)
+            self._remaining -= len(part)
+            if self._remaining == 0:
+                self._file.close()
+                self._file = None
+                self._index += 1
+        return b''.join(parts)
+
+    def close(self) -> None:
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> 'ManifestReader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class ManifestWriter:
+    """Splits the incoming byte stream back into the manifest's files under root, checking each file's sha256
+    as soon as its last byte is written. Every file is written under its path plus .part, so files of the same
+    paths stay intact until commit() renames them all into place, or discard() removes them.
+    Meant to be driven from the worker pool like a regular file."""
+    def __init__(self, root: str, entries: List[ManifestEntry]) -> None:
+        self.root = root
+        self.corrupted: List[str] = []      # Entry paths whose content didn't match the manifest
+        self._entries = entries
+        self._paths = [safe_join(root, entry.path) for entry in entries]
+        self._part_paths = [file_path + TransferJournal.PART_SUFFIX for file_path in self._paths]
+        self._index = -1
+        self._file: BinaryIO | None = None
+        self._digest = None
+        self._remaining = 0
+        self._next_file()
+
+    def _close_file(self) -> None:
+        if self._file != None:
+            self._file.close()
+            self._file = None
+            if self._remaining == 0 and self._digest.hexdigest() != self._entries[self._index].sha256:
+                self.corrupted.append(self._entries[self._index].path)
+
+    def _next_file(self) -> None:
+        """Moves to the next entry with content, creating the empty ones on the way."""
+        while True:
+            self._close_file()
+            self._index += 1
+            if self._index >= len(self._entries):
+                return
+            makedirs(path.dirname(self._paths[self._index]), exist_ok= True)
+            self._file = open(self._part_paths[self._index], 'wb')
+            self._digest = sha256()
+            self._remaining = self._entries[self._index].size
+            if self._remaining > 0:
+                return
+
+    def write(self, chunk: bytes) -> int:
+        view = memoryview(chunk)
+        while view:
+            if self._file == None:
+                raise ValueError('Received more bytes than the manifest describes!')
+            part = view[:self._remaining]
+            self._file.write(part)
+            self._digest.update(part)
+            self._remaining -= len(part)
+            view = view[len(part):]
+            if self._remaining == 0:
+                self._next_file()
+        return len(chunk)
+
+    def close(self) -> None:
+        self._close_file() # An unfinished file is left as it is, without being verified
+
+    def commit(self) -> None:
+        """Renames the received files into place, replacing the files of the same paths."""
+        self.close()
+        for part_path, file_path in zip(self._part_paths[:self._index + 1], self._paths):
+            replace(part_path, file_path)
+
+    def discard(self) -> None:
+        """Removes the files of a transfer that didn't complete, leaving the files of the same paths as they were."""
+        self.close()
+        for part_path in self._part_paths[:self._index + 1]:
+            if path.exists(part_path):
+                remove(part_path)
+
+    def __enter__(self) -> 'ManifestWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
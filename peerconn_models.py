@@ -1,11 +1,14 @@
 from dataclasses import (dataclass, field)
-from asyncio import (AbstractServer, Event)
+from asyncio import (AbstractServer, Event, Queue)
 from asyncio.streams import (StreamReader, StreamWriter)
 from datetime import (datetime)
-from typing import (List)
+from enum import (IntEnum)
+from sys import (intern)
+from typing import (Any, Dict, List)
+from time import (perf_counter)
 from cryptography.fernet import (Fernet)
 
-class MessageTypes:
+class MessageTypes(IntEnum):
     ME:                     int = 0
     PEER:                   int = 1
     CONNECTION_ESTABLISHED: int = 2
@@ -14,6 +17,32 @@ class MessageTypes:
     FILE_NOTIFY_1:          int = 5
     SYSTEM_WARN:            int = 6
 
+class FrameTypes:
+    KEY_EXCHANGE:           int = 0     # Encoded PeerPacket of the handshake, plaintext
+    MESSAGE:                int = 1     # Encrypted PeerPacket carrying a chat message
+    FILE_HEADER:            int = 2     # Encoded FileData, starts a file transaction
+    FILE_CHUNK:             int = 3     # Encrypted chunk of the current file
+    FILE_END:               int = 4     # Sender has written every chunk of the current file; striped, encoded count of the data connections opened
+    FILE_CANCEL:            int = 5     # Sender has aborted the current file
+    FILE_RAW:               int = 6     # Plaintext file bytes of a trusted link, payload is streamed instead of buffered
+    FILE_RESUME:            int = 7     # Receiver's reply to FILE_HEADER, encoded FileResume
+    STRIPE_HELLO:           int = 8     # First frame of an extra data connection, encoded StripeHello
+    FILE_RANGE:             int = 9     # !QI offset and chunk counter, then the encrypted chunk; striped transfers only
+    MESSAGE_BATCH:          int = 10    # Encrypted list of PeerPackets coalesced by the sender's MessageBatcher
+    SESSION_HELLO:          int = 11    # First frame of a client's message and file connections, encoded SessionHello
+    MUX_HELLO:              int = 12    # First frame of a client's only connection when it is multiplexed, encoded SessionHello; mux frames follow
+    SESSION_RESUME:         int = 13    # Server's answer to a hello with a ticket, encoded bool; True skips the key exchange
+    HEARTBEAT:              int = 14    # Encoded loop time of the sender, echoed back in a HEARTBEAT_ACK
+    HEARTBEAT_ACK:          int = 15    # Payload of the HEARTBEAT it answers
+
+# Data class to represent a single length-prefixed frame on a channel
+@dataclass
+class Frame:
+    type:           int | None = None
+    flags:          int = 0
+    length:         int = 0             # Payload length from the header
+    payload:      bytes = b''
+
 # Data class to store peer connection details
 @dataclass
 class PeerData:
@@ -27,14 +56,136 @@ class FileData:
     name:           str | None = None
     extension:      str | None = None
     size :          int | None = None
+    cipher:         str | None = None               # Chunk cipher mode, None for peers that only know Fernet
+    nonce_prefix: bytes | None = None               # Per transfer nonce prefix of an AEAD chunk cipher
+    transfer_id:    str | None = None               # Stable id of the file so an interrupted transfer can be resumed
+    stripes:        int = 1                         # Extra data connections carrying the chunks, 1 keeps them on the file socket
+    manifest: List['ManifestEntry'] | None = None   # Files of a multi-file transfer, their bodies follow back-to-back as one stream
+    compression:    str | None = None               # Mode of the chunks flagged as compressed, None when none are
+    chunk_hashes: List[str] | None = None           # sha256 of every chunk, lets the receiver copy the ones it already has
+
+# Data class to describe one file of a multi-file transfer
+@dataclass
+class ManifestEntry:
+    path:           str | None = None               # Relative path with '/' separators, rebuilt under the downloads directory
+    size:           int = 0
+    sha256:         str | None = None               # Hex digest the receiver checks the written file against
+
+# Data class for the receiver's answer to a file header
+@dataclass
+class FileResume:
+    transfer_id:    str | None = None
+    offset:         int = 0                         # Bytes the receiver already holds, the sender starts from here
+    missing:  List[int] | None = None               # Chunks a deduplicating receiver still lacks, the sender sends only these
+
+# Data class introducing an extra data connection of a striped transfer
+@dataclass
+class StripeHello:
+    transfer_id:    str | None = None
+    index:          int = 0
 
-# Data class to represent individual messages
+# Data class introducing a client's message or file connection to a server peersocket
 @dataclass
+class SessionHello:
+    session_id:     str | None = None               # Same on both connections of a client, so the server pairs them into one session
+    ticket:       bytes | None = None               # Resumption ticket of a reconnecting client, skips the key exchange
+
+# Data class to represent individual messages, kept by the million in chat histories
+@dataclass(slots= True)
 class Message:
-    sender:         str | None = 'sender'           # Name of the sender
+    sender:         str | None = 'sender'           # Name of the sender, interned so a history shares one string per peer
     content:        str | None = 'message_content'  # Content of the message
-    date_time: datetime | None = None               # Indicates when the message was sent/received
-    type:           int | None = None
+    timestamp:    float | None = None               # time() when the message was sent/received
+    type:           int | None = None               # MessageTypes
+
+    def __post_init__(self) -> None:
+        if type(self.sender) is str:
+            self.sender = intern(self.sender)
+
+    @property
+    def date_time(self) -> datetime | None:
+        return datetime.fromtimestamp(self.timestamp) if self.timestamp != None else None
+
+# Data class for one result of a history search
+@dataclass(slots= True)
+class SearchHit:
+    history_id:     str | None = None               # Id of the peersocket the message belongs to
+    position:       int = 0                         # Index of the message in that peersocket's history
+    message:    Message | None = None
+
+# Data class to measure a single file transfer
+@dataclass
+class TransferStats:
+    size:               int = 0             # Total bytes of the file
+    transferred:        int = 0             # File bytes moved so far
+    resumed_from:       int = 0             # Offset the transfer started at, not counted in the throughput
+    chunk_size:         int = 0             # Last chunk size picked by the sender
+    started:          float = 0.0           # perf_counter() when the transfer started
+    finished:         float | None = None   # perf_counter() when the transfer ended
+    compression:        str | None = None   # Compression mode of the chunks, the sender drops it for an incompressible file
+    wire_bytes:         int = 0             # Chunk payload bytes that crossed the wire, after compression and encryption
+    compression_time: float = 0.0           # CPU seconds spent compressing or decompressing chunks
+    stripes:            int = 0             # Data connections a striped send opened, 0 when its ranges went over the file socket
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished if self.finished != None else perf_counter()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second."""
+        elapsed = self.elapsed
+        return (self.transferred - self.resumed_from) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def percentage(self) -> int:
+        return round((self.transferred * 100) / self.size) if self.size else 100
+
+    @property
+    def compression_ratio(self) -> float:
+        """File bytes per byte on the wire, above 1.0 when compression paid off."""
+        return (self.transferred - self.resumed_from) / self.wire_bytes if self.wire_bytes else 1.0
+
+    def __str__(self) -> str:
+        text = f'{self.transferred} bytes in {self.elapsed:.2f}s, {self.throughput / (1024 * 1024):.2f} MiB/s'
+        if self.compression != None:
+            text += f', {self.compression} {self.compression_ratio:.2f}x in {self.compression_time:.2f}s CPU'
+        return text
+
+# Data class to measure one priority lane of the command dispatcher
+@dataclass
+class LaneStats:
+    depth:              int = 0             # Commands waiting in the lane right now
+    dispatched:         int = 0             # Commands started so far
+    total_wait:       float = 0.0           # Seconds between queueing and starting, summed over dispatched commands
+    max_wait:         float = 0.0
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.dispatched if self.dispatched else 0.0
+
+    def __str__(self) -> str:
+        return f'{self.depth} waiting, {self.dispatched} dispatched, wait avg {self.average_wait * 1000:.2f} ms max {self.max_wait * 1000:.2f} ms'
+
+# Data class to measure the message batching of a peersocket
+@dataclass
+class BatchStats:
+    messages:           int = 0             # Packets handed to the batcher
+    frames:             int = 0             # Frames written for them
+    wire_bytes:         int = 0             # Frame payload bytes, after compression and encryption
+    idle_flushes:       int = 0             # Packets that found the link idle and went out at once
+    timer_flushes:      int = 0             # Batches flushed when the latency budget ran out
+    size_flushes:       int = 0             # Batches flushed early for reaching the size or count threshold
+    largest_batch:      int = 0             # Most packets that shared one frame
+    dropped:            int = 0             # Packets still pending when the writer was already closing, that no outbox took back
+
+    @property
+    def messages_per_frame(self) -> float:
+        return self.messages / self.frames if self.frames else 0.0
+
+    def __str__(self) -> str:
+        return (f'{self.messages} messages in {self.frames} frames ({self.messages_per_frame:.2f} per frame, largest {self.largest_batch}), '
+                f'{self.wire_bytes} bytes, flushes idle/timer/size = {self.idle_flushes}/{self.timer_flushes}/{self.size_flushes}')
 
 @dataclass
 class PeerPacket:
@@ -44,11 +195,44 @@ class PeerPacket:
     message:        Message | None = None
     file_data:     FileData | None = None
     file_bytes:       bytes | None = None
+    ciphers:      List[str] | None = None           # File channel cipher modes offered during exchange_key
+    trusted_link:       bool = False                # Whether this side allows plaintext file transfers sent with sendfile
+    file_streams:       int = 1                     # Data connections per file this side accepts
+    compressions: List[str] | None = None           # Compression modes offered during exchange_key
+    dedup:              bool = False                # Whether this side announces and looks up chunk hashes
+    heartbeats:         bool = False                # Whether this side answers HEARTBEAT frames
 
-# Data class to manage message history
+# Data class to measure the message channel of a peersocket by its heartbeats
 @dataclass
+class LinkStats:
+    srtt:             float | None = None   # Smoothed round trip time in seconds, as in RFC 6298
+    rttvar:           float = 0.0           # Its smoothed mean deviation
+    jitter:           float = 0.0           # Smoothed difference of consecutive round trip times, as in RFC 3550
+    last_rtt:         float | None = None
+    samples:            int = 0
+    last_heard:       float = 0.0           # Loop time of the last frame the peer sent on the message channel
+    missed:             int = 0             # Heartbeat intervals the peer has been silent for
+
+    def add_sample(self, rtt: float) -> None:
+        if self.srtt == None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        if self.last_rtt != None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+        self.samples += 1
+
+    def __str__(self) -> str:
+        if self.srtt == None:
+            return 'no round trips yet'
+        return f'rtt {self.srtt * 1000:.2f} ms ± {self.rttvar * 1000:.2f} ms, jitter {self.jitter * 1000:.2f} ms over {self.samples} heartbeats'
+
+# Data class to manage message history
+@dataclass(slots= True)
 class History:
-    messages:       List[Message] | None = field(default_factory=list)  # List of messages
+    messages:       List[Message] | Any = field(default_factory=list)   # List of messages, or the MessageStore PeerConn gives every peersocket
     new_messages:       int = 0                                         # Number of undisplayed messages
 
 # Data class to store references to servers
@@ -58,14 +242,14 @@ class Servers:
     file_server:    AbstractServer | None = None    # Reference to the server for handling files
 
 # Data class to manage data streams
-@dataclass
+@dataclass(slots= True)
 class Streams:
     msg_reader:     StreamReader | None = None      # Reader to read data from the socket (messages)
     msg_writer:     StreamWriter | None = None      # Writer to write data to the socket (messages)
     file_reader:    StreamReader | None = None      # Reader to read data from the socket (files)
     file_writer:    StreamWriter | None = None      # Writer to write data to the socket (files)
 
-@dataclass
+@dataclass(slots= True)
 class Events:
     msg_event_server:   Event | None = None
     file_event_server:  Event | None = None
@@ -73,7 +257,7 @@ class Events:
     file_event_stream:  Event | None = None
 
 # Main class representing an asynchronous socket
-@dataclass
+@dataclass(slots= True)
 class PeerSocket:
     id:                         str | None = None        # An identifier for the socket (could be None if not assigned)
     servers:                Servers | None = None        # References to servers for handling messages and files
@@ -85,5 +269,29 @@ class PeerSocket:
     file_comm_connected:    bool = False                 # Indicates whether the file communication established
     in_file_transaction:    bool = False
     file_percentage:            int | None = 0
+    file_throughput:          float = 0.0                # Bytes per second of the last or current file transfer
     key:                        str | None = None
-    cipher_suite:           Fernet | None = None
\ No newline at end of file
+    cipher_suite:           Fernet | None = None
+    file_cipher_mode:          str | None = None        # Cipher mode negotiated for the file channel
+    file_key:                bytes | None = None        # Key of the file channel when the mode is an AEAD
+    trusted_link:               bool = False            # Both sides allow plaintext file transfers the sender hands to sendfile
+    file_replies:              Queue | None = None      # FileResume replies of the peer, read by hm_send_file
+    file_streams:                int = 1                # Negotiated data connections per file, only client peersockets open them
+    incoming_stripes:            Any = None             # StripedReceive of the striped file being received
+    compression:                str | None = None       # Compression mode negotiated for both channels, None disables it
+    dedup:                      bool = False            # Both sides skip chunks the receiver already has
+    message_batcher:             Any = None             # MessageBatcher of the outgoing messages, set once the keys are exchanged
+    sessions: Dict[str, 'PeerSocket'] | None = None     # Server peersockets: session of every accepted client by its session id
+    parent_id:                  str | None = None       # Sessions: id of the server peersocket that accepted the client
+    mux:                         Any = None             # MuxConnection carrying both channels when they share one connection
+    session_id:                 str | None = None       # Clients: session the server keeps for them, the same across reconnects
+    resume_ticket:            bytes | None = None       # Derived by the key exchange, a reconnecting client presents it to skip the next one
+    resumed:                    bool | None = None      # Whether the last connection resumed the session, None when no ticket was presented
+    resume_expiry:               Any = None             # Sessions: TimerHandle that forgets a dropped session its client didn't resume
+    reconnect:                  bool = False            # Clients: the supervisor reconnects after a drop, hm_close clears it
+    supervisor:                  Any = None             # Clients: Task running the channels and reconnecting them
+    outbox:                      Any = None             # Clients: bounded deque of encoded PeerPackets sent while the link was down
+    heartbeats:                 bool = False            # The peer answers heartbeats, so its silence means it is gone
+    link:             LinkStats | None = None           # Round trip time and liveness of the message channel, from heartbeats
+    uplink:                      Any = None             # FairScheduler over the rate limit of file uploads to the peer, made on first use
+    interrupted_send:     str | None = None             # Clients: file whose send the link dropped, sent again, and resumed, once reconnected
\ No newline at end of file
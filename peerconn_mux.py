@@ -0,0 +1,289 @@
+from peerconn_models import (StreamReader, StreamWriter)
+from asyncio import (Event, Protocol, StreamReaderProtocol, Task, Transport, IncompleteReadError, create_task, get_running_loop)
+from collections import (deque)
+from socket import (IPPROTO_TCP)
+from struct import (Struct)
+from typing import (Any, Deque, Dict, List, Set, Tuple)
+try:
+    from socket import (TCP_NOTSENT_LOWAT)
+except ImportError:
+    TCP_NOTSENT_LOWAT = None # Linux and macOS only
+
+MUX_HEADER:              Struct = Struct('!BBI')        # stream id, kind, payload length
+
+class MuxKinds:
+    DATA:                   int = 0     # Payload is the next bytes of the stream
+    PAUSE:                  int = 1     # The receiver's buffer of the stream is full, the sender holds its data back
+    RESUME:                 int = 2     # ...the receiver has read it down again
+    CLOSE:                  int = 3     # The sender won't write to the stream any more
+
+class MuxStreams:
+    MESSAGE:                int = 0     # Chat frames
+    FILE:                   int = 1     # File frames
+
+class MuxError(Exception):
+    """Raised for a mux frame of an unknown stream or kind, or an oversized one."""
+
+class MuxTransport(Transport):
+    """One logical stream of a MuxConnection, looking like a socket transport to an asyncio StreamReader/StreamWriter pair.
+    Writes wait in a queue of their own until the connection's sender takes them a segment at a time, so the
+    write buffer limits and drain() of each stream work as they do on a socket. pause_reading() and resume_reading(),
+    called by the StreamReader as its buffer fills up and drains, tell the peer to hold back or go on with this stream only."""
+    def __init__(self, connection: 'MuxConnection', stream_id: int, protocol: Protocol) -> None:
+        super().__init__()
+        self.stream_id = stream_id
+        self._connection = connection
+        self._protocol = protocol
+        self._pending: Deque[bytes | memoryview] = deque()
+        self._pending_bytes = 0
+        self._high_water = 64 * 1024
+        self._low_water = 16 * 1024
+        self._writing_paused = False    # The protocol was told to pause writing
+        self._peer_paused = False       # The peer sent PAUSE for this stream
+        self._reading = True
+        self._closing = False           # close() was called, CLOSE follows the pending data
+        self._closed = False            # The protocol has lost the stream
+
+    def write(self, data: bytes | bytearray | memoryview) -> None:
+        if self._closing or not data:
+            return
+        if type(data) is not bytes:
+            data = bytes(data) # The caller may reuse its buffer
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        self._connection._schedule(self)
+        if not self._writing_paused and self._pending_bytes > self._high_water:
+            self._writing_paused = True
+            self._protocol.pause_writing()
+
+    def writelines(self, list_of_data: List[bytes]) -> None:
+        for data in list_of_data:
+            self.write(data)
+
+    def _take(self, size: int) -> Tuple[List[bytes | memoryview], int]:
+        """Up to size pending bytes, for the next DATA frame."""
+        pieces = []
+        taken = 0
+        while self._pending and taken < size:
+            data = self._pending[0]
+            if len(data) <= size - taken:
+                self._pending.popleft()
+            else:
+                view = memoryview(data)
+                data, self._pending[0] = view[:size - taken], view[size - taken:]
+            pieces.append(data)
+            taken += len(data)
+        self._pending_bytes -= taken
+        if self._writing_paused and self._pending_bytes <= self._low_water:
+            self._writing_paused = False
+            self._protocol.resume_writing()
+        return pieces, taken
+
+    def get_write_buffer_size(self) -> int:
+        return self._pending_bytes
+
+    def get_write_buffer_limits(self) -> Tuple[int, int]:
+        return self._low_water, self._high_water
+
+    def set_write_buffer_limits(self, high: int | None = None, low: int | None = None) -> None:
+        if high == None:
+            high = 64 * 1024 if low == None else 4 * low
+        if low == None:
+            low = high // 4
+        self._high_water, self._low_water = high, low
+
+    def pause_reading(self) -> None:
+        if self._reading and not self._closed:
+            self._reading = False
+            self._connection._send_control(self.stream_id, MuxKinds.PAUSE)
+
+    def resume_reading(self) -> None:
+        if not self._reading and not self._closed:
+            self._reading = True
+            self._connection._send_control(self.stream_id, MuxKinds.RESUME)
+
+    def is_reading(self) -> bool:
+        return self._reading
+
+    def close(self) -> None:
+        if not self._closing:
+            self._closing = True
+            self._connection._schedule(self)
+
+    def abort(self) -> None:
+        self._pending.clear()
+        self._pending_bytes = 0
+        self.close()
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def can_write_eof(self) -> bool:
+        return False
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return self._connection.get_extra_info(name, default)
+
+    def set_protocol(self, protocol: Protocol) -> None:
+        self._protocol = protocol
+
+    def get_protocol(self) -> Protocol:
+        return self._protocol
+
+    def _received(self, kind: int, payload: bytes) -> None:
+        if self._closed:
+            return
+        if kind == MuxKinds.DATA:
+            self._protocol.data_received(payload)
+        elif kind == MuxKinds.PAUSE:
+            self._peer_paused = True
+        elif kind == MuxKinds.RESUME:
+            self._peer_paused = False
+            self._connection._schedule(self)
+        elif kind == MuxKinds.CLOSE:
+            self._protocol.eof_received()
+        else:
+            raise MuxError(f'Unknown mux frame kind {kind}!')
+
+    def _lose(self, exc: Exception | None) -> None:
+        """The stream is gone, either closed here or with its connection; like a socket, it can't be read any more either."""
+        if not self._closed:
+            self._closed = True
+            self._closing = True
+            self._pending.clear()
+            self._pending_bytes = 0
+            self._protocol.connection_lost(exc)
+
+class MuxConnection:
+    """Carries several logical byte streams over one connection, so a client needs a single port for chat and files.
+    Every stream has its own buffers and flow control: a receiver that stops reading a stream pauses only that
+    stream on the sender, and the sender takes at most SEGMENT_SIZE bytes from each ready stream in turn, so a
+    message waits behind at most a few segments of a file instead of the whole transfer.
+    The connection is closed once every stream it opened is closed."""
+    SEGMENT_SIZE:           int = 16 * 1024             # Largest DATA payload
+    WRITE_BATCH:            int = 256 * 1024            # Bytes written to the socket between drains
+    SOCKET_HIGH_WATER:      int = 256 * 1024            # Kept low so data waits in the stream queues, where a message can overtake it
+    SOCKET_NOTSENT_LOWAT:   int = 128 * 1024            # ...and out of the kernel's send buffer too, where nothing can overtake it
+    READ_LIMIT:             int = 4 * 1024 * 1024       # StreamReader limit of every stream; the peer is paused at twice this
+
+    def __init__(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._writer.transport.set_write_buffer_limits(high= self.SOCKET_HIGH_WATER)
+        sock = writer.get_extra_info('socket')
+        if sock != None and TCP_NOTSENT_LOWAT != None:
+            try:
+                sock.setsockopt(IPPROTO_TCP, TCP_NOTSENT_LOWAT, self.SOCKET_NOTSENT_LOWAT)
+            except OSError:
+                pass # Only a latency optimization
+        self._streams: Dict[int, MuxTransport] = {}
+        self._ready: Deque[MuxTransport] = deque()      # Streams with data or a CLOSE to send, in turn
+        self._scheduled: Set[MuxTransport] = set()
+        self._control: List[bytes] = []                 # PAUSE and RESUME frames, sent ahead of any data
+        self._wakeup = Event()
+        self._closed = False
+        self._send_task: Task = create_task(self._send_loop())
+        self._receive_task: Task = create_task(self._receive_loop())
+
+    def open_stream(self, stream_id: int) -> Tuple[StreamReader, StreamWriter]:
+        """Both sides must open the same stream ids before the peer writes to them."""
+        if stream_id in self._streams:
+            raise MuxError(f'Stream {stream_id} is already open!')
+        loop = get_running_loop()
+        reader = StreamReader(limit= self.READ_LIMIT, loop= loop)
+        protocol = StreamReaderProtocol(reader, loop= loop)
+        transport = MuxTransport(self, stream_id, protocol)
+        self._streams[stream_id] = transport
+        protocol.connection_made(transport)
+        if self._closed:
+            transport._lose(None)
+        return reader, StreamWriter(transport, protocol, reader, loop)
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return self._writer.get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self._closed
+
+    def abort(self) -> None:
+        """Drops the connection without sending what is queued; every stream reads EOF."""
+        self._writer.transport.abort()
+        self._close(None)
+
+    def _schedule(self, transport: MuxTransport) -> None:
+        if transport not in self._scheduled and not transport._peer_paused and not transport._closed:
+            self._scheduled.add(transport)
+            self._ready.append(transport)
+            self._wakeup.set()
+
+    def _send_control(self, stream_id: int, kind: int) -> None:
+        if not self._closed:
+            self._control.append(MUX_HEADER.pack(stream_id, kind, 0))
+            self._wakeup.set()
+
+    async def _send_loop(self) -> None:
+        exc = None
+        try:
+            while not self._closed:
+                if not self._control and not self._ready:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                buffers, self._control = self._control, []
+                written = 0
+                closed: List[MuxTransport] = []
+                while self._ready and written < self.WRITE_BATCH:
+                    transport = self._ready.popleft()
+                    if transport._peer_paused or transport._closed:
+                        self._scheduled.discard(transport)
+                        continue
+                    pieces, length = transport._take(self.SEGMENT_SIZE)
+                    if length:
+                        buffers.append(MUX_HEADER.pack(transport.stream_id, MuxKinds.DATA, length))
+                        buffers.extend(pieces)
+                        written += length
+                    if transport._pending_bytes:
+                        self._ready.append(transport)
+                    else:
+                        self._scheduled.discard(transport)
+                        if transport._closing:
+                            buffers.append(MUX_HEADER.pack(transport.stream_id, MuxKinds.CLOSE, 0))
+                            closed.append(transport)
+                self._writer.writelines(buffers)
+                await self._writer.drain()
+                for transport in closed:
+                    transport._lose(None)
+                if closed and all(transport._closed for transport in self._streams.values()):
+                    break
+        except Exception as ex:
+            exc = ex
+        finally:
+            self._close(exc)
+
+    async def _receive_loop(self) -> None:
+        exc = None
+        try:
+            while True:
+                header = await self._reader.readexactly(MUX_HEADER.size)
+                stream_id, kind, length = MUX_HEADER.unpack(header)
+                if length > self.SEGMENT_SIZE:
+                    raise MuxError(f'Mux frame is too large: {length}')
+                transport = self._streams.get(stream_id)
+                if transport == None:
+                    raise MuxError(f'Mux frame of unknown stream {stream_id}!')
+                transport._received(kind, await self._reader.readexactly(length) if length else b'')
+        except IncompleteReadError:
+            pass # The peer closed the connection
+        except Exception as ex:
+            exc = ex
+        finally:
+            self._close(exc)
+
+    def _close(self, exc: Exception | None) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        for transport in self._streams.values():
+            transport._lose(exc)
+        self._writer.close()
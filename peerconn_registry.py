@@ -0,0 +1,99 @@
+from peerconn_models import (PeerSocket)
+from threading import (Lock)
+from typing import (Callable, Dict, Iterator, List)
+
+class PeerSocketRegistry:
+    """PeerSockets by id, with an index per role (server, client or session of a server) and per connection state (active or inactive).
+    The indexes are dicts used as ordered sets so lookups are O(1) and listings keep the creation order;
+    whoever changes servers, msg_comm_connected or file_comm_connected calls refresh() afterwards.
+    on_change is called with the id of a peersocket whose role or state moved it between indexes.
+    The loop thread changes it while the GUI thread lists and searches it, so every access holds a lock;
+    listings are snapshots taken under it, and on_change is called after releasing it."""
+    def __init__(self, on_change: Callable[[str], None] | None = None) -> None:
+        self._on_change = on_change
+        self._lock = Lock()
+        self._by_id: Dict[str, PeerSocket] = {}
+        self._servers: Dict[str, PeerSocket] = {}
+        self._clients: Dict[str, PeerSocket] = {}
+        self._sessions: Dict[str, PeerSocket] = {}     # Accepted clients of the server peersockets
+        self._active: Dict[str, PeerSocket] = {}       # Both the message and the file socket are connected
+        self._inactive: Dict[str, PeerSocket] = {}     # Neither of them is
+
+    def add(self, peersocket: PeerSocket) -> None:
+        with self._lock:
+            if peersocket.id in self._by_id:
+                raise KeyError(f'{peersocket.id} is already registered!')
+            self._by_id[peersocket.id] = peersocket
+        self.refresh(peersocket)
+
+    def remove(self, id: str) -> PeerSocket | None:
+        with self._lock:
+            peersocket = self._by_id.pop(id, None)
+            if peersocket != None:
+                for index in (self._servers, self._clients, self._sessions, self._active, self._inactive):
+                    index.pop(id, None)
+            return peersocket
+
+    def get(self, id: str) -> PeerSocket | None:
+        with self._lock:
+            return self._by_id.get(id)
+
+    def refresh(self, peersocket: PeerSocket) -> None:
+        """Moves the peersocket to the indexes matching its current role and state."""
+        id = peersocket.id
+        with self._lock:
+            if id not in self._by_id:
+                return
+            changed = self._set(self._servers, id, peersocket, peersocket.servers != None)
+            changed |= self._set(self._clients, id, peersocket, peersocket.servers == None and peersocket.parent_id == None)
+            changed |= self._set(self._sessions, id, peersocket, peersocket.parent_id != None)
+            changed |= self._set(self._active, id, peersocket, peersocket.msg_comm_connected and peersocket.file_comm_connected)
+            changed |= self._set(self._inactive, id, peersocket, not peersocket.msg_comm_connected and not peersocket.file_comm_connected)
+        if changed and self._on_change != None:
+            self._on_change(id)
+
+    @staticmethod
+    def _set(index: Dict[str, PeerSocket], id: str, peersocket: PeerSocket, member: bool) -> bool:
+        """Returns whether the membership changed."""
+        if member:
+            changed = id not in index
+            index[id] = peersocket # Re-inserting an existing key keeps its position
+            return changed
+        return index.pop(id, None) != None
+
+    def servers(self) -> List[PeerSocket]:
+        with self._lock:
+            return list(self._servers.values())
+
+    def clients(self) -> List[PeerSocket]:
+        with self._lock:
+            return list(self._clients.values())
+
+    def sessions(self) -> List[PeerSocket]:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def active(self) -> List[PeerSocket]:
+        with self._lock:
+            return list(self._active.values())
+
+    def inactive(self) -> List[PeerSocket]:
+        with self._lock:
+            return list(self._inactive.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            for index in (self._by_id, self._servers, self._clients, self._sessions, self._active, self._inactive):
+                index.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._by_id)
+
+    def __iter__(self) -> Iterator[PeerSocket]:
+        with self._lock: # A snapshot, so closing or removing while iterating is safe, also from another thread
+            return iter(list(self._by_id.values()))
+
+    def __contains__(self, id: str) -> bool:
+        with self._lock:
+            return id in self._by_id
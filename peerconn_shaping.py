@@ -0,0 +1,125 @@
+from asyncio import (Event, Future, Task, FIRST_COMPLETED, create_task, get_running_loop, sleep, wait)
+from heapq import (heappop, heappush)
+from itertools import (count)
+from time import (monotonic)
+from typing import (Dict, List, Tuple)
+
+class TokenBucket:
+    """Caps a byte rate: tokens drip in at rate per second up to burst, and taking more than there are
+    leaves the bucket in debt, which the next taker waits out; chunks larger than the burst still pass at the rate.
+    A rate of 0 is unlimited. set_rate() wakes up a waiting taker to wait by the new rate instead."""
+    BURST_TIME:           float = 0.25          # Seconds of the rate an idle bucket saves up
+    MIN_BURST:              int = 64 * 1024
+
+    def __init__(self, rate: float = 0) -> None:
+        self.rate = 0.0
+        self.burst = 0.0
+        self._tokens = 0.0
+        self._updated = monotonic()
+        self._changed: Future | None = None
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float) -> None:
+        self._refill()
+        self.rate = max(0.0, float(rate or 0))
+        self.burst = max(self.rate * self.BURST_TIME, self.MIN_BURST) if self.rate else 0.0
+        self._tokens = min(self._tokens, self.burst) if self.rate else 0.0
+        if self._changed != None and not self._changed.done():
+            self._changed.set_result(None)
+
+    def _refill(self) -> None:
+        now = monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def ready(self) -> None:
+        """Waits until the bucket is out of debt."""
+        self._refill()
+        while self.rate and self._tokens < 0:
+            if self._changed == None or self._changed.done():
+                self._changed = get_running_loop().create_future()
+            await wait((self._changed,), timeout= -self._tokens / self.rate)
+            self._refill()
+
+    def take(self, size: int) -> None:
+        if self.rate:
+            self._refill()
+            self._tokens -= size
+
+    async def acquire(self, size: int) -> None:
+        await self.ready()
+        self.take(size)
+
+class FairScheduler:
+    """Hands the bytes of a TokenBucket to the sends sharing it by weighted fair queueing (self-clocked):
+    each chunk is stamped with a virtual finish time, its send's previous finish time or the current virtual
+    time, whichever is later, plus its size over the send's weight. Whenever the bucket is out of debt, the chunk
+    with the smallest stamp is let through; a send that just went has queued its next chunk by then, so sends
+    of weight 3 get three times the bytes of sends of weight 1, and a send that just started doesn't wait
+    behind the backlog of a long one. weight is this scheduler's own share in the schedulers above it."""
+    def __init__(self, bucket: TokenBucket, weight: float = 1.0) -> None:
+        self.bucket = bucket
+        self.weight = weight
+        self._virtual_time = 0.0
+        self._waiting: List[Tuple[float, int, int, Future]] = []   # (finish time, arrival, size, turn) heap
+        self._sequence = count()
+        self._dispatcher: Task | None = None
+
+    @property
+    def limited(self) -> bool:
+        return self.bucket.rate > 0
+
+    async def _dispatch(self) -> None:
+        while self._waiting:
+            await self.bucket.ready()
+            finish, _, size, turn = heappop(self._waiting)
+            if not turn.done(): # Cancelled sends leave their turns behind
+                self._virtual_time = finish
+                self.bucket.take(size)
+                turn.set_result(None)
+            await sleep(0) # Lets the send queue its next chunk before the bucket may already be ready again
+        self._dispatcher = None
+
+    async def acquire(self, size: int, weight: float, finish_times: Dict['FairScheduler', float]) -> None:
+        """Waits for size bytes of the bucket; finish_times holds the send's finish time in every scheduler,
+        stamped before any wait so concurrent chunks of one send, like its stripes, queue one after another."""
+        if not self.limited:
+            return
+        finish = max(self._virtual_time, finish_times.get(self, 0.0)) + size / max(weight, 1e-3)
+        finish_times[self] = finish
+        turn = get_running_loop().create_future()
+        heappush(self._waiting, (finish, next(self._sequence), size, turn))
+        if self._dispatcher == None:
+            self._dispatcher = create_task(self._dispatch())
+        await turn
+
+class TransferShaper:
+    """Paces one file send through a chain of schedulers, the peersocket's own first and the global one last.
+    It is its own flow in each of them, weighted by the scheduler below: a session by its own weight in its
+    server's scheduler, then by the server's weight in the global one."""
+    def __init__(self, schedulers: List[FairScheduler]) -> None:
+        self._schedulers = schedulers
+        self._finish_times: Dict[FairScheduler, float] = {}
+
+    @property
+    def limited(self) -> bool:
+        return any(scheduler.limited for scheduler in self._schedulers)
+
+    async def _acquire(self, size: int) -> None:
+        for index, scheduler in enumerate(self._schedulers):
+            await scheduler.acquire(size, self._schedulers[max(0, index - 1)].weight, self._finish_times)
+
+    async def wait(self, size: int, cancel_event: Event) -> None:
+        """Returns once size bytes may go out, or early once the send is cancelled."""
+        if not self.limited:
+            return
+        pacing = create_task(self._acquire(size))
+        cancelled = create_task(cancel_event.wait())
+        try:
+            await wait((pacing, cancelled), return_when= FIRST_COMPLETED)
+        finally:
+            cancelled.cancel()
+            pacing.cancel()
+        if pacing.done() and not pacing.cancelled() and pacing.exception() != None:
+            raise pacing.exception()
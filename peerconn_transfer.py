@@ -0,0 +1,328 @@
+from peerconn_models import (StreamReader, StreamWriter, TransferStats, FrameTypes, Frame)
+from peerconn_framing import (write_frame, encode_header, read_frame, FrameError)
+from peerconn_crypto import (ChunkCipher, seal, unseal)
+from peerconn_workers import (WorkerPool)
+from peerconn_journal import (TransferJournal)
+from peerconn_compression import (SAMPLE_SIZE, compress_chunk, decompress_chunk, is_compressible)
+from peerconn_shaping import (TransferShaper)
+from asyncio import (Event, Task, IncompleteReadError, create_task, get_running_loop, gather)
+from collections import (deque)
+from struct import (Struct)
+from time import (perf_counter)
+from typing import (BinaryIO, Callable, Deque, List, Set, Tuple)
+try:
+    from os import (pwrite)
+except ImportError:
+    pwrite = None # Not available on Windows, see write_at
+
+FILE_RANGE_HEADER:   Struct = Struct('!QI')     # Offset of the chunk in the file, chunk counter for the nonce
+
+def pack_chunk(compression: str | None, mode: str, key: bytes, nonce: bytes | None, chunk: bytes) -> Tuple[bytes, int, float]:
+    """Compresses then seals a chunk in one worker hop; returns the token, its frame flags and the compression CPU time."""
+    payload, flags, cpu_time = compress_chunk(compression, chunk)
+    return seal(mode, key, nonce, payload), flags, cpu_time
+
+def unpack_chunk(compression: str | None, mode: str, key: bytes, nonce: bytes | None, token: bytes, flags: int) -> Tuple[bytes, float]:
+    return decompress_chunk(compression, unseal(mode, key, nonce, token), flags)
+
+def read_at(file: BinaryIO, offset: int, size: int) -> bytes:
+    file.seek(offset)
+    return file.read(size)
+
+def write_at(file: BinaryIO, offset: int, data: bytes) -> None:
+    """Positional write; the file must be unbuffered and owned by one data connection."""
+    if pwrite != None:
+        pwrite(file.fileno(), data, offset)
+    else:
+        file.seek(offset)
+        file.write(data)
+
+class FileSender:
+    """Streams a file as FILE_CHUNK frames, sizing chunks from the measured send time and bounding
+    the bytes in flight with the transport's write buffer water marks instead of a fixed sleep.
+    Reads, compression and encryption run on the worker pool a few chunks ahead of the socket.
+    A shaper paces the chunks to the rate limits in force, checked again before every chunk."""
+    MIN_CHUNK_SIZE:         int = 64 * 1024             # Starting and smallest chunk size
+    MAX_CHUNK_SIZE:         int = 4 * 1024 * 1024       # Largest chunk size, keeps encrypted frames far below MAX_FRAME_SIZE
+    TARGET_CHUNK_TIME:    float = 0.05                  # Seconds a chunk should take from read to drain
+    HIGH_WATER:             int = 8 * 1024 * 1024       # drain() blocks once this many bytes are buffered
+    LOW_WATER:              int = 2 * 1024 * 1024       # ...and resumes once the buffer falls under this
+    PIPELINE_DEPTH:         int = 4                     # Chunks being encrypted ahead of the socket
+    RAW_SEGMENT_SIZE:       int = 16 * 1024 * 1024      # Bytes per FILE_RAW frame, cancel is checked between segments
+
+    def __init__(self, writer: StreamWriter, cipher: ChunkCipher, cancel_event: Event, workers: WorkerPool, compression: str | None = None,
+                 zero_copy: bool = True, shaper: TransferShaper | None = None) -> None:
+        self._writer = writer
+        self._cipher = cipher
+        self._cancel_event = cancel_event
+        self._workers = workers
+        self._compression = compression
+        self._zero_copy = zero_copy    # False when the writer isn't a socket the kernel can copy into, like a mux stream
+        self._shaper = shaper
+        self._writer.transport.set_write_buffer_limits(high= self.HIGH_WATER, low= self.LOW_WATER)
+
+    def next_chunk_size(self, chunk_size: int, chunk_time: float) -> int:
+        if chunk_time < self.TARGET_CHUNK_TIME / 2:
+            chunk_size *= 2
+        elif chunk_time > self.TARGET_CHUNK_TIME * 2:
+            chunk_size //= 2
+        return max(self.MIN_CHUNK_SIZE, min(self.MAX_CHUNK_SIZE, chunk_size))
+
+    def _encrypt(self, compression: str | None, chunk: bytes) -> Task:
+        return create_task(self._workers.run_cpu(pack_chunk, compression, self._cipher.mode, self._cipher.key, self._cipher.next_encrypt_nonce(), chunk))
+
+    async def send(self, file: BinaryIO, size: int, on_progress: Callable[[TransferStats], None] | None = None, offset: int = 0) -> TransferStats:
+        """Sends from the file's current position (the resume offset) until EOF or until the cancel event is set;
+        the returned stats are finished either way."""
+        stats = TransferStats(size= size, transferred= offset, resumed_from= offset, chunk_size= self.MIN_CHUNK_SIZE, started= perf_counter(),
+                              compression= self._compression)
+        pending: Deque[Tuple[int, Task]] = deque()     # (plain size, encryption) in chunk order
+        end_of_file = False
+        sampled = stats.compression == None
+        last_chunk_sent = stats.started
+        try:
+            while not self._cancel_event.is_set():
+                if not end_of_file:
+                    chunk = await self._workers.run_io(file.read, stats.chunk_size)
+                    if chunk and not sampled:
+                        sampled = True
+                        if not await self._workers.run_cpu(is_compressible, stats.compression, chunk[:SAMPLE_SIZE]):
+                            stats.compression = None
+                    if chunk:
+                        pending.append((len(chunk), self._encrypt(stats.compression, chunk)))
+                    else:
+                        end_of_file = True
+                if not pending:
+                    break
+                if end_of_file or len(pending) >= self.PIPELINE_DEPTH:
+                    chunk_size, encryption = pending.popleft()
+                    token, flags, cpu_time = await encryption
+                    if self._shaper != None:
+                        await self._shaper.wait(len(token), self._cancel_event)
+                    write_frame(self._writer, FrameTypes.FILE_CHUNK, token, flags)
+                    await self._writer.drain()
+                    stats.transferred += chunk_size
+                    stats.wire_bytes += len(token)
+                    stats.compression_time += cpu_time
+                    if on_progress != None:
+                        on_progress(stats)
+                    now = perf_counter()
+                    stats.chunk_size = self.next_chunk_size(stats.chunk_size, now - last_chunk_sent)
+                    last_chunk_sent = now
+        finally:
+            for _, encryption in pending:
+                encryption.cancel()
+        stats.finished = perf_counter()
+        return stats
+
+    async def send_raw(self, file: BinaryIO, size: int, on_progress: Callable[[TransferStats], None] | None = None, offset: int = 0) -> TransferStats:
+        """Trusted link path: the kernel copies the file into the socket, only frame headers pass through Python.
+        Without zero copy, or while a rate limit applies, the segments are read on the worker pool and written like chunks, still unencrypted."""
+        stats = TransferStats(size= size, transferred= offset, resumed_from= offset, chunk_size= self.RAW_SEGMENT_SIZE, started= perf_counter())
+        loop = get_running_loop()
+        while not self._cancel_event.is_set() and stats.transferred < size:
+            segment_size = min(self.RAW_SEGMENT_SIZE, size - stats.transferred)
+            self._writer.write(encode_header(FrameTypes.FILE_RAW, segment_size))
+            await self._writer.drain()
+            if self._zero_copy and (self._shaper == None or not self._shaper.limited):
+                await loop.sendfile(self._writer.transport, file, stats.transferred, segment_size)
+            else:
+                for block_offset in range(stats.transferred, stats.transferred + segment_size, FileReceiver.RAW_READ_SIZE):
+                    block_size = min(FileReceiver.RAW_READ_SIZE, stats.transferred + segment_size - block_offset)
+                    if self._shaper != None:
+                        await self._shaper.wait(block_size, self._cancel_event)
+                    self._writer.write(await self._workers.run_io(read_at, file, block_offset, block_size))
+                    await self._writer.drain()
+            stats.transferred += segment_size
+            if on_progress != None:
+                on_progress(stats)
+        stats.finished = perf_counter()
+        return stats
+
+class FileReceiver:
+    """Decrypts and decompresses FILE_CHUNK payloads on the worker pool and writes them in arrival order,
+    recording every written chunk in the transfer journal when there is one."""
+    PIPELINE_DEPTH:         int = 4                     # Chunks being decrypted ahead of the disk
+    RAW_READ_SIZE:          int = 1024 * 1024           # Largest piece taken from the reader per disk write
+
+    def __init__(self, file: BinaryIO, cipher: ChunkCipher, workers: WorkerPool, stats: TransferStats, journal: TransferJournal | None = None) -> None:
+        self._file = file
+        self._cipher = cipher
+        self._workers = workers
+        self._journal = journal
+        self._compression = stats.compression
+        self._pending: Deque[Task] = deque()
+        self.stats = stats
+
+    def _write(self, offset: int, chunk: bytes) -> None:
+        self._file.write(chunk)
+        if self._journal != None:
+            self._journal.record(offset, chunk)
+
+    async def _write_chunk(self, chunk: bytes) -> None:
+        await self._workers.run_io(self._write, self.stats.transferred, chunk)
+        self.stats.transferred += len(chunk)
+
+    async def _write_next(self) -> None:
+        chunk, cpu_time = await self._pending.popleft()
+        self.stats.compression_time += cpu_time
+        await self._write_chunk(chunk)
+
+    async def feed(self, token: bytes, flags: int = 0) -> None:
+        self.stats.wire_bytes += len(token)
+        self._pending.append(create_task(self._workers.run_cpu(unpack_chunk, self._compression, self._cipher.mode, self._cipher.key, self._cipher.next_decrypt_nonce(), token, flags)))
+        while len(self._pending) > self.PIPELINE_DEPTH:
+            await self._write_next()
+
+    async def flush(self) -> None:
+        while self._pending:
+            await self._write_next()
+
+    async def receive_raw(self, reader: StreamReader, length: int) -> None:
+        """Moves a FILE_RAW payload into the file as read() hands it over, nothing is decrypted or decompressed
+        on the way; StreamReader has no readinto(), so every read is still copied out of the reader's buffer."""
+        while length > 0:
+            chunk = await reader.read(min(length, self.RAW_READ_SIZE))
+            if not chunk:
+                raise ConnectionError('File socket closed in the middle of a raw segment!')
+            await self._write_chunk(chunk)
+            length -= len(chunk)
+
+    def abort(self) -> None:
+        while self._pending:
+            self._pending.popleft().cancel()
+
+class StripedFileSender:
+    """Spreads one file over several data connections: connection k carries chunks k, k + n, k + 2n...
+    as offset-addressed FILE_RANGE frames, so each connection gets its own congestion window.
+    With a single writer it also sends the scattered chunks a deduplicating receiver is missing."""
+    CHUNK_SIZE:             int = 1024 * 1024
+
+    def __init__(self, writers: List[StreamWriter], cipher: ChunkCipher, cancel_event: Event, workers: WorkerPool, compression: str | None = None,
+                 shaper: TransferShaper | None = None) -> None:
+        self._writers = writers
+        self._cipher = cipher
+        self._cancel_event = cancel_event
+        self._workers = workers
+        self._compression = compression
+        self._shaper = shaper           # Shared by the stripes, they are one send
+        for writer in writers:
+            writer.transport.set_write_buffer_limits(high= FileSender.HIGH_WATER, low= FileSender.LOW_WATER)
+
+    async def send(self, file_path: str, size: int, on_progress: Callable[[TransferStats], None] | None = None, offset: int = 0,
+                   chunks: List[int] | None = None) -> TransferStats:
+        """Sends every chunk from offset on, or only the given chunk indexes of the whole file.
+        offset must be a multiple of CHUNK_SIZE, the receiver places every chunk by its index."""
+        if chunks == None:
+            ranges = [(index * self.CHUNK_SIZE, index) for index in range(offset // self.CHUNK_SIZE, -(-size // self.CHUNK_SIZE))]
+        else:
+            ranges = [(index * self.CHUNK_SIZE, index) for index in chunks]
+            offset = size - sum(min(self.CHUNK_SIZE, size - position) for position, _ in ranges)
+        stats = TransferStats(size= size, transferred= offset, resumed_from= offset, chunk_size= self.CHUNK_SIZE, started= perf_counter(),
+                              compression= self._compression)
+        if stats.compression != None:
+            with open(file_path, 'rb') as file:
+                sample = await self._workers.run_io(read_at, file, offset, SAMPLE_SIZE)
+            if not await self._workers.run_cpu(is_compressible, stats.compression, sample):
+                stats.compression = None
+        stripe_count = len(self._writers)
+        await gather(*[self._send_stripe(writer, file_path, ranges[index::stripe_count], stats, on_progress) for index, writer in enumerate(self._writers)])
+        stats.finished = perf_counter()
+        return stats
+
+    async def _send_stripe(self, writer: StreamWriter, file_path: str, ranges: List[Tuple[int, int]], stats: TransferStats, on_progress: Callable[[TransferStats], None] | None) -> None:
+        with open(file_path, 'rb') as file:
+            for position, chunk_index in ranges:
+                if self._cancel_event.is_set():
+                    break
+                chunk = await self._workers.run_io(read_at, file, position, self.CHUNK_SIZE)
+                token, flags, cpu_time = await self._workers.run_cpu(pack_chunk, stats.compression, self._cipher.mode, self._cipher.key, self._cipher.nonce_for(chunk_index), chunk)
+                if self._shaper != None:
+                    await self._shaper.wait(len(token), self._cancel_event)
+                write_frame(writer, FrameTypes.FILE_RANGE, FILE_RANGE_HEADER.pack(position, chunk_index) + token, flags)
+                await writer.drain()
+                stats.transferred += len(chunk)
+                stats.wire_bytes += len(token)
+                stats.compression_time += cpu_time
+                if on_progress != None:
+                    on_progress(stats)
+
+class StripedReceive:
+    """Incoming striped or deduplicated file shared by its data connections, each writes its ranges in place.
+    Ranges arriving on the file socket itself go through feed_range. A range must sit where its chunk index,
+    which is also its nonce, puts it and arrive only once; the first one that doesn't fails the transfer.
+    Ranges of the present chunks, already in place by a resumed prefix or deduplication, are skipped uncounted."""
+    def __init__(self, transfer_id: str, file_path: str, cipher: ChunkCipher, workers: WorkerPool, stats: TransferStats,
+                 stripes: int, journal: TransferJournal | None = None, on_progress: Callable[[TransferStats], None] | None = None,
+                 present: Set[int] | None = None) -> None:
+        self.transfer_id = transfer_id
+        self.file_path = file_path
+        self.stats = stats
+        self.done = Event()                     # Set once every data connection has ended
+        self._cipher = cipher
+        self._workers = workers
+        self._stripes = stripes
+        self._journal = journal
+        self._on_progress = on_progress
+        self._finished = 0
+        self._file: BinaryIO | None = None      # Handle of the ranges fed from the file socket
+        self._received: Set[int] = set()        # Chunk indexes written so far
+        self._present: Set[int] = present or set()
+        self.error: FrameError | None = None    # The first bad range, the transfer can't complete once set
+
+    def _write(self, file: BinaryIO, offset: int, chunk: bytes) -> None:
+        write_at(file, offset, chunk)
+        if self._journal != None:
+            self._journal.record(offset, chunk)
+
+    async def _write_range(self, file: BinaryIO, frame: Frame) -> None:
+        offset, counter = FILE_RANGE_HEADER.unpack_from(frame.payload)
+        if offset != counter * StripedFileSender.CHUNK_SIZE or offset >= self.stats.size or counter in self._received:
+            self.error = FrameError(f'Range of chunk {counter} at {offset} doesn\'t belong to the file!')
+            raise self.error
+        if counter in self._present:
+            return
+        token = frame.payload[FILE_RANGE_HEADER.size:]
+        chunk, cpu_time = await self._workers.run_cpu(unpack_chunk, self.stats.compression, self._cipher.mode, self._cipher.key, self._cipher.nonce_for(counter), token, frame.flags)
+        if len(chunk) != min(StripedFileSender.CHUNK_SIZE, self.stats.size - offset) or counter in self._received:
+            self.error = FrameError(f'Chunk {counter} has {len(chunk)} bytes, or arrived twice!')
+            raise self.error
+        self._received.add(counter)
+        await self._workers.run_io(self._write, file, offset, chunk)
+        self.stats.transferred += len(chunk)
+        self.stats.wire_bytes += len(token)
+        self.stats.compression_time += cpu_time
+        if self._on_progress != None:
+            self._on_progress(self.stats)
+
+    async def feed_range(self, frame: Frame) -> None:
+        if self._file == None:
+            self._file = await self._workers.run_io(open, self.file_path, 'r+b', 0)
+        await self._write_range(self._file, frame)
+
+    def expect(self, stripes: int) -> None:
+        """Data connections the sender managed to open, once it has ended; done is set when as many have ended."""
+        self._stripes = stripes
+        if self._finished >= self._stripes:
+            self.done.set()
+
+    def close(self) -> None:
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+    async def receive(self, reader: StreamReader) -> None:
+        """Runs one data connection until the sender closes it."""
+        file = await self._workers.run_io(open, self.file_path, 'r+b', 0)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame.type == FrameTypes.FILE_RANGE:
+                    await self._write_range(file, frame)
+        except IncompleteReadError:
+            pass # Sender closed the connection, its stripe is done
+        finally:
+            file.close()
+            self._finished += 1
+            if self._finished >= self._stripes:
+                self.done.set()
@@ -1,21 +1,68 @@
 from peerconn_models import ( PeerData, PeerSocket)
-from asyncio import (AbstractEventLoop, Event, Queue)
-from typing import (List)
+from peerconn_workers import (WorkerPool, WorkerKinds)
+from peerconn_dedup import (ContentIndex, CHUNK_SIZE as DEDUP_CHUNK_SIZE)
+from peerconn_registry import (PeerSocketRegistry)
+from peerconn_history import (HistoryDatabase)
+from peerconn_events import (EventPublisher)
+from peerconn_shaping import (FairScheduler)
+from asyncio import (AbstractEventLoop, Event, Queue, Task)
+from threading import (local)
+from typing import (List, Set)
 from logging import (Logger)
 from os import (path)
 from sys import (argv as sys_argv)
 
 class Variables:
     """Basis variables defined for PeerConn."""
-    _peersockets:       List[PeerSocket] | None     # PeerSocket list to store and manage multiple connections
+    _peersockets:     PeerSocketRegistry | None     # PeerSockets of the multiple connections, indexed by id, role and state
     _peerdata:                  PeerData | None     # User's PeerData
-    _SLEEP_TIME:                    float = 0.1     # Sleep time constant for async functions 
     _logger:                      Logger | None     # Logger object for logging transactions
     _loop:             AbstractEventLoop | None     # Async loop object
     _command_event:                Event | None     # Event object for thread_main function
     _command_queue:                Queue | None     # Queue to store and run commands
+    _batch_local:                  local | None     # Commands of the batch() a thread is in, if any
+    _events:              EventPublisher | None     # Tells subscribers like the GUI what changed, instead of being polled
+    _workers:                 WorkerPool | None     # Executors for chunk crypto and disk I/O
+    _content_index:         ContentIndex | None = None              # Chunk hashes of the downloads directory, built on first use
+    _content_refresh:               Task | None = None              # Background ContentIndex.refresh() of it
+    _history_database:   HistoryDatabase | None = None              # Scratch SQLite file the message histories spill into, removed on exit
+    _uplink:               FairScheduler | None = None              # Shares the global upload rate limit between the peersockets' file sends
+    _part_paths:                     Set[str] = set()               # .part files being received into, shared by every PeerConn like the downloads directory
+    _WORKER_KIND:                     str = WorkerKinds.THREAD      # 'thread' or 'process', from the configuration file
+    _WORKER_COUNT:             int | None = None                    # Workers per pool, None lets the executor decide
+    _TRUSTED_LINK:                   bool = False                   # Allows plaintext file transfers the sender hands to sendfile when the peer allows them too
+    _ENCRYPT_FILES:                  bool = True                    # On a trusted link, False sends every file in plaintext
+    _PRE_ENCRYPTED_EXTENSIONS:  List[str] = ['.gpg', '.pgp', '.age', '.enc', '.aes', '.kdbx']  # Already encrypted at rest, sent in plaintext on a trusted link
+    _FILE_REPLY_TIMEOUT:            float = 5.0                     # Seconds a hello or the stripes may take, and between the sender's checks while it waits for the resume offset
+    _JOURNAL_MIN_SIZE:                int = 8 * 1024 * 1024         # Smaller files are received without a journal and start over when interrupted
+    _FILE_STREAMS:                    int = 1                       # Data connections a single file may be striped across, 1 disables striping
+    _STRIPE_MIN_SIZE:                 int = 8 * 1024 * 1024         # Smaller files aren't worth the extra connections
+    _COMPRESSION:                    bool = True                    # Offers zstd (when installed) or zlib on both channels
+    _MESSAGE_COMPRESSION_MIN:         int = 512                     # Smaller message packets are sent as they are
+    _MESSAGE_BATCH_DELAY:           float = 0.002                   # Seconds a message may wait to share a frame with the next ones, 0 disables batching
+    _MESSAGE_BATCH_BYTES:             int = 64 * 1024               # A batch this large is flushed without waiting
+    _MESSAGE_BATCH_COUNT:             int = 256                     # So is a batch of this many messages
+    _HISTORY_RING_SIZE:               int = 1000                    # Most recent messages of a peersocket kept in memory
+    _HISTORY_FLUSH_SIZE:              int = 256                     # Messages written to the history database at once
+    _DEDUP:                          bool = False                   # Sends chunk hashes first and only the chunks the peer doesn't have
+    _DEDUP_MIN_SIZE:                  int = 4 * DEDUP_CHUNK_SIZE    # Smaller files aren't worth hashing twice
+    _MULTIPLEX:                      bool = True                    # Clients carry messages and files as two streams of one connection to the message port
+    _CONNECT_TIMEOUT:               float = 5.0                     # Seconds a connection attempt may take
+    _RECONNECT:                      bool = True                    # Client peersockets reconnect on their own when the link drops
+    _RECONNECT_BASE_DELAY:          float = 0.5                     # Backoff ceiling of the first attempt, doubled by every failed one...
+    _RECONNECT_MAX_DELAY:           float = 30.0                    # ...up to this; the wait is drawn at random below the ceiling
+    _RECONNECT_ATTEMPTS:              int = 10                      # Failed attempts in a row before giving up
+    _RESUME_WINDOW:                 float = 60.0                    # Seconds a server keeps a dropped session for its client to resume
+    _OUTBOX_SIZE:                     int = 256                     # Messages kept while the link is down, the oldest are dropped first
+    _HEARTBEAT_INTERVAL:            float = 5.0                     # Seconds between heartbeats on the message channel, 0 disables them
+    _HEARTBEAT_MISSES:                int = 3                       # Silent intervals after which the peer is taken for dead
+    _TCP_KEEPALIVE:                  bool = True                    # Lets the OS probe idle connections too
+    _TCP_KEEPALIVE_IDLE:              int = 30                      # Idle seconds before the first probe
+    _TCP_KEEPALIVE_INTERVAL:          int = 10                      # Seconds between unanswered probes
+    _TCP_KEEPALIVE_COUNT:             int = 3                       # Unanswered probes before the OS drops the connection
+    _UPLOAD_RATE:                   float = 0                       # Bytes per second all file sends together may take, 0 is unlimited
+    _PEERSOCKET_UPLOAD_RATE:        float = 0                       # ...and the file sends of a single peersocket, unless set_rate_limit() changed it
     log_filename:                     str = 'last.log'
-    _file_delimiter:               bytes | None = b'PEERCONN_DELIMETER'             # Delimiter for uploading file with its info, in binary > [file_info, delimiter, file]
     _BASE_PATH:                       str = path.abspath(path.dirname(sys_argv[0])) # Path of the PeerConn
     _DOWNLOADS_DIR:                str = path.join(_BASE_PATH, 'downloads')         # Download directory path
     _config_path:                     str = path.join(_BASE_PATH, 'config.json')    # Path of the configuration json file for user preferences like custom host name and custom downloads directory
\ No newline at end of file
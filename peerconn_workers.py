@@ -0,0 +1,33 @@
+from asyncio import (get_running_loop)
+from concurrent.futures import (Executor, ThreadPoolExecutor, ProcessPoolExecutor)
+from multiprocessing import (get_context)
+from typing import (Any, Callable)
+
+class WorkerKinds:
+    THREAD:     str = 'thread'      # Crypto releases the GIL inside OpenSSL, cheapest to start
+    PROCESS:    str = 'process'     # Sidesteps the GIL entirely, pays for pickling every chunk
+
+class WorkerPool:
+    """Runs chunk crypto on a configurable executor and disk I/O on a thread pool, off the event loop.
+    Callers keep chunk order by awaiting the returned awaitables in submission order."""
+    def __init__(self, kind: str = WorkerKinds.THREAD, max_workers: int | None = None) -> None:
+        self.kind = kind
+        self.max_workers = max_workers
+        self._io_executor: Executor = ThreadPoolExecutor(max_workers= max_workers, thread_name_prefix= 'peerconn_io')
+        if kind == WorkerKinds.PROCESS:
+            # Spawned, not forked: a forked worker would inherit the open sockets and keep them alive after we close them
+            self._cpu_executor: Executor = ProcessPoolExecutor(max_workers= max_workers, mp_context= get_context('spawn'))
+        else:
+            self._cpu_executor: Executor = self._io_executor
+
+    async def run_cpu(self, fn: Callable, *args) -> Any:
+        """fn and args must be picklable when the pool is a process pool."""
+        return await get_running_loop().run_in_executor(self._cpu_executor, fn, *args)
+
+    async def run_io(self, fn: Callable, *args) -> Any:
+        return await get_running_loop().run_in_executor(self._io_executor, fn, *args)
+
+    def shutdown(self) -> None:
+        self._io_executor.shutdown(wait= False, cancel_futures= True)
+        if self._cpu_executor is not self._io_executor:
+            self._cpu_executor.shutdown(wait= False, cancel_futures= True)
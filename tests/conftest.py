@@ -0,0 +1,3 @@
+from sys import (path as sys_path)
+from os import (path)
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__)))) # The modules live flat in the repository root
@@ -0,0 +1,67 @@
+from datetime import (datetime)
+
+import pytest
+
+from peerconn_models import (PeerData, Message, MessageTypes, FileData, ManifestEntry, FileResume, PeerPacket)
+from peerconn_codec import (CODEC_VERSION, MAX_DEPTH, CodecError, decode, encode, encode_list)
+
+VALUES = [
+    None, True, False, 0, 127, 128, -1, (1 << 63) - 1, -(1 << 63), 1.5, '', 'short', 'x' * 100, 'ünïcode',
+    b'', b'\x00\xff' * 40, [], list(range(20)), [[1, [2, [3]]], 'a', None], datetime(2024, 5, 1, 12, 30, 15),
+]
+
+@pytest.mark.parametrize('value', VALUES)
+def test_round_trip(value):
+    assert decode(encode(value)) == value
+
+def test_round_trip_dataclasses():
+    sender = PeerData(name= 'workstation-01', local_address= '192.168.1.20', msg_port= 50001, file_port= 50002)
+    packet = PeerPacket(sender= sender, target= ['192.168.1.21', 50001], message= Message(sender.name, 'hi', 1700000000.5, MessageTypes.ME))
+    file_data = FileData(name= 'logs', extension= '', size= 8192, nonce_prefix= b'12345678',
+                         manifest= [ManifestEntry('logs/a.log', 4096, 'a' * 64), ManifestEntry('logs/b.log', 4096, 'b' * 64)])
+    for value in (packet, file_data, FileResume('id', 1048576, [1, 3])):
+        assert decode(encode(value)) == value
+
+def test_tuples_decode_as_lists():
+    assert decode(encode(('a', 1))) == ['a', 1]
+
+def test_zero_copy_bytes_are_views():
+    encoded = encode([b'payload'])
+    decoded = decode(encoded, zero_copy= True)[0]
+    assert isinstance(decoded, memoryview) and decoded.tobytes() == b'payload'
+
+def test_encode_list_matches_encode():
+    values = [Message('a', str(index), float(index), MessageTypes.ME) for index in range(20)]
+    assert encode_list([encode(value) for value in values]) == encode(values)
+
+def test_missing_fields_get_defaults():
+    encoded = bytearray(encode(FileResume('id', 5, [1])))
+    encoded[4] = 1 # Field count of a peer that only knew transfer_id
+    assert decode(bytes(encoded[:encoded.index(b'id') + 2])) == FileResume('id')
+
+def test_every_truncation_is_rejected():
+    encoded = encode(PeerPacket(sender= PeerData(name= 'peer'), message= Message('peer', 'hello', 1.0, MessageTypes.ME)))
+    for length in range(len(encoded)):
+        with pytest.raises(CodecError):
+            decode(encoded[:length])
+
+def test_trailing_bytes_are_rejected():
+    with pytest.raises(CodecError):
+        decode(encode('value') + b'\x00')
+
+def test_nesting_is_limited():
+    assert decode(bytes([CODEC_VERSION]) + b'\x91' * (MAX_DEPTH - 1) + b'\x90') is not None
+    with pytest.raises(CodecError):
+        decode(bytes([CODEC_VERSION]) + b'\x91' * MAX_DEPTH + b'\x90')
+    with pytest.raises(CodecError):
+        decode(bytes([CODEC_VERSION]) + b'\x91' * 100000 + b'\x90') # Far past the recursion limit
+
+@pytest.mark.parametrize('data', [b'', bytes([CODEC_VERSION + 1, 0]), bytes([CODEC_VERSION, 0xC1]), bytes([CODEC_VERSION, 0xC7, 250, 1, 0])])
+def test_bad_bytes_are_rejected(data):
+    with pytest.raises(CodecError):
+        decode(data)
+
+@pytest.mark.parametrize('value', [1 << 63, -(1 << 63) - 1, object(), {'a': 1}])
+def test_unencodable_values_are_rejected(value):
+    with pytest.raises(CodecError):
+        encode(value)
@@ -0,0 +1,79 @@
+from asyncio import (IncompleteReadError, StreamReader, TimeoutError, run)
+from typing import (Iterable, List)
+
+import pytest
+
+from peerconn_models import (FrameTypes)
+from peerconn_framing import (FRAME_HEADER, FRAME_VERSION, MAX_FRAME_SIZE, FrameError, encode_header, read_frame, read_frame_header,
+                              write_frame, write_frames)
+
+class BufferWriter:
+    """Collects what write_frame() writes, in place of a StreamWriter."""
+    def __init__(self) -> None:
+        self.buffers: List[bytes] = []
+
+    def writelines(self, buffers: Iterable[bytes]) -> None:
+        self.buffers.extend(bytes(buffer) for buffer in buffers)
+
+    def data(self) -> bytes:
+        return b''.join(self.buffers)
+
+def read_all(data: bytes, count: int, eof: bool = True) -> list:
+    async def read() -> list:
+        reader = StreamReader()
+        reader.feed_data(data)
+        if eof:
+            reader.feed_eof()
+        return [await read_frame(reader, timeout= 1) for _ in range(count)]
+    return run(read())
+
+def test_round_trip():
+    writer = BufferWriter()
+    write_frame(writer, FrameTypes.MESSAGE, b'hello', flags= 3)
+    write_frame(writer, FrameTypes.FILE_END)
+    frames = read_all(writer.data(), 2)
+    assert (frames[0].type, frames[0].flags, frames[0].length, frames[0].payload) == (FrameTypes.MESSAGE, 3, 5, b'hello')
+    assert (frames[1].type, frames[1].length, frames[1].payload) == (FrameTypes.FILE_END, 0, b'')
+
+def test_pipelined_frames_split_across_reads():
+    writer = BufferWriter()
+    payloads = [bytes([index]) * index * 100 for index in range(1, 20)]
+    write_frames(writer, [(FrameTypes.FILE_CHUNK, payload) for payload in payloads])
+
+    async def read() -> list:
+        reader = StreamReader()
+        data = writer.data()
+        for start in range(0, len(data), 7): # Headers and payloads cut at arbitrary points
+            reader.feed_data(data[start:start + 7])
+        reader.feed_eof()
+        return [await read_frame(reader) for _ in payloads]
+    assert [frame.payload for frame in run(read())] == payloads
+
+def test_truncated_payload_raises():
+    writer = BufferWriter()
+    write_frame(writer, FrameTypes.MESSAGE, b'x' * 100)
+    with pytest.raises(IncompleteReadError):
+        read_all(writer.data()[:-1], 1)
+
+def test_truncated_header_raises():
+    with pytest.raises(IncompleteReadError):
+        read_all(encode_header(FrameTypes.MESSAGE, 0)[:-1], 1)
+
+def test_missing_header_times_out():
+    with pytest.raises(TimeoutError):
+        read_all(b'', 1, eof= False)
+
+def test_unknown_version_is_rejected():
+    with pytest.raises(FrameError):
+        read_all(FRAME_HEADER.pack(FRAME_VERSION + 1, FrameTypes.MESSAGE, 0, 0), 1)
+
+def test_oversized_frame_is_rejected():
+    with pytest.raises(FrameError):
+        encode_header(FrameTypes.FILE_CHUNK, MAX_FRAME_SIZE + 1)
+
+    async def read() -> None:
+        reader = StreamReader()
+        reader.feed_data(FRAME_HEADER.pack(FRAME_VERSION, FrameTypes.FILE_CHUNK, 0, MAX_FRAME_SIZE + 1))
+        await read_frame_header(reader)
+    with pytest.raises(FrameError):
+        run(read())
@@ -0,0 +1,86 @@
+from json import (dumps as json_dumps)
+from os import (urandom)
+
+from peerconn_journal import (TransferJournal)
+
+CHUNK: int = 64 * 1024
+
+def receive(tmp_path, data: bytes, chunks: int, transfer_id: str = 'transfer', order: list | None = None) -> TransferJournal:
+    """Writes the first chunks of data into a part file the way a receive does, then closes the journal as an interruption would."""
+    part_path = str(tmp_path / 'file.bin.part')
+    journal = TransferJournal(part_path)
+    journal.start(transfer_id, len(data))
+    with open(part_path, 'wb') as part:
+        part.truncate(len(data))
+        for index in (order if order != None else range(chunks)):
+            part.seek(index * CHUNK)
+            part.write(data[index * CHUNK:(index + 1) * CHUNK])
+            journal.record(index * CHUNK, data[index * CHUNK:(index + 1) * CHUNK])
+    journal.close()
+    return TransferJournal(part_path)
+
+def test_resumes_after_the_written_prefix(tmp_path):
+    data = urandom(10 * CHUNK)
+    assert receive(tmp_path, data, 4).resume_offset('transfer', len(data)) == 4 * CHUNK
+
+def test_out_of_order_chunks_resume_after_the_contiguous_prefix(tmp_path):
+    data = urandom(10 * CHUNK)
+    assert receive(tmp_path, data, 0, order= [2, 0, 5, 1]).resume_offset('transfer', len(data)) == 3 * CHUNK
+
+def test_resumed_journal_continues(tmp_path):
+    data = urandom(10 * CHUNK)
+    journal = receive(tmp_path, data, 4)
+    offset = journal.resume_offset('transfer', len(data))
+    journal.start('transfer', len(data))
+    with open(journal.file_path, 'r+b') as part:
+        part.seek(offset)
+        part.write(data[offset:])
+    journal.record(offset, data[offset:])
+    journal.close()
+    assert TransferJournal(journal.file_path).resume_offset('transfer', len(data)) == len(data)
+    with open(journal.file_path, 'rb') as part:
+        assert part.read() == data
+
+def test_changed_bytes_end_the_prefix(tmp_path):
+    data = urandom(10 * CHUNK)
+    journal = receive(tmp_path, data, 6)
+    with open(journal.file_path, 'r+b') as part:
+        part.seek(3 * CHUNK + 10)
+        part.write(b'\x00' * 4)
+    assert journal.resume_offset('transfer', len(data)) == 3 * CHUNK
+
+def test_other_transfer_starts_over(tmp_path):
+    data = urandom(4 * CHUNK)
+    journal = receive(tmp_path, data, 4)
+    assert journal.resume_offset('other', len(data)) == 0
+    assert journal.resume_offset('transfer', len(data) + 1) == 0
+    assert journal.resume_offset(None, len(data)) == 0
+
+def test_entries_past_the_size_invalidate_the_journal(tmp_path):
+    data = urandom(4 * CHUNK)
+    journal = receive(tmp_path, data, 4)
+    with open(journal.file_path, 'ab') as part:
+        part.write(urandom(CHUNK)) # An earlier attempt wrote past the end of the file
+    with open(journal.journal_path, 'a', encoding= 'utf-8') as lines:
+        lines.write(json_dumps({'offset': 4 * CHUNK, 'length': CHUNK, 'sha256': '0' * 64}) + '\n')
+    assert journal.resume_offset('transfer', len(data)) == 0
+
+def test_malformed_entries_invalidate_the_journal(tmp_path):
+    data = urandom(4 * CHUNK)
+    journal = receive(tmp_path, data, 2)
+    with open(journal.journal_path, 'a', encoding= 'utf-8') as lines:
+        lines.write(json_dumps({'offset': 'x', 'length': CHUNK, 'sha256': '0' * 64}) + '\n')
+    assert journal.resume_offset('transfer', len(data)) == 0
+
+def test_torn_last_line_keeps_the_rest(tmp_path):
+    data = urandom(4 * CHUNK)
+    journal = receive(tmp_path, data, 3)
+    with open(journal.journal_path, 'a', encoding= 'utf-8') as lines:
+        lines.write('{"offset": 196608, "len')
+    assert journal.resume_offset('transfer', len(data)) == 3 * CHUNK
+
+def test_remove_deletes_the_journal(tmp_path):
+    data = urandom(2 * CHUNK)
+    journal = receive(tmp_path, data, 2)
+    journal.remove()
+    assert journal.resume_offset('transfer', len(data)) == 0